@@ -1200,10 +1200,8 @@ class _HistBase(Plottable, NamedObject):
             except ImportError:
                 from root_numpy import fill_array as fill_func
         except ImportError:
-            log.critical(
-                "root_numpy is needed for Hist*.fill_array. "
-                "Is it installed and importable?")
-            raise
+            # fill the histogram in compiled code without root_numpy
+            from ..tree.booking import fill_hist as fill_func
         fill_func(self, array, weights=weights)
 
     def fill_view(self, view):
@@ -8,8 +8,12 @@ from __future__ import absolute_import
 
 import os
 import sys
+import json
+import tempfile
 import warnings
+import multiprocessing
 import pkg_resources
+from collections import deque
 
 import tables
 TABLES_NEW_API = int(pkg_resources.parse_version(tables.__version__)[0]) >= 3
@@ -18,8 +22,18 @@ if TABLES_NEW_API:
 else:
     tables_open = tables.openFile
 
-from root_numpy import tree2rec, RootNumpyUnconvertibleWarning
 from numpy.lib import recfunctions
+try:
+    from root_numpy import tree2rec, RootNumpyUnconvertibleWarning
+except ImportError:
+    import numpy as np
+    from .tree.fastio import read_tree
+
+    class RootNumpyUnconvertibleWarning(RuntimeWarning):
+        pass
+
+    def tree2rec(*args, **kwargs):
+        return read_tree(*args, **kwargs).view(np.recarray)
 
 from .io import root_open, TemporaryFile
 from . import log; log = log[__name__]
@@ -52,9 +66,17 @@ def _drop_object_col(rec, warn=True):
     return rec
 
 
+def _create_table(hfile, group, name, recarray, title, chunkshape=None):
+    if TABLES_NEW_API:
+        return hfile.create_table(
+            group, name, recarray, title, chunkshape=chunkshape)
+    return hfile.createTable(
+        group, name, recarray, title, chunkshape=chunkshape)
+
+
 def tree2hdf5(tree, hfile, group=None,
               entries=-1, selection=None,
-              show_progress=False):
+              show_progress=False, chunkshape=None):
     """
     Convert a TTree into a HDF5 table.
 
@@ -83,6 +105,10 @@ def tree2hdf5(tree, hfile, group=None,
         If True, then display and update a progress bar on stdout as the TTree
         is converted.
 
+    chunkshape : int, optional (default=None)
+        The number of rows in each HDF5 chunk of the table. By default
+        PyTables computes it from the expected size of the table.
+
     """
     show_progress = show_progress and check_tty(sys.stdout)
     if show_progress:
@@ -125,14 +151,9 @@ def tree2hdf5(tree, hfile, group=None,
             pbar.start()
         recarray = tree2rec(tree, selection=selection)
         recarray = _drop_object_col(recarray)
-        if TABLES_NEW_API:
-            table = hfile.create_table(
-                group, tree.GetName(),
-                recarray, tree.GetTitle())
-        else:
-            table = hfile.createTable(
-                group, tree.GetName(),
-                recarray, tree.GetTitle())
+        table = _create_table(
+            hfile, group, tree.GetName(),
+            recarray, tree.GetTitle(), chunkshape=chunkshape)
         # flush data in the table
         table.flush()
         # flush all pending data
@@ -166,14 +187,9 @@ def tree2hdf5(tree, hfile, group=None,
                 if pbar is not None:
                     # start after any output from root_numpy
                     pbar.start()
-                if TABLES_NEW_API:
-                    table = hfile.create_table(
-                        group, tree.GetName(),
-                        recarray, tree.GetTitle())
-                else:
-                    table = hfile.createTable(
-                        group, tree.GetName(),
-                        recarray, tree.GetTitle())
+                table = _create_table(
+                    hfile, group, tree.GetName(),
+                    recarray, tree.GetTitle(), chunkshape=chunkshape)
             start += entries
             if start <= total_entries and pbar is not None:
                 pbar.update(start)
@@ -189,11 +205,215 @@ def tree2hdf5(tree, hfile, group=None,
         hfile.close()
 
 
+# open input files of each worker process
+_WORKER_FILES = {}
+
+
+def _read_chunk(args):
+    """
+    Read a range of entries of a tree into a record array
+    """
+    filename, treepath, selection, start, stop = args
+    rfile = _WORKER_FILES.get(filename)
+    if rfile is None:
+        rfile = _WORKER_FILES[filename] = root_open(filename)
+    tree = rfile.Get(treepath)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RootNumpyUnconvertibleWarning)
+        recarray = tree2rec(tree, selection=selection,
+                            start=start, stop=stop)
+    tree.Delete()
+    return recarray
+
+
+def _ordered_results(func, tasks, workers):
+    """
+    Yield the results of a function applied to each task in the order of the
+    tasks. With more than one worker the tasks are evaluated in a pool of
+    processes at most two tasks per worker ahead of the consumer so that the
+    number of results held in memory is bounded.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    tasks = iter(tasks)
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(func, (task,)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().get()
+            for task in tasks:
+                pending.append(pool.apply_async(func, (task,)))
+                break
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _load_journal(path, inputname):
+    if path is None or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except (IOError, ValueError):
+        log.warning("ignoring unreadable journal {0}".format(path))
+        return {}
+    if content.get('input') != inputname:
+        log.warning("ignoring journal {0} of another input {1}".format(
+            path, content.get('input')))
+        return {}
+    return content.get('tables', {})
+
+
+def _save_journal(path, inputname, tables):
+    dirname = os.path.dirname(os.path.abspath(path))
+    # write to a temporary file and rename so that a crash never leaves a
+    # partially written journal
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'input': inputname, 'tables': tables}, f,
+                  indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def _get_group(hfile, dirpath):
+    if not dirpath:
+        return hfile.root
+    where = '/' + dirpath.strip('/')
+    try:
+        if TABLES_NEW_API:
+            return hfile.get_node(where)
+        return hfile.getNode(where)
+    except tables.NoSuchNodeError:
+        pass
+    if TABLES_NEW_API:
+        return hfile.create_group(
+            os.path.dirname(where), os.path.basename(where),
+            createparents=True)
+    return hfile.createGroup(
+        os.path.dirname(where), os.path.basename(where))
+
+
+def _convert_parallel(rfile, hfile, rpath='',
+                      entries=-1, selection=None,
+                      show_progress=False,
+                      workers=1, journal=None,
+                      resume=False, chunkshape=None):
+    """
+    Convert all trees in a ROOT file by reading ranges of entries in a pool
+    of worker processes while the tables are written in order in this process.
+    The first entry of the next range of each table is recorded in a journal
+    after each range is written so that a conversion can be resumed.
+    """
+    show_progress = show_progress and check_tty(sys.stdout)
+    inputname = os.path.abspath(rfile.GetName())
+    journaled = _load_journal(journal, inputname) if resume else {}
+    # the tables and the ranges of entries that remain to be converted
+    plan = []
+    tasks = []
+    for dirpath, dirnames, treenames in rfile.walk(
+            rpath, class_pattern='TTree'):
+        if not treenames:
+            continue
+        group = _get_group(hfile, dirpath)
+        for treename in sorted(treenames):
+            treepath = os.path.join(dirpath, treename)
+            tablepath = '/' + treepath.strip('/')
+            tree = rfile.Get(treepath)
+            total = int(tree.GetEntries())
+            title = tree.GetTitle()
+            tree.Delete()
+            record = journaled.get(tablepath)
+            start = 0
+            if treename in group:
+                if record is None:
+                    log.warning(
+                        "Tree '{0}' already exists "
+                        "in the output file".format(tablepath))
+                    continue
+                table = getattr(group, treename)
+                if record['done']:
+                    log.info("Tree '{0}' is already converted".format(
+                        tablepath))
+                    continue
+                # discard rows appended after the last journal entry
+                if table.nrows > record['rows']:
+                    table.truncate(record['rows'])
+                start = record['next']
+            step = entries if entries > 0 else max(total, 1)
+            ranges = [(first, min(first + step, total))
+                      for first in range(start, total, step)]
+            if not ranges and start == 0:
+                # create an empty table
+                ranges = [(0, 0)]
+            if not ranges:
+                continue
+            plan.append((tablepath, group, treename, title, total, ranges))
+            for first, last in ranges:
+                tasks.append((inputname, treepath, selection, first, last))
+    tables_journal = dict(journaled)
+    results = _ordered_results(_read_chunk, tasks, workers)
+    try:
+        _write_tables(hfile, plan, results, show_progress, chunkshape,
+                      journal, inputname, tables_journal)
+    finally:
+        results.close()
+        # close the input files opened by a single worker in this process
+        for worker_file in _WORKER_FILES.values():
+            worker_file.Close()
+        _WORKER_FILES.clear()
+
+
+def _write_tables(hfile, plan, results, show_progress, chunkshape,
+                  journal, inputname, tables_journal):
+    """
+    Write the ranges of entries read by the workers into their tables
+    """
+    for tablepath, group, treename, title, total, ranges in plan:
+        log.info("Converting tree '{0}' with {1:d} entries ...".format(
+            tablepath, total))
+        pbar = None
+        if show_progress and total > 0:
+            pbar = ProgressBar(widgets=[Percentage(), ' ', Bar(), ' ', ETA()],
+                               maxval=total)
+            pbar.start()
+        for first, last in ranges:
+            recarray = next(results)
+            if treename in group:
+                table = getattr(group, treename)
+                table.append(_drop_object_col(recarray, warn=False))
+            else:
+                table = _create_table(
+                    hfile, group, treename, _drop_object_col(recarray),
+                    title, chunkshape=chunkshape)
+            table.flush()
+            hfile.flush()
+            tables_journal[tablepath] = {
+                'next': last,
+                'rows': int(table.nrows),
+                'done': last >= total}
+            if journal is not None:
+                _save_journal(journal, inputname, tables_journal)
+            if pbar is not None:
+                pbar.update(last)
+        if pbar is not None:
+            pbar.finish()
+
+
 def root2hdf5(rfile, hfile, rpath='',
               entries=-1, userfunc=None,
               selection=None,
               show_progress=False,
-              ignore_exception=False):
+              ignore_exception=False,
+              workers=1, journal=None,
+              resume=False, chunkshape=None):
     """
     Convert all trees in a ROOT file into tables in an HDF5 file.
 
@@ -232,6 +452,29 @@ def root2hdf5(rfile, hfile, rpath='',
         If True, then ignore exceptions raised in converting trees and instead
         skip such trees.
 
+    workers : int, optional (default=1)
+        The number of processes reading ranges of ``entries`` entries of the
+        trees in parallel. The tables are written in order by this process.
+
+    journal : string, optional (default=None)
+        The path to a journal in which the progress of the conversion is
+        recorded after each range of entries is written.
+
+    resume : bool, optional (default=False)
+        If True, then continue the conversion recorded in the ``journal``
+        into the existing HDF5 file: completed tables are skipped and the
+        others are continued from their last completed range of entries.
+
+    chunkshape : int, optional (default=None)
+        The number of rows in each HDF5 chunk of the tables. By default
+        PyTables computes it from the expected size of each table.
+
+    Notes
+    -----
+    The ``userfunc`` and ``ignore_exception`` options are only supported
+    with a single worker and without a journal, otherwise a ValueError is
+    raised.
+
     """
     own_rootfile = False
     if isinstance(rfile, string_types):
@@ -240,9 +483,32 @@ def root2hdf5(rfile, hfile, rpath='',
 
     own_h5file = False
     if isinstance(hfile, string_types):
-        hfile = tables_open(filename=hfile, mode="w", title="Data")
+        hfile = tables_open(filename=hfile, mode="a" if resume else "w",
+                            title="Data")
         own_h5file = True
 
+    if workers > 1 or journal is not None:
+        if userfunc is not None:
+            raise ValueError(
+                "a user function cannot be used with "
+                "multiple workers or a journal")
+        if ignore_exception:
+            raise ValueError(
+                "exceptions cannot be ignored with "
+                "multiple workers or a journal")
+        _convert_parallel(rfile, hfile, rpath=rpath,
+                          entries=entries, selection=selection,
+                          show_progress=show_progress,
+                          workers=workers, journal=journal,
+                          resume=resume, chunkshape=chunkshape)
+        if journal is not None and os.path.exists(journal):
+            os.unlink(journal)
+        if own_h5file:
+            hfile.close()
+        if own_rootfile:
+            rfile.Close()
+        return
+
     for dirpath, dirnames, treenames in rfile.walk(
             rpath, class_pattern='TTree'):
 
@@ -291,7 +557,8 @@ def root2hdf5(rfile, hfile, rpath='',
                 try:
                     tree2hdf5(tree, hfile, group=group,
                               entries=entries, selection=selection,
-                              show_progress=show_progress)
+                              show_progress=show_progress,
+                              chunkshape=chunkshape)
                 except Exception as e:
                     if ignore_exception:
                         log.error("Failed to convert tree '{0}': {1}".format(
@@ -343,6 +610,21 @@ def main():
     parser.add_argument('-l', '--complib', default='zlib',
                         choices=('zlib', 'lzo', 'bzip2', 'blosc'),
                         help="compression algorithm")
+    parser.add_argument('--no-shuffle', action='store_true', default=False,
+                        help="do not apply the byte shuffle filter "
+                             "before compression")
+    parser.add_argument('--fletcher32', action='store_true', default=False,
+                        help="store Fletcher32 checksums of each chunk")
+    parser.add_argument('--chunkshape', type=int, default=None,
+                        help="number of rows in each HDF5 chunk "
+                             "(computed by PyTables by default)")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="number of processes reading the trees")
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="record the progress of the conversion in a \n"
+                             "journal and continue an interrupted conversion \n"
+                             "from the last range of entries recorded in its \n"
+                             "journal (the journal is also written with -j)")
     parser.add_argument('-s', '--selection', default=None,
                         help="apply a selection on each "
                              "tree with a cut expression")
@@ -401,10 +683,19 @@ def main():
                 "Could not find the function '{0}' in the script {1}".format(
                     funcname, args.script))
 
+    # the journal is only written by the parallel conversion
+    use_journal = args.workers > 1 or args.resume
+    if use_journal and userfunc is not None:
+        parser.error("--script cannot be used with -j or --resume")
+    if use_journal and args.ignore_exception:
+        parser.error("--ignore-exception cannot be used with -j or --resume")
+
     for inputname in args.files:
         outputname = os.path.splitext(inputname)[0] + '.' + args.ext
+        journal = outputname + '.journal'
         output_exists = os.path.exists(outputname)
-        if output_exists and not (args.force or args.update):
+        resume = args.resume and output_exists
+        if output_exists and not (args.force or args.update or resume):
             sys.exit(
                 "Output {0} already exists. "
                 "Use the --force option to overwrite it".format(outputname))
@@ -413,13 +704,15 @@ def main():
         except IOError:
             sys.exit("Could not open {0}".format(inputname))
         try:
-            if args.complevel > 0:
+            if args.complevel > 0 or args.fletcher32:
                 filters = tables.Filters(complib=args.complib,
-                                         complevel=args.complevel)
+                                         complevel=args.complevel,
+                                         shuffle=not args.no_shuffle,
+                                         fletcher32=args.fletcher32)
             else:
                 filters = None
             hd5file = tables_open(filename=outputname,
-                                  mode='a' if args.update else 'w',
+                                  mode='a' if args.update or resume else 'w',
                                   title='Data', filters=filters)
         except IOError:
             sys.exit("Could not create {0}".format(outputname))
@@ -430,7 +723,11 @@ def main():
                       userfunc=userfunc,
                       selection=args.selection,
                       show_progress=not args.no_progress_bar,
-                      ignore_exception=args.ignore_exception)
+                      ignore_exception=args.ignore_exception,
+                      workers=args.workers,
+                      journal=journal if use_journal else None,
+                      resume=resume,
+                      chunkshape=args.chunkshape)
             log.info("{0} {1}".format(
                 "Updated" if output_exists and args.update else "Created",
                 outputname))
@@ -438,7 +735,10 @@ def main():
             log.info("Caught Ctrl-c ... cleaning up")
             hd5file.close()
             rootfile.Close()
-            if not output_exists:
+            if os.path.exists(journal):
+                log.info("Use --resume to continue the conversion "
+                         "into {0}".format(outputname))
+            elif not output_exists:
                 log.info("Removing {0}".format(outputname))
                 os.unlink(outputname)
             sys.exit(1)
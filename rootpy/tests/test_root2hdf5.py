@@ -81,6 +81,39 @@ def test_root2hdf5_chunked_selected():
     hfile.close()
 
 
+@with_setup(setup_func, teardown_func)
+def test_root2hdf5_parallel_resume():
+
+    try:
+        import tables
+    except ImportError:
+        raise SkipTest
+
+    from rootpy.root2hdf5 import root2hdf5, _save_journal
+
+    rfile = get_file('test_tree.root')
+    hfilename = os.path.join(TEMPDIR, 'out.h5')
+    journal = os.path.join(TEMPDIR, 'out.h5.journal')
+    root2hdf5(rfile, hfilename, entries=100, workers=2, journal=journal)
+    # the journal is removed after a complete conversion
+    assert_equal(os.path.exists(journal), False)
+
+    hfile = tables.openFile(hfilename, 'a')
+    assert_equal(len(hfile.root.test), 1000)
+    expected = list(hfile.root.test.col('i'))
+    # simulate a crash after appending rows past the last journal entry
+    hfile.root.test.truncate(300)
+    hfile.close()
+    _save_journal(journal, os.path.abspath(rfile.GetName()),
+                  {'/test': {'next': 200, 'rows': 200, 'done': False}})
+
+    root2hdf5(rfile, hfilename, entries=100, workers=2,
+              journal=journal, resume=True)
+    hfile = tables.openFile(hfilename)
+    assert_equal(list(hfile.root.test.col('i')), expected)
+    hfile.close()
+
+
 if __name__ == "__main__":
     import nose
     nose.runmodule()
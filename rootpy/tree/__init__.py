@@ -24,6 +24,8 @@ from .model import TreeModel
 from .chain import TreeChain, TreeQueue
 from .cut import Cut
 from .categories import Categories
+from .frame import TreeFrame
+from .skim import skim
 
 __all__ = [
     'ObjectCol',
@@ -46,4 +48,6 @@ __all__ = [
     'TreeQueue',
     'Cut',
     'Categories',
+    'TreeFrame',
+    'skim',
 ]
@@ -0,0 +1,305 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements the booking of histograms that are filled together in
+a single loop over a Tree or TreeChain.
+"""
+from __future__ import absolute_import
+
+import re
+try:
+    from collections import OrderedDict
+except ImportError: # py 2.6
+    from ..extern.ordereddict import OrderedDict
+
+import ROOT
+
+from .cut import Cut
+
+__all__ = [
+    'Bookings',
+]
+
+
+class Chunk(OrderedDict):
+    """
+    The columns of a chunk of entries yielded by ``iterate``, mapping branch
+    names to arrays. ``n_entries`` is the number of entries in the chunk,
+    which is known even if no branches are read.
+    """
+    n_entries = 0
+
+    def copy(self):
+        chunk = Chunk(self)
+        chunk.n_entries = self.n_entries
+        return chunk
+
+
+def fill_hist(hist, values, weights=None):
+    """
+    Fill a histogram with an array of values of shape (n_entries, n_dims)
+    and optional per-entry weights
+    """
+    import numpy as np
+    values = np.asarray(values, dtype=np.double)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    if weights is not None:
+        weights = np.ascontiguousarray(weights, dtype=np.double)
+    try:
+        from root_numpy import fill_hist as root_numpy_fill_hist
+    except ImportError:
+        pass
+    else:
+        root_numpy_fill_hist(hist, values, weights=weights)
+        return
+    n_entries, n_dims = values.shape
+    if n_entries == 0:
+        return
+    if weights is None:
+        weights = np.ones(n_entries, dtype=np.double)
+    columns = [np.ascontiguousarray(values[:, i]) for i in range(n_dims)]
+    if n_dims == 1:
+        hist.FillN(n_entries, columns[0], weights)
+    elif n_dims == 2:
+        hist.FillN(n_entries, columns[0], columns[1], weights)
+    else:
+        # TH3 does not implement FillN
+        from .fastio import fill_hist as compiled_fill_hist
+        compiled_fill_hist(hist, values, weights)
+
+
+def _instances(arrays):
+    """
+    Flatten the values of the expressions of a booking over the instances of
+    each entry as TTreeFormula does: fixed-length arrays are truncated to the
+    shortest array and per-entry values are repeated for each instance.
+    All arrays must have the same number of entries.
+    """
+    import numpy as np
+    arrays = [np.asarray(array) for array in arrays]
+    arrays = [array.reshape(
+        (len(array), int(np.prod(array.shape[1:], dtype=np.int64))))
+        for array in arrays]
+    lengths = [array.shape[1] for array in arrays if array.shape[1] != 1]
+    if not lengths:
+        return [array[:, 0] for array in arrays]
+    length = min(lengths)
+    return [np.repeat(array[:, 0], length) if array.shape[1] == 1
+            else array[:, :length].ravel() for array in arrays]
+
+
+class Booking(object):
+
+    def __init__(self, expression, selection, hist):
+        fields = re.split('(?<!:):(?!:)', expression)
+        if len(fields) != hist.GetDimension():
+            raise TypeError(
+                "The dimensionality of the expression `{0}` ({1:d}) "
+                "does not match the dimensionality of a `{2}`".format(
+                    expression, len(fields), hist.__class__.__name__))
+        self.fields = [Cut(field).compile() for field in fields]
+        self.selection = Cut(selection).compile()
+        self.hist = hist
+
+    @property
+    def branches(self):
+        branches = list(self.selection.branches)
+        for field in self.fields:
+            branches += field.branches
+        return branches
+
+
+def fill_categories(chunks, categories, booking, weight=1.):
+    """
+    Fill one clone of the histogram of a booking per category of a
+    Categories tree with an iterable of column chunks (that must include the
+    ``branches`` of the booking and the variables of the categories). The
+    category of each entry is found with ``Categories.categorize`` so every
+    chunk is split among the categories in one pass. Return the list of
+    histograms in the order of ``categories.walk()``. ``weight`` may be a
+    callable returning the current weight of the tree.
+    """
+    import numpy as np
+    hist = booking.hist
+    n_categories = len(list(categories.walk()))
+    hists = [hist.Clone('{0}_{1:d}'.format(hist.GetName(), i))
+             for i in range(n_categories)]
+    for h in hists:
+        h.Reset()
+    for chunk in chunks:
+        tree_weight = weight() if callable(weight) else weight
+        # the selection is a weight as in TTree::Draw
+        arrays = _instances(
+            [field(chunk) for field in booking.fields] +
+            [booking.selection(chunk), categories.categorize(chunk)])
+        index = arrays.pop()
+        weights = arrays.pop().astype(np.double) * tree_weight
+        passing = (weights != 0) & (index >= 0)
+        values = np.column_stack(arrays)[passing]
+        weights = weights[passing]
+        index = index[passing]
+        # group the entries by category
+        order = np.argsort(index, kind='mergesort')
+        bounds = np.searchsorted(index[order], np.arange(n_categories + 1))
+        for i, h in enumerate(hists):
+            selected = order[bounds[i]:bounds[i + 1]]
+            if len(selected):
+                fill_hist(h, values[selected], weights[selected])
+    return hists
+
+
+def yield_branches(cuts, weights=None):
+    """
+    Return the branches required to evaluate a list of cuts and a list of
+    weight expressions
+    """
+    branches = []
+    for expression in list(cuts) + list(weights or []):
+        for branch in Cut(expression).compile().branches:
+            if branch not in branches:
+                branches.append(branch)
+    return branches
+
+
+def compute_yields(chunks, cuts, weights=None, cumulative=False, weight=1.):
+    """
+    Compute the number of entries, the sum of weights and the sum of squared
+    weights passing each cut for each weight expression in a single pass over
+    an iterable of column chunks. The passing entries of all cuts are packed
+    into one matrix per chunk so that the sums for all pairs of cuts and
+    weights are computed with two matrix products. ``weight`` may be a
+    callable returning the current weight of the tree, which multiplies all
+    weight expressions.
+
+    Parameters
+    ----------
+    chunks : iterable
+        The column chunks (i.e. from ``Tree.iterate``).
+
+    cuts : list
+        The selections (str or Cut). An entry passes a cut if the value of
+        the cut is nonzero.
+
+    weights : list, optional (default=None)
+        The weight expressions (str or Cut). If None, then each entry has a
+        weight of one.
+
+    cumulative : bool, optional (default=False)
+        If True, then an entry passes a cut only if it also passes all
+        previous cuts, as in a cutflow.
+
+    weight : float or callable, optional (default=1.)
+        The weight of the tree.
+
+    Returns
+    -------
+    count : ndarray of shape (n_cuts,)
+        The number of entries passing each cut.
+
+    sumw : ndarray of shape (n_cuts, n_weights)
+        The sum of weights of the entries passing each cut.
+
+    sumw2 : ndarray of shape (n_cuts, n_weights)
+        The sum of squared weights of the entries passing each cut.
+    """
+    import numpy as np
+    cuts = [Cut(cut).compile() for cut in cuts]
+    if weights is None:
+        weights = ['']
+    # the empty cut evaluates to one for each entry
+    weights = [Cut(expression).compile() for expression in weights]
+    count = np.zeros(len(cuts), dtype=np.int64)
+    sumw = np.zeros((len(cuts), len(weights)), dtype=np.double)
+    sumw2 = np.zeros((len(cuts), len(weights)), dtype=np.double)
+    if not cuts:
+        return count, sumw, sumw2
+    for chunk in chunks:
+        tree_weight = weight() if callable(weight) else weight
+        evaluated = {}
+
+        def evaluate(func):
+            try:
+                return evaluated[func.expression]
+            except KeyError:
+                result = evaluated[func.expression] = func(chunk)
+                return result
+
+        passing = np.column_stack([evaluate(cut) != 0 for cut in cuts])
+        if len(passing) == 0:
+            continue
+        if cumulative:
+            passing = np.logical_and.accumulate(passing, axis=1)
+        values = np.column_stack(
+            [evaluate(func) for func in weights]).astype(np.double)
+        if tree_weight != 1.:
+            values *= tree_weight
+        count += passing.sum(axis=0)
+        passing = passing.astype(np.double)
+        sumw += np.dot(passing.T, values)
+        sumw2 += np.dot(passing.T, values * values)
+    return count, sumw, sumw2
+
+
+class Bookings(list):
+    """
+    A list of histograms booked to be filled with expressions passing
+    selections. All histograms are filled in a single pass over the columns
+    of a tree. Each distinct selection and expression is evaluated only once
+    per chunk of entries, however many histograms use it.
+    """
+    def book(self, expression, selection, hist):
+        if not isinstance(hist, ROOT.TH1):
+            raise TypeError("Cannot draw into a `{0}`".format(type(hist)))
+        self.append(Booking(expression, selection, hist))
+
+    @property
+    def branches(self):
+        """
+        The branches required to fill all booked histograms
+        """
+        branches = []
+        for booking in self:
+            for branch in booking.branches:
+                if branch not in branches:
+                    branches.append(branch)
+        return branches
+
+    def fill(self, columns, weight=1.):
+        """
+        Fill all booked histograms with a chunk of entries
+        """
+        import numpy as np
+        evaluated = {}
+
+        def evaluate(func):
+            try:
+                return evaluated[func.expression]
+            except KeyError:
+                result = evaluated[func.expression] = func(columns)
+                return result
+
+        for booking in self:
+            # fill all elements of fixed-length arrays
+            arrays = _instances(
+                [evaluate(field) for field in booking.fields] +
+                [evaluate(booking.selection)])
+            # the selection is a weight as in TTree::Draw
+            selection = arrays.pop().astype(np.double)
+            if weight != 1.:
+                selection = selection * weight
+            passing = selection != 0
+            values = np.column_stack(arrays)[passing]
+            fill_hist(booking.hist, values, selection[passing])
+
+    def run(self, chunks, weight=1.):
+        """
+        Fill all booked histograms with an iterable of column chunks and
+        return the list of filled histograms. ``weight`` may be a callable
+        returning the current weight of the tree.
+        """
+        for chunk in chunks:
+            self.fill(chunk, weight() if callable(weight) else weight)
+        hists = [booking.hist for booking in self]
+        del self[:]
+        return hists
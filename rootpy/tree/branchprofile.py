@@ -0,0 +1,90 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a persistent record of the branches that an analysis
+accesses when reading a tree with ``read_branches_on_demand``. A later run of
+the same analysis can then read these branches from the first entry instead
+of discovering them one at a time while the TTreeCache is learning.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import json
+import tempfile
+
+from .. import log; log = log[__name__]
+from .. import userdata
+from ..utils.path import mkdir_p
+
+__all__ = [
+    'BranchProfile',
+]
+
+
+class BranchProfile(object):
+    """
+    The branches of a tree accessed by an analysis.
+
+    Parameters
+    ----------
+    analysis : str
+        The name of the analysis. Each analysis has its own profile file.
+
+    tree_name : str
+        The name of the tree. A profile file holds the branches of each tree
+        read by the analysis.
+
+    path : str, optional (default=None)
+        The path to the profile file. By default the profile is stored in
+        ``branch_profiles/<analysis>.json`` in the rootpy user data directory.
+    """
+    def __init__(self, analysis, tree_name, path=None):
+        if path is None:
+            path = os.path.join(
+                userdata.DATA_ROOT, 'branch_profiles',
+                re.sub(r'[^\w.-]', '_', analysis) + '.json')
+        self.analysis = analysis
+        self.tree_name = tree_name
+        self.path = path
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            log.warning(
+                "ignoring unreadable branch profile {0}".format(self.path))
+            return {}
+
+    @property
+    def branches(self):
+        """
+        The sorted list of branches recorded for this tree
+        """
+        return sorted(self._load().get(self.tree_name, []))
+
+    def save(self, branches):
+        """
+        Record the branches accessed for this tree, replacing any previous
+        record for this tree but preserving the records of other trees
+        """
+        profiles = self._load()
+        profiles[self.tree_name] = sorted(set(branches))
+        dirname = os.path.dirname(self.path)
+        mkdir_p(dirname)
+        # write to a temporary file and rename so that concurrent jobs never
+        # read a partially written profile
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(profiles, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+        log.info("recorded {0:d} accessed branches of tree `{1}` "
+                 "in {2}".format(len(profiles[self.tree_name]),
+                                 self.tree_name, self.path))
+
+    def __repr__(self):
+        return "BranchProfile('{0}', '{1}')".format(
+            self.analysis, self.tree_name)
@@ -279,3 +279,86 @@ class Categories(object):
         """
         for category in self.walk():
             yield category
+
+    def _regions(self):
+        """
+        Return the sorted cut values of the subtree of nodes below this node
+        that split on the same variable and the regions between the cuts in
+        ascending order: None for a forbidden region, True for a category or
+        the node of another variable splitting the region further
+        """
+        cuts = []
+        regions = []
+
+        def visit_side(forbid, child):
+            if forbid:
+                regions.append(None)
+            elif child is None:
+                regions.append(True)
+            elif child.feature == self.feature:
+                visit(child)
+            else:
+                regions.append(child)
+
+        def visit(node):
+            # in-order so that the cuts and regions are in ascending order
+            visit_side(node.forbidleft, node.leftchild)
+            cuts.append(float(node.data))
+            visit_side(node.forbidright, node.rightchild)
+
+        visit(self)
+        if any(left >= right for left, right in zip(cuts[:-1], cuts[1:])):
+            # not a search tree over this variable so only split at this node
+            cuts = [float(self.data)]
+            regions = [
+                None if forbid else True if child is None else child
+                for forbid, child in ((self.forbidleft, self.leftchild),
+                                      (self.forbidright, self.rightchild))]
+        return cuts, regions
+
+    def _categorize(self, arrays, index, categories, offset):
+        import numpy as np
+        cuts, regions = self._regions()
+        values = np.asarray(arrays[self.variables[self.feature][0]])[index]
+        # region i holds the values in (cuts[i - 1], cuts[i]]
+        bins = np.digitize(values, cuts, right=True)
+        if values.dtype.kind == 'f':
+            # NaN passes neither x <= cut nor x > cut
+            bins[np.isnan(values)] = len(regions)
+        order = np.argsort(bins, kind='mergesort')
+        bounds = np.searchsorted(bins[order], np.arange(len(regions) + 1))
+        for i, region in enumerate(regions):
+            if region is None:
+                continue
+            selected = index[order[bounds[i]:bounds[i + 1]]]
+            if region is True:
+                categories[selected] = offset
+                offset += 1
+            else:
+                offset = region._categorize(
+                    arrays, selected, categories, offset)
+        return offset
+
+    def categorize(self, arrays):
+        """
+        Return the index of the category of each entry in one vectorized pass
+        over the columns of the variables. The categories are numbered in the
+        order of ``walk()`` and entries in no category are assigned -1.
+
+        Parameters
+        ----------
+        arrays : dict or NumPy structured array
+            The columns of the variables of the categories, i.e. a chunk of
+            ``Tree.iterate``.
+
+        Returns
+        -------
+        categories : NumPy array of ints
+        """
+        import numpy as np
+        name = self.variables[self.feature][0]
+        n_entries = len(arrays[name])
+        categories = np.empty(n_entries, dtype=np.intp)
+        categories.fill(-1)
+        self._categorize(arrays, np.arange(n_entries), categories, 0)
+        return categories
@@ -2,15 +2,29 @@
 # distributed under the terms of the GNU General Public License
 from __future__ import absolute_import
 
+import os
 import multiprocessing
+from bisect import bisect_right
+import threading
 import time
+try:
+    from collections import OrderedDict
+except ImportError: # py 2.6
+    from ..extern.ordereddict import OrderedDict
 
 from .. import log; log = log[__name__]
 from ..io import root_open, DoesNotExist
 from ..utils.extras import humanize_bytes
 from ..context import preserve_current_directory
 from ..extern.six import string_types
-from .filtering import EventFilterList
+from .filtering import EventFilterList, FilterList
+from .booking import (
+    Bookings, Booking, Chunk, fill_categories, compute_yields,
+    yield_branches)
+from .branchprofile import BranchProfile
+from .friend import Friend
+from .selectioncache import SelectionCache
+from .index import DatasetIndex, _index_file
 
 __all__ = [
     'TreeChain',
@@ -18,6 +32,17 @@ __all__ = [
 ]
 
 
+def _work_unit(unit):
+    """
+    Return the filename and the (first, last) range of entries of a work
+    unit that is either a filename or a (filename, first, last) tuple
+    """
+    if isinstance(unit, tuple):
+        filename, first, last = unit
+        return filename, (first, last)
+    return unit, None
+
+
 class BaseTreeChain(object):
 
     def __init__(self, name,
@@ -33,7 +58,13 @@ class BaseTreeChain(object):
                  learn_entries=10,
                  always_read=None,
                  ignore_unsupported=False,
-                 filters=None):
+                 filters=None,
+                 prefetch=0,
+                 specialize_buffer=False,
+                 branch_profile=None,
+                 selection=None,
+                 selection_cache=None,
+                 column_cache=None):
         self._name = name
         self._buffer = treebuffer
         self._branches = branches
@@ -43,6 +74,7 @@ class BaseTreeChain(object):
         self._events = events
         self._total_events = 0
         self._ignore_unsupported = ignore_unsupported
+        self._specialize_buffer = specialize_buffer
         self._initialized = False
         if filters is None:
             self._filters = EventFilterList([])
@@ -57,6 +89,32 @@ class BaseTreeChain(object):
         self._cache_size = cache_size
         self._learn_entries = learn_entries
 
+        self._prefetch = prefetch
+        self._prefetcher = None
+        if prefetch > 0:
+            self._prefetcher = FilePrefetcher()
+        self._rollover_time = 0.
+        self._bookings = Bookings()
+        # the number of bytes read from each file once it is closed
+        self.bytes_read = OrderedDict()
+        # the branches accessed with read_branches_on_demand are recorded in
+        # this profile and preloaded in later runs
+        if isinstance(branch_profile, string_types):
+            branch_profile = BranchProfile(branch_profile, name)
+        self._branch_profile = branch_profile
+        self._accessed_branches = set()
+        # only the entries passing this selection are read from each file
+        # using the cached entry lists of the selection cache
+        self._selection = selection
+        if selection and selection_cache is None:
+            selection_cache = SelectionCache()
+        self._selection_cache = selection_cache
+        # the columns read with iterate are stored in and read from this
+        # ColumnCache
+        self._column_cache = column_cache
+        # the friend trees joined to each tree by the values of key branches
+        self._friends = []
+
         self.weight = 1.
         self.userdata = {}
 
@@ -80,6 +138,16 @@ class BaseTreeChain(object):
                     branches.append(branch)
             self.always_read(branches)
 
+        if self._branch_profile is not None:
+            preload = [
+                branch for branch in self._branch_profile.branches
+                if branch not in self._always_read and
+                self._tree.has_branch(branch)]
+            if preload:
+                log.info("preloading {0:d} branches from {1}".format(
+                    len(preload), self._branch_profile))
+                self.always_read(list(self._always_read) + preload)
+
     def __nonzero__(self):
         return len(self) > 0
 
@@ -91,6 +159,59 @@ class BaseTreeChain(object):
         """
         return None
 
+    def _peek_files(self, n):
+        """
+        Return up to ``n`` of the files that will be returned next by
+        ``_next_file``. Override in subclasses that support prefetching.
+        """
+        return []
+
+    @property
+    def prefetch_stats(self):
+        """
+        A dict summarizing the time spent opening files (``rollover_time``)
+        and, if prefetching, the number of prefetched files (``files``), the
+        time spent warming them (``prefetch_time``), the part of it hidden
+        behind the processing of the previous files (``hidden_time``) and
+        the time the rollover waited for the warm-up (``wait_time``)
+        """
+        stats = {'rollover_time': self._rollover_time}
+        if self._prefetcher is not None:
+            stats.update(self._prefetcher.stats)
+        return stats
+
+    def _log_prefetch_stats(self):
+        if self._prefetcher is None:
+            return
+        stats = self.prefetch_stats
+        log.info(
+            "spent {0:.1f} s opening files ({1:.1f} s waiting for "
+            "prefetching); prefetching {2:d} file{3} hid {4:.1f} s of "
+            "{5:.1f} s spent warming files".format(
+                stats['rollover_time'], stats['wait_time'],
+                stats['files'], 's' if stats['files'] != 1 else '',
+                stats['hidden_time'], stats['prefetch_time']))
+
+    def report(self):
+        """
+        Print the cut-flow of the filters (including the time spent in each
+        filter if the filters are timed) and the number of bytes read from
+        each file
+        """
+        from ..utils.extras import print_table
+        self._filters.report()
+        if self.bytes_read:
+            table = [('File', 'Bytes read')]
+            for filename, nbytes in self.bytes_read.items():
+                table.append((filename, humanize_bytes(nbytes)))
+            table.append(('Total', humanize_bytes(
+                sum(self.bytes_read.values()))))
+            print_table(table)
+
+    def _record_accessed_branches(self):
+        if self._branch_profile is not None and self._read_branches_on_demand:
+            self._accessed_branches.update(self._buffer._branch_cache.keys())
+
     def always_read(self, branches):
         self._always_read = branches
         self._tree.always_read(branches)
@@ -99,6 +220,9 @@ class BaseTreeChain(object):
         if self._tree is not None:
             self._tree = None
         if self._file is not None:
+            name = self._file.GetName()
+            self.bytes_read[name] = (
+                self.bytes_read.get(name, 0) + self._file.GetBytesRead())
             self._file.Close()
             self._file = None
 
@@ -126,6 +250,192 @@ class BaseTreeChain(object):
     def draw(self, *args, **kwargs):
         return self.Draw(*args, **kwargs)
 
+    def iterate(self, branches=None, step_size=100000, collections=False):
+        """
+        Loop over subfiles and iterate over each tree in chunks of entries,
+        yielding dicts mapping branch names to NumPy arrays.
+        See ``rootpy.tree.Tree.iterate``. Chunks do not span file boundaries
+        and the same output arrays are reused for all chunks of all files.
+        If the chain has a ``selection`` then only the entries passing it are
+        included in the chunks, as in the loop over the entries.
+        """
+        self.reset()
+        out = {}
+        while self._rollover():
+            start, stop = self._tree.entry_range or (0, None)
+            for chunk in self._select_chunks(self._tree.iterate(
+                    branches, step_size=step_size, out=out,
+                    collections=collections, start=start, stop=stop),
+                    start):
+                yield chunk
+
+    def _select_chunks(self, chunks, start):
+        """
+        Keep only the entries in the entry list of the selection of the chain
+        in the chunks of the current tree beginning at entry ``start``
+        """
+        elist = self._tree._selection_entry_list
+        if not elist:
+            for chunk in chunks:
+                yield chunk
+            return
+        import numpy as np
+        from .jagged import JaggedCollection
+        n_entries = int(elist.GetN())
+        entries = np.fromiter(
+            (elist.GetEntry(i) for i in range(n_entries)),
+            dtype=np.int64, count=n_entries)
+        first = start
+        for chunk in chunks:
+            last = first + chunk.n_entries
+            left, right = np.searchsorted(entries, [first, last])
+            index = entries[left:right] - first
+            first = last
+            if len(index) == 0:
+                continue
+            selected = Chunk([
+                (name, column.entries(index)
+                 if isinstance(column, JaggedCollection) else column[index])
+                for name, column in chunk.items()])
+            selected.n_entries = len(index)
+            yield selected
+
+    def book(self, expression, selection="", hist=None):
+        """
+        Book a histogram to be filled when ``run`` is called.
+        See ``rootpy.tree.Tree.book``.
+        """
+        self._bookings.book(expression, selection, hist)
+
+    def run(self, step_size=100000):
+        """
+        Fill all booked histograms in a single pass over all files in the
+        chain, opening each file only once. Return the list of filled
+        histograms in the order they were booked.
+        """
+        return self._bookings.run(
+            self.iterate(self._bookings.branches, step_size=step_size),
+            weight=lambda: self.weight)
+
+    def yields(self, cuts, weights=None, cumulative=False, weighted=False,
+               step_size=100000):
+        """
+        Compute the number of entries, the sum of weights and the sum of
+        squared weights passing each cut for each weight expression in a
+        single pass over all files in the chain. If ``weighted`` is True then
+        the weights are multiplied by the weight of each tree.
+        See ``rootpy.tree.Tree.yields``.
+        """
+        return compute_yields(
+            self.iterate(yield_branches(cuts, weights),
+                         step_size=step_size),
+            cuts, weights, cumulative=cumulative,
+            weight=(lambda: self.weight) if weighted else 1.)
+
+    def add_friend(self, filename, name=None, keys=('run', 'event'),
+                   branches=None, prefix='', index_path=None):
+        """
+        Join a friend tree to the entries of all trees in the chain by the
+        values of key branches. The branches of the friend are added to the
+        buffer of the chain and are set to the values of the friend entry
+        with the same keys as the current entry when iterating over the
+        chain. See ``rootpy.tree.friend.Friend``.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file containing the friend tree.
+
+        name : str, optional (default=None)
+            The name of the friend tree. By default this is the name of the
+            trees in the chain.
+
+        keys : list, optional (default=('run', 'event'))
+            The names of the branches identifying an entry in both the
+            friend and the trees in the chain.
+
+        branches : list, optional (default=None)
+            Only read these branches of the friend.
+
+        prefix : str, optional (default='')
+            Prefix the names of the branches of the friend with this string.
+
+        index_path : str, optional (default=None)
+            The file in which the sorted index of the friend is stored. By
+            default the index is stored next to the friend file.
+
+        Returns
+        -------
+        friend : Friend
+            The friend. Its ``matched`` attribute tells whether the current
+            entry has a friend entry.
+        """
+        if name is None:
+            name = self._name
+        friend = Friend(filename, name, keys=keys, branches=branches,
+                        prefix=prefix, index_path=index_path)
+        for branch, value in friend.items():
+            if branch in self._buffer:
+                friend.close()
+                raise ValueError(
+                    "friend branch `{0}` has the same name as a branch of "
+                    "the chain".format(branch))
+        self._friends.append(friend)
+        if self._tree is not None:
+            # the other trees are joined when they are opened
+            friend.join(self._tree)
+            for branch, value in friend.items():
+                self._tree._buffer.add_external(branch, value)
+            if self._specialize_buffer:
+                self._tree._buffer.specialize()
+        return friend
+
+    def _friend_branches(self):
+        return [branch for friend in self._friends
+                for branch, value in friend.items()]
+
+    def fill_categories(self, categories, expression, hist, selection="",
+                        step_size=100000):
+        """
+        Fill one clone of a histogram per category of a
+        ``rootpy.tree.categories.Categories`` tree in a single pass over all
+        files in the chain. Each entry is assigned to its category with
+        ``Categories.categorize`` instead of evaluating one selection per
+        category.
+
+        Parameters
+        ----------
+        categories : Categories
+            The categories.
+
+        expression : str
+            The expression to histogram, as in ``book``.
+
+        hist : Hist
+            The histogram to clone for each category.
+
+        selection : str or Cut, optional (default="")
+            Only fill the entries passing this selection (which is also used
+            as a weight as in ``TTree::Draw``).
+
+        step_size : int, optional (default=100000)
+            The number of entries in each chunk read with ``iterate``.
+
+        Returns
+        -------
+        hists : list
+            One histogram per category in the order of ``categories.walk()``.
+        """
+        booking = Booking(expression, selection, hist)
+        branches = []
+        for name in booking.branches + [
+                name for name, var_type in categories.variables]:
+            if name not in branches:
+                branches.append(name)
+        return fill_categories(
+            self.iterate(branches, step_size=step_size),
+            categories, booking, weight=lambda: self.weight)
+
     def __getattr__(self, attr):
         try:
             return getattr(self._tree, attr)
@@ -141,14 +451,25 @@ class BaseTreeChain(object):
 
     def __iter__(self):
         passed_events = 0
+        friends = self._friends
+        if self._tree is None and not self._rollover():
+            # the chain was closed at the end of the previous loop and has
+            # no more trees to open
+            return
         while True:
             entries = 0
             total_entries = float(self._tree.GetEntries())
+            if self._tree.entry_range is not None:
+                first, last = self._tree.entry_range
+                total_entries = float(
+                    max(min(last, total_entries) - first, 1))
             t1 = time.time()
             t2 = t1
             for entry in self._tree:
                 entries += 1
                 self.userdata = {}
+                for friend in friends:
+                    friend.read(entry._entry.value)
                 if self._filters(entry):
                     yield entry
                     passed_events += 1
@@ -163,6 +484,7 @@ class BaseTreeChain(object):
                             'ies' if entry_rate != 1 else 'y',
                             100 * entries / total_entries))
                     t2 = time.time()
+            self._record_accessed_branches()
             if self._events == passed_events:
                 break
             log.info("{0:d} entries per second".format(
@@ -174,44 +496,87 @@ class BaseTreeChain(object):
             if not self._rollover():
                 break
         self._filters.finalize()
+        self._log_prefetch_stats()
+        if self._branch_profile is not None and self._accessed_branches:
+            self._branch_profile.save(self._accessed_branches)
 
     def _rollover(self):
-        BaseTreeChain.reset(self)
-        filename = self._next_file()
-        if filename is None:
+        t0 = time.time()
+        try:
+            return self._open_next()
+        finally:
+            self._rollover_time += time.time() - t0
+
+    def _open_next(self):
+        unit = self._next_file()
+        if unit is None:
+            BaseTreeChain.reset(self)
             return False
+        filename, entry_range = _work_unit(unit)
+        if (entry_range is not None and self._tree is not None and
+                self._file is not None and self._file.GetName() == filename):
+            # continue with another range of entries of the open file
+            log.info("current entries: [{0:d}, {1:d})".format(*entry_range))
+            self._tree.entry_range = entry_range
+            return True
+        BaseTreeChain.reset(self)
         log.info("current file: {0}".format(filename))
+        if self._prefetcher is not None:
+            # wait for the warm-up of this file to finish and then start
+            # warming the following files while this one is processed
+            self._prefetcher.wait(filename)
+            for upcoming in self._peek_files(self._prefetch):
+                self._prefetcher.prefetch(upcoming)
         try:
             with preserve_current_directory():
                 self._file = root_open(filename)
         except IOError:
             self._file = None
             log.warning("could not open file {0} (skipping)".format(filename))
-            return self._rollover()
+            return self._open_next()
         try:
             self._tree = self._file.Get(self._name)
         except DoesNotExist:
             log.warning(
                 "tree {0} does not exist in file {1} (skipping)".format(
                     self._name, filename))
-            return self._rollover()
+            return self._open_next()
         if len(self._tree.GetListOfBranches()) == 0:
             log.warning("tree with no branches in file {0} (skipping)".format(
                 filename))
-            return self._rollover()
+            return self._open_next()
+        for friend in self._friends:
+            # match the entries before the branch addresses are set
+            friend.join(self._tree)
+        self._tree.column_cache = self._column_cache
+        self._tree.entry_range = entry_range
+        if self._selection_cache is not None:
+            self._tree.selection_cache = self._selection_cache
+            if self._selection:
+                elist = self._selection_cache.entry_list(
+                    self._tree, self._selection)
+                self._tree.SetEntryList(elist)
+                # only iterate over the entries in the list (this also keeps
+                # the entry list alive as long as the tree)
+                self._tree._selection_entry_list = elist
         if self._branches is not None:
             self._tree.activate(self._branches, exclusive=True)
         if self._ignore_branches is not None:
             self._tree.deactivate(self._ignore_branches, exclusive=False)
         if self._buffer is None:
             self._tree.create_buffer(self._ignore_unsupported)
-            self._buffer = self._tree._buffer
         else:
             self._tree.set_buffer(
                 self._buffer,
+                ignore_branches=self._friend_branches(),
                 ignore_missing=True,
                 transfer_objects=True)
-            self._buffer = self._tree._buffer
+        for friend in self._friends:
+            for branch, value in friend.items():
+                self._tree._buffer.add_external(branch, value)
+        if self._specialize_buffer:
+            self._tree._buffer.specialize()
+        self._buffer = self._tree._buffer
         if self._use_cache:
             # enable TTreeCache for this tree
             log.info(
@@ -232,8 +597,18 @@ class BaseTreeChain(object):
 class TreeChain(BaseTreeChain):
     """
     A ROOT.TChain replacement
+
+    Global entry numbers are mapped onto files with the cumulative number of
+    entries in the files (see ``offsets``) so that ``chain[i]``,
+    ``chain.iterate(start=, stop=)`` and ``chain.split(n)`` only open the
+    files they need.
+
+    If an ``index`` (a ``rootpy.tree.index.DatasetIndex`` or the path to its
+    JSON file) is given then files without entries are skipped without
+    opening them and ``GetEntries()`` returns the total number of entries in
+    all files from the index.
     """
-    def __init__(self, name, files, **kwargs):
+    def __init__(self, name, files, index=None, **kwargs):
         if isinstance(files, tuple):
             files = list(files)
         elif not isinstance(files, list):
@@ -243,8 +618,29 @@ class TreeChain(BaseTreeChain):
         if not files:
             raise RuntimeError(
                 "unable to initialize TreeChain: no files")
+        if index is not None:
+            if not isinstance(index, DatasetIndex):
+                index = DatasetIndex(index, name)
+            index.update(files)
+            nonempty = []
+            for filename in files:
+                record = index.get(filename)
+                if record is None or record['entries'] > 0:
+                    nonempty.append(filename)
+            if len(nonempty) < len(files):
+                log.info("skipping {0:d} files without entries".format(
+                    len(files) - len(nonempty)))
+            files = nonempty
+            if not files:
+                raise RuntimeError(
+                    "unable to initialize TreeChain: no files with entries")
+        self._index = index
         self._files = files
+        self._kwargs = kwargs
+        self._offsets = None
         self.curr_file_idx = 0
+        # the position of the currently open file in self._files
+        self._open_idx = None
         super(TreeChain, self).__init__(name, **kwargs)
 
     def reset(self):
@@ -258,10 +654,128 @@ class TreeChain(BaseTreeChain):
     def __len__(self):
         return len(self._files)
 
+    def GetEntries(self, *args, **kwargs):
+        """
+        Return the total number of entries in all files from the index if
+        this chain has one and no arguments are given. Otherwise return the
+        number of entries in the current tree.
+        """
+        if self._index is not None and not args and not kwargs:
+            return self._index.entries(self._files)
+        return self._tree.GetEntries(*args, **kwargs)
+
+    @property
+    def offsets(self):
+        """
+        The number of entries in all files before each file followed by the
+        total number of entries. The entries are taken from the index if this
+        chain has one, otherwise each file is opened once to count them.
+        Files that cannot be read count as empty.
+        """
+        if self._offsets is None:
+            if self._index is not None:
+                self._index.update(self._files)
+            offsets = [0]
+            for filename in self._files:
+                if self._index is not None:
+                    record = self._index.get(filename)
+                else:
+                    _, record = _index_file((self._name, filename))
+                entries = record['entries'] if record is not None else 0
+                offsets.append(offsets[-1] + entries)
+            self._offsets = offsets
+        return self._offsets
+
+    def _locate(self, entry):
+        """
+        Return the position of the file containing a global entry and the
+        entry number within that file
+        """
+        offsets = self.offsets
+        idx = bisect_right(offsets, entry) - 1
+        return idx, entry - offsets[idx]
+
+    def _open_file(self, idx):
+        if self._tree is not None and self._open_idx == idx:
+            return
+        self.curr_file_idx = idx
+        if not self._rollover() or self._open_idx != idx:
+            raise IOError("could not open file {0}".format(self._files[idx]))
+
+    def __getitem__(self, item):
+        """
+        Get the value of a branch in the current tree if ``item`` is a str,
+        otherwise load the global entry ``item`` of the chain, opening only
+        the file containing it
+        """
+        if isinstance(item, string_types):
+            return self._tree.__getitem__(item)
+        total = self.offsets[-1]
+        if item < 0:
+            item += total
+        if not (0 <= item < total):
+            raise IndexError("entry index out of range: {0:d}".format(item))
+        idx, entry = self._locate(item)
+        self._open_file(idx)
+        tree = self._tree[entry]
+        for friend in self._friends:
+            friend.read(entry)
+        return tree
+
+    def iterate(self, branches=None, step_size=100000, collections=False,
+                start=None, stop=None):
+        """
+        Iterate over the entries of the chain in chunks of entries, yielding
+        dicts mapping branch names to NumPy arrays.
+        See ``rootpy.tree.Tree.iterate``. If ``start`` or ``stop`` is given
+        then only the global entries in [start, stop) are read and only the
+        files containing them are opened. If the chain has a ``selection``
+        then only the entries passing it are included in the chunks.
+        """
+        if start is None and stop is None:
+            for chunk in super(TreeChain, self).iterate(
+                    branches, step_size=step_size, collections=collections):
+                yield chunk
+            return
+        offsets = self.offsets
+        start = 0 if start is None else max(start, 0)
+        stop = offsets[-1] if stop is None else min(stop, offsets[-1])
+        if start >= stop:
+            return
+        first, _ = self._locate(start)
+        last, _ = self._locate(stop - 1)
+        out = {}
+        for idx in range(first, last + 1):
+            if offsets[idx + 1] == offsets[idx]:
+                continue
+            self._open_file(idx)
+            first = max(start - offsets[idx], 0)
+            for chunk in self._select_chunks(self._tree.iterate(
+                    branches, step_size=step_size, out=out,
+                    collections=collections, start=first,
+                    stop=min(stop, offsets[idx + 1]) - offsets[idx]),
+                    first):
+                yield chunk
+
+    def split(self, n):
+        """
+        Partition the entries of the chain into at most ``n`` contiguous
+        ranges of (nearly) equal numbers of entries. Return a list of
+        (start, stop) global entry ranges that may be processed independently,
+        i.e. with ``iterate(start=start, stop=stop)`` in separate processes.
+        """
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        total = self.offsets[-1]
+        bounds = [total * k // n for k in range(n + 1)]
+        return [(left, right) for left, right in zip(bounds[:-1], bounds[1:])
+                if right > left]
+
     def _next_file(self):
         if self.curr_file_idx >= len(self._files):
             return None
         filename = self._files[self.curr_file_idx]
+        self._open_idx = self.curr_file_idx
         nfiles_remaining = len(self._files) - self.curr_file_idx
         log.info("{0:d} file{1} remaining".format(
             nfiles_remaining,
@@ -269,17 +783,195 @@ class TreeChain(BaseTreeChain):
         self.curr_file_idx += 1
         return filename
 
+    def _peek_files(self, n):
+        return self._files[self.curr_file_idx:self.curr_file_idx + n]
+
+    def map_reduce(self, func, reducer=None, workers=None):
+        """
+        Apply a function on each file of this chain in a pool of worker
+        processes and reduce the outputs into a single result.
+
+        Parameters
+        ----------
+        func : callable
+            A picklable (module-level) function called with a TreeChain over
+            a single file of this chain. The TreeChain is constructed with the
+            same keyword arguments as this chain, except for ``treebuffer``,
+            ``onfilechange`` and ``filters`` which are not transferred to the
+            workers. Any filters must be created inside ``func``.
+
+        reducer : callable, optional (default=None)
+            A picklable function combining two outputs of ``func`` into one.
+            By default FilterLists are merged with ``FilterList.merge`` and
+            all other outputs (histograms, counters, ...) are summed.
+
+        workers : int, optional (default=None)
+            The number of worker processes. By default use as many processes
+            as there are CPUs. If 1 then ``func`` is called in this process.
+
+        Returns
+        -------
+        result : the reduced outputs of ``func`` or None if no file could be
+            processed
+        """
+        if reducer is None:
+            reducer = _reduce_outputs
+        kwargs = dict([
+            (key, value) for key, value in self._kwargs.items()
+            if key not in ('treebuffer', 'onfilechange', 'filters')])
+        tasks = [(func, self._name, filename, kwargs)
+                 for filename in self._files]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(tasks))
+        pool = None
+        if workers <= 1:
+            outputs = map(_map_task, tasks)
+        else:
+            pool = multiprocessing.Pool(workers)
+            outputs = pool.imap_unordered(_map_task, tasks)
+        try:
+            result = None
+            # reduce outputs as soon as they are ready
+            for output in outputs:
+                if output is None:
+                    continue
+                if result is None:
+                    result = output
+                else:
+                    result = reducer(result, output)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        return result
 
-class TreeQueue(BaseTreeChain):
 
+class FilePrefetcher(object):
+    """
+    Warm upcoming files on background threads so that opening them and
+    reading their first entries hits the operating system's page cache. This
+    hides the latency of network-mounted storage at file boundaries of a
+    chain. The tail of each file (holding the keys, the streamer infos and
+    the tree header) and its head (holding the file header and typically the
+    first baskets) are read first. The rest of the file is read ahead only
+    until the file is opened, so that the rollover never waits for more than
+    the warm-up and the read-ahead never competes with the reads of the tree.
+    """
+    BLOCK_SIZE = 4 * 1024 * 1024
+    WARM_SIZE = 16 * 1024 * 1024
+
+    def __init__(self):
+        self._threads = {}
+        self.stats = {
+            'files': 0,
+            'prefetch_time': 0.,
+            'wait_time': 0.,
+            'hidden_time': 0.}
+
+    def prefetch(self, filename):
+        # only local or mounted files can be read ahead
+        if filename in self._threads or not os.path.isfile(filename):
+            return
+        state = {
+            'warmed': threading.Event(),
+            'cancel': threading.Event(),
+        }
+        thread = threading.Thread(
+            target=self._read, args=(filename, state))
+        thread.daemon = True
+        self._threads[filename] = state
+        thread.start()
+
+    def _read_range(self, f, start, stop, cancel=None):
+        f.seek(start)
+        while start < stop:
+            if cancel is not None and cancel.is_set():
+                return
+            data = f.read(min(self.BLOCK_SIZE, stop - start))
+            if not data:
+                return
+            start += len(data)
+
+    def _read(self, filename, state):
+        t0 = time.time()
+        try:
+            with open(filename, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                head = min(self.WARM_SIZE, size)
+                tail = max(head, size - self.WARM_SIZE)
+                self._read_range(f, tail, size)
+                self._read_range(f, 0, head)
+                state['warm'] = (t0, time.time())
+                state['warmed'].set()
+                # read ahead the rest until the file is opened
+                self._read_range(f, head, tail, cancel=state['cancel'])
+        except IOError:
+            log.warning("could not prefetch file {0}".format(filename))
+        finally:
+            state['warmed'].set()
+
+    def wait(self, filename):
+        """
+        Block until the warm-up of this file is complete and abandon the
+        read-ahead of the rest of the file
+        """
+        try:
+            state = self._threads.pop(filename)
+        except KeyError:
+            return
+        t0 = time.time()
+        state['warmed'].wait()
+        wait_time = time.time() - t0
+        state['cancel'].set()
+        warm_start, warm_end = state.get('warm', (t0, t0))
+        self.stats['files'] += 1
+        self.stats['prefetch_time'] += warm_end - warm_start
+        self.stats['wait_time'] += wait_time
+        # only the part of the warm-up done before the file was needed is
+        # hidden behind the processing of the previous file
+        self.stats['hidden_time'] += max(0., min(warm_end, t0) - warm_start)
+
+
+def _map_task(args):
+    func, name, filename, kwargs = args
+    try:
+        chain = TreeChain(name, [filename], **kwargs)
+    except RuntimeError:
+        log.warning("skipping file {0}".format(filename))
+        return None
+    return func(chain)
+
+
+def _reduce_outputs(left, right):
+    if isinstance(left, FilterList):
+        return FilterList.merge(left, right)
+    return left + right
+
+
+class TreeQueue(BaseTreeChain):
+    """
+    A chain over the files taken from a multiprocessing.Queue shared by many
+    workers. If an ``index`` (a ``rootpy.tree.index.DatasetIndex``) is given
+    then files without entries are skipped without opening them. Fill the
+    queue in the order of ``DatasetIndex.plan`` to balance the workers.
+
+    The queue may also hold (filename, first, last) work units, in which case
+    only the entries in [first, last) of that file are processed and
+    consecutive units of the same file reuse the open file. Fill the queue
+    with ``DatasetIndex.work_units`` so that large units are processed first
+    and idle workers pick up small units at the end.
+    """
     SENTINEL = None
 
-    def __init__(self, name, files, **kwargs):
+    def __init__(self, name, files, index=None, **kwargs):
         # multiprocessing.queues d.n.e. until one has been created
         multiprocessing.Queue()
         if not isinstance(files, multiprocessing.queues.Queue):
             raise TypeError("files must be a multiprocessing.Queue")
         self._files = files
+        self._index = index
 
         super(TreeQueue, self).__init__(name, **kwargs)
 
@@ -294,7 +986,19 @@ class TreeQueue(BaseTreeChain):
     __bool__ = __nonzero__
 
     def _next_file(self):
-        filename = self._files.get()
-        if filename == self.SENTINEL:
-            return None
-        return filename
+        while True:
+            unit = self._files.get()
+            if unit == self.SENTINEL:
+                return None
+            filename, entry_range = _work_unit(unit)
+            if entry_range is not None:
+                if entry_range[1] <= entry_range[0]:
+                    continue
+                return unit
+            if self._index is not None:
+                record = self._index.get(filename)
+                if record is not None and record['entries'] == 0:
+                    log.info("skipping file without entries: {0}".format(
+                        filename))
+                    continue
+            return filename
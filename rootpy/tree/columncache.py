@@ -0,0 +1,237 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements an on-disk cache of the columns of trees. The first
+time a branch of a tree is read with ``iterate`` all of its entries are
+stored in a raw ``.npy`` file keyed by the path, size and modification time
+of the file containing the tree, the name of the tree and the name of the
+branch. Later reads memory-map the ``.npy`` files instead of decompressing
+the baskets of the branch again. The least recently used columns are evicted
+when the total size of the cache exceeds its limit.
+
+.. sourcecode:: python
+
+   tree.column_cache = ColumnCache()
+   # the first pass reads the branches and stores them
+   for chunk in tree.iterate(['jet_pt', 'jet_eta']):
+       ...
+   # later passes only map the stored columns into memory
+   for chunk in tree.iterate(['jet_pt', 'jet_eta']):
+       ...
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import hashlib
+
+from .. import log; log = log[__name__]
+from .. import userdata
+from ..extern.shortuuid import uuid
+from ..utils.path import mkdir_p
+
+__all__ = [
+    'ColumnCache',
+]
+
+
+class ColumnCache(object):
+    """
+    A size-bounded cache of the columns of trees stored as ``.npy`` files.
+
+    Parameters
+    ----------
+    path : str, optional (default=None)
+        The directory in which the columns are stored. By default this is
+        ``columns`` in the rootpy user data directory.
+
+    max_size : int, optional (default=10 GB)
+        The maximum total size in bytes of the stored columns. The least
+        recently used columns are removed when a new column exceeds it.
+    """
+    def __init__(self, path=None, max_size=10 * 1024 ** 3):
+        if path is None:
+            path = os.path.join(userdata.DATA_ROOT, 'columns')
+        self.path = path
+        self.max_size = max_size
+        # the (key, branch) pairs of columns that cannot be stored
+        self._uncacheable = set()
+
+    def key(self, tree):
+        """
+        Return the key of a tree. A tree that is not read from a file cannot
+        be cached and None is returned.
+        """
+        directory = tree.GetDirectory()
+        if not directory:
+            return None
+        rootfile = directory.GetFile()
+        if not rootfile:
+            return None
+        filename = os.path.abspath(rootfile.GetName())
+        if not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        key = '\n'.join([
+            directory.GetPath().split(':', 1)[-1],
+            tree.GetName(),
+            filename,
+            str(stat.st_size),
+            repr(stat.st_mtime)])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _filename(self, key, branch):
+        if not re.match(r'^[\w.-]+$', branch):
+            branch = hashlib.sha1(branch.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key, branch + '.npy')
+
+    def get(self, tree, branches):
+        """
+        Return a dict mapping the names of the cached branches of a tree to
+        read-only memory-mapped arrays of all entries
+        """
+        import numpy as np
+        key = self.key(tree)
+        if key is None:
+            return {}
+        columns = {}
+        for branch in branches:
+            filename = self._filename(key, branch)
+            if not os.path.exists(filename):
+                continue
+            try:
+                columns[branch] = np.load(filename, mmap_mode='r')
+            except (IOError, ValueError):
+                log.warning(
+                    "ignoring unreadable cached column {0}".format(filename))
+                continue
+            # the modification time orders the columns for eviction
+            os.utime(filename, None)
+        return columns
+
+    def build(self, tree, branches, read, step_size=100000):
+        """
+        Read all entries of the branches of a tree in chunks with
+        ``read(branches, start, stop)`` (returning a structured array),
+        store the columns and return a dict of the memory-mapped columns.
+        Columns of variable-length or object types are not read or stored.
+        """
+        from numpy.lib.format import open_memmap
+        from .fastio import _branch_dtype
+        key = self.key(tree)
+        total_entries = int(tree.GetEntries())
+        if key is None or total_entries == 0:
+            return {}
+        # only read the branches of basic types and fixed-length arrays
+        fixed = []
+        for name in branches:
+            if _branch_dtype(tree.GetBranch(name)) is None:
+                self._uncacheable.add((key, name))
+            else:
+                fixed.append(name)
+        branches = fixed
+        if not branches:
+            return {}
+        mkdir_p(os.path.join(self.path, key))
+        outputs = {}
+        tmp_filenames = {}
+        try:
+            for start in range(0, total_entries, step_size):
+                stop = min(start + step_size, total_entries)
+                rec = read(branches, start, stop)
+                if start == 0:
+                    for name in rec.dtype.names:
+                        column = rec[name]
+                        if column.dtype.hasobject:
+                            self._uncacheable.add((key, name))
+                            continue
+                        tmp_filenames[name] = '{0}.{1}.tmp'.format(
+                            self._filename(key, name), uuid())
+                        outputs[name] = open_memmap(
+                            tmp_filenames[name], mode='w+',
+                            dtype=column.dtype,
+                            shape=(total_entries,) + column.shape[1:])
+                for name, output in outputs.items():
+                    output[start:stop] = rec[name]
+            for output in outputs.values():
+                output.flush()
+            del outputs
+            # rename so that concurrent jobs never read a partial column
+            for name, tmp_filename in tmp_filenames.items():
+                os.rename(tmp_filename, self._filename(key, name))
+        finally:
+            for tmp_filename in tmp_filenames.values():
+                if os.path.exists(tmp_filename):
+                    os.unlink(tmp_filename)
+        self.evict()
+        return self.get(tree, list(tmp_filenames.keys()))
+
+    def columns(self, tree, branches, read, step_size=100000):
+        """
+        Return a dict mapping the names of the branches of a tree that can be
+        cached to memory-mapped arrays of all entries, storing the branches
+        that are not cached yet (see ``build``)
+        """
+        key = self.key(tree)
+        if key is None:
+            return {}
+        columns = self.get(tree, branches)
+        missing = [name for name in branches
+                   if name not in columns and
+                   (key, name) not in self._uncacheable]
+        if missing:
+            log.info("caching {0:d} column{1} of tree {2}".format(
+                len(missing), 's' if len(missing) != 1 else '',
+                tree.GetName()))
+            columns.update(self.build(tree, missing, read,
+                                      step_size=step_size))
+        return columns
+
+    def size(self):
+        """
+        Return the total size in bytes of the stored columns
+        """
+        return sum(size for _, size, _ in self._columns())
+
+    def _columns(self):
+        columns = []
+        if not os.path.isdir(self.path):
+            return columns
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith('.npy'):
+                    continue
+                filename = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                columns.append((stat.st_mtime, stat.st_size, filename))
+        return columns
+
+    def evict(self):
+        """
+        Remove the least recently used columns until the total size of the
+        cache is within ``max_size``
+        """
+        columns = sorted(self._columns())
+        total = sum(size for _, size, _ in columns)
+        for mtime, size, filename in columns:
+            if total <= self.max_size:
+                break
+            log.debug("evicting cached column {0}".format(filename))
+            try:
+                os.unlink(filename)
+            except OSError:
+                continue
+            total -= size
+            dirname = os.path.dirname(filename)
+            if not os.listdir(dirname):
+                os.rmdir(dirname)
+
+    def clear(self):
+        """
+        Remove all stored columns
+        """
+        for _, _, filename in self._columns():
+            os.unlink(filename)
@@ -2,6 +2,9 @@
 # distributed under the terms of the GNU General Public License
 from __future__ import absolute_import
 
+import __future__
+import ast
+import copy
 import re
 import sys
 if sys.version_info[0] >= 3:
@@ -56,6 +59,383 @@ _TERNARY = re.compile(
     '(?P<name>\w+)'
     '(?P<right>[<>=]+[a-zA-Z0-9_\.]+)')
 
+# TTreeFormula functions and their NumPy equivalents
+_FUNCTIONS = {
+    'abs': 'abs', 'fabs': 'abs', 'Abs': 'abs',
+    'sqrt': 'sqrt', 'Sqrt': 'sqrt',
+    'exp': 'exp', 'Exp': 'exp',
+    'log': 'log', 'Log': 'log',
+    'log10': 'log10', 'Log10': 'log10',
+    'pow': 'power', 'Power': 'power',
+    'sin': 'sin', 'Sin': 'sin',
+    'cos': 'cos', 'Cos': 'cos',
+    'tan': 'tan', 'Tan': 'tan',
+    'asin': 'arcsin', 'ASin': 'arcsin',
+    'acos': 'arccos', 'ACos': 'arccos',
+    'atan': 'arctan', 'ATan': 'arctan',
+    'atan2': 'arctan2', 'ATan2': 'arctan2',
+    'sinh': 'sinh', 'SinH': 'sinh',
+    'cosh': 'cosh', 'CosH': 'cosh',
+    'tanh': 'tanh', 'TanH': 'tanh',
+    'floor': 'floor', 'Floor': 'floor',
+    'ceil': 'ceil', 'Ceil': 'ceil',
+    'min': 'minimum', 'Min': 'minimum',
+    'max': 'maximum', 'Max': 'maximum',
+    'Hypot': 'hypot',
+}
+
+_NUMPY = '_rootpy_np'
+_COLUMNS = '_rootpy_columns'
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<name>[A-Za-z_]\w*)|
+    (?P<op>&&|\|\||==|!=|<=|>=|[-+*/%^<>!&|(),\[\].]))""", re.VERBOSE)
+
+# the binary operators of TTreeFormula from the lowest to the highest
+# precedence (as in C) and their Python equivalents
+_BINARY_OPS = [
+    {'||': 'or'},
+    {'&&': 'and'},
+    {'|': '|'},
+    {'&': '&'},
+    {'==': '==', '!=': '!='},
+    {'<': '<', '<=': '<=', '>': '>', '>=': '>='},
+    {'+': '+', '-': '-'},
+    {'*': '*', '/': '/', '%': '%'},
+]
+# the level of the comparisons that may be chained as in Python
+# (a < b < c means (a < b) && (b < c))
+_CHAINED_OPS = 5
+
+
+class _FormulaParser(object):
+    """
+    Translate a TTreeFormula expression into a fully parenthesized Python
+    expression so that the operators keep the precedence they have in
+    TTreeFormula: ``!`` and unary minus bind more tightly than the
+    arithmetic operators, ``^`` is the power operator and binds more tightly
+    than unary minus, and the bitwise ``&`` and ``|`` bind less tightly than
+    the comparisons.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = _TOKEN.match(expression, pos)
+            if match is None:
+                raise self.error()
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        self.pos = 0
+
+    def error(self):
+        return SyntaxError(
+            "unable to compile the cut `{0}`".format(self.expression))
+
+    def peek_op(self):
+        if self.pos < len(self.tokens):
+            kind, text = self.tokens[self.pos]
+            if kind == 'op':
+                return text
+        return None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise self.error()
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def expect(self, op):
+        if self.peek_op() != op:
+            raise self.error()
+        self.pos += 1
+
+    def parse(self):
+        source = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise self.error()
+        return source
+
+    def binary(self, level):
+        if level == len(_BINARY_OPS):
+            return self.unary()
+        ops = _BINARY_OPS[level]
+        parts = [self.binary(level + 1)]
+        while self.peek_op() in ops:
+            parts.append(ops[self.next()[1]])
+            parts.append(self.binary(level + 1))
+            if level != _CHAINED_OPS:
+                parts = ['({0})'.format(' '.join(parts))]
+        if len(parts) == 1:
+            return parts[0]
+        return '({0})'.format(' '.join(parts))
+
+    def unary(self):
+        op = self.peek_op()
+        if op in ('-', '+', '!'):
+            self.next()
+            return '({0} {1})'.format(
+                'not' if op == '!' else op, self.unary())
+        source = self.postfix()
+        if self.peek_op() == '^':
+            self.next()
+            # the exponent may have a sign
+            return '({0} ** {1})'.format(source, self.unary())
+        return source
+
+    def postfix(self):
+        kind, text = self.next()
+        if kind == 'number':
+            source = text
+        elif kind == 'name':
+            source = text
+            if self.peek_op() == '(':
+                self.next()
+                args = []
+                if self.peek_op() != ')':
+                    args.append(self.binary(0))
+                    while self.peek_op() == ',':
+                        self.next()
+                        args.append(self.binary(0))
+                self.expect(')')
+                source = '{0}({1})'.format(text, ', '.join(args))
+        elif text == '(':
+            source = '({0})'.format(self.binary(0))
+            self.expect(')')
+        else:
+            raise self.error()
+        while True:
+            op = self.peek_op()
+            if op == '[':
+                self.next()
+                source = '{0}[{1}]'.format(source, self.binary(0))
+                self.expect(']')
+            elif op == '.':
+                self.next()
+                kind, text = self.next()
+                if kind != 'name':
+                    raise self.error()
+                source = '{0}.{1}'.format(source, text)
+            else:
+                return source
+
+
+def _numpy_func(name, node):
+    func = ast.Attribute(
+        value=ast.Name(id=_NUMPY, ctx=ast.Load()),
+        attr=name, ctx=ast.Load())
+    return ast.copy_location(func, node)
+
+
+def _subscript_index(node):
+    # Python < 3.9 wraps subscript indices in ast.Index
+    index = node.slice
+    if hasattr(ast, 'Index') and isinstance(index, ast.Index):
+        index = index.value
+    return index
+
+
+class _VectorizeTransformer(ast.NodeTransformer):
+    """
+    Rewrite a Python AST translated from a TTreeFormula expression into an
+    AST of NumPy operations on a dict of column arrays
+    """
+    def __init__(self):
+        self.branches = []
+
+    def column(self, name, node):
+        if name not in self.branches:
+            self.branches.append(name)
+        if sys.version_info >= (3, 8):
+            key = ast.Constant(value=name)
+        else:
+            key = ast.Str(s=name)
+        if sys.version_info < (3, 9):
+            key = ast.Index(value=key)
+        column = ast.Subscript(
+            value=ast.Name(id=_COLUMNS, ctx=ast.Load()),
+            slice=key, ctx=ast.Load())
+        return ast.copy_location(column, node)
+
+    def logical(self, func, values, node):
+        values = [self.visit(value) for value in values]
+        result = values[0]
+        for value in values[1:]:
+            result = ast.Call(
+                func=_numpy_func(func, node),
+                args=[result, value], keywords=[])
+        return ast.copy_location(result, node)
+
+    def visit_BoolOp(self, node):
+        if isinstance(node.op, ast.And):
+            return self.logical('logical_and', node.values, node)
+        return self.logical('logical_or', node.values, node)
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return ast.copy_location(ast.Call(
+                func=_numpy_func('logical_not', node),
+                args=[self.visit(node.operand)], keywords=[]), node)
+        return self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        if len(node.ops) == 1:
+            return self.generic_visit(node)
+        # a chained comparison a < b < c means (a < b) && (b < c)
+        operands = [node.left] + node.comparators
+        # each inner operand appears in two comparisons and is transformed
+        # in place when visited so each comparison gets its own copy
+        comparisons = [
+            ast.copy_location(ast.Compare(
+                left=copy.deepcopy(operands[i]), ops=[op],
+                comparators=[copy.deepcopy(operands[i + 1])]), node)
+            for i, op in enumerate(node.ops)]
+        return self.logical('logical_and', comparisons, node)
+
+    def visit_BinOp(self, node):
+        # the bitwise operators and the modulo of TTreeFormula convert their
+        # operands to integers (truncating towards zero as in C)
+        funcs = {
+            ast.BitAnd: 'bitwise_and',
+            ast.BitOr: 'bitwise_or',
+            ast.Mod: 'fmod',
+        }
+        func = funcs.get(type(node.op))
+        if func is None:
+            return self.generic_visit(node)
+        operands = [
+            ast.Call(
+                func=ast.Attribute(
+                    value=ast.Call(
+                        func=_numpy_func('asarray', node),
+                        args=[self.visit(operand)], keywords=[]),
+                    attr='astype', ctx=ast.Load()),
+                args=[_numpy_func('int64', node)], keywords=[])
+            for operand in (node.left, node.right)]
+        return ast.copy_location(ast.Call(
+            func=_numpy_func(func, node),
+            args=operands, keywords=[]), node)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name):
+            raise SyntaxError("unsupported function call in cut")
+        name = node.func.id
+        if name not in _FUNCTIONS:
+            raise SyntaxError(
+                "unsupported function `{0}` in cut".format(name))
+        return ast.copy_location(ast.Call(
+            func=_numpy_func(_FUNCTIONS[name], node),
+            args=[self.visit(arg) for arg in node.args],
+            keywords=[]), node)
+
+    def visit_Subscript(self, node):
+        # element of a fixed-length array branch: x[2] -> x[:, 2]
+        if not isinstance(node.value, (ast.Name, ast.Attribute)):
+            raise SyntaxError("unsupported subscript in cut")
+        index = ast.Tuple(
+            elts=[ast.Slice(lower=None, upper=None, step=None),
+                  self.visit(_subscript_index(node))],
+            ctx=ast.Load())
+        if sys.version_info < (3, 9):
+            index = ast.Index(value=index)
+        return ast.copy_location(ast.Subscript(
+            value=self.visit(node.value), slice=index,
+            ctx=ast.Load()), node)
+
+    def visit_Attribute(self, node):
+        # a.b refers to the branch a.b (split objects)
+        parts = []
+        value = node
+        while isinstance(value, ast.Attribute):
+            parts.append(value.attr)
+            value = value.value
+        if not isinstance(value, ast.Name):
+            raise SyntaxError("unsupported attribute access in cut")
+        parts.append(value.id)
+        return self.column('.'.join(reversed(parts)), node)
+
+    def visit_Name(self, node):
+        return self.column(node.id, node)
+
+
+def _as_double(column):
+    """
+    Convert a numeric column to double precision since TTreeFormula
+    evaluates all arithmetic in double precision
+    """
+    import numpy as np
+    dtype = getattr(column, 'dtype', None)
+    if dtype is not None and dtype.kind in 'biuf':
+        return column.astype(np.float64, copy=False)
+    return column
+
+
+def _num_entries(columns):
+    if hasattr(columns, 'n_entries'):
+        # a chunk yielded by iterate
+        return columns.n_entries
+    if hasattr(columns, 'dtype'):
+        # a structured array
+        return len(columns)
+    for column in columns.values():
+        return len(column)
+    return 0
+
+
+class CompiledCut(object):
+    """
+    A selection or weight expression compiled into vectorized NumPy
+    operations. Call it with a dict of column arrays (such as the chunks
+    yielded by ``Tree.iterate``) or a NumPy structured array to evaluate the
+    expression for all entries at once. As in TTreeFormula, numeric columns
+    are evaluated in double precision.
+
+    Attributes
+    ----------
+    branches : list
+        The names of the columns required to evaluate the expression.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        self.branches = []
+        self._code = None
+        if not expression:
+            return
+        # translate TTreeFormula syntax into Python syntax
+        source = _FormulaParser(expression.replace('TMath::', '')).parse()
+        try:
+            node = ast.parse(source, mode='eval')
+        except SyntaxError:
+            raise SyntaxError(
+                "unable to compile the cut `{0}`".format(expression))
+        transformer = _VectorizeTransformer()
+        node = ast.fix_missing_locations(transformer.visit(node))
+        self.branches = transformer.branches
+        self._code = compile(node, '<cut {0}>'.format(expression), 'eval',
+                             __future__.division.compiler_flag, True)
+
+    def __call__(self, columns):
+        import numpy as np
+        if self._code is None:
+            # the empty cut selects everything
+            return np.ones(_num_entries(columns), dtype=np.bool_)
+        namespace = {
+            _NUMPY: np,
+            _COLUMNS: dict([
+                (name, _as_double(columns[name])) for name in self.branches]),
+        }
+        result = eval(self._code, namespace)
+        if np.ndim(result) == 0:
+            # a constant expression
+            result = np.repeat(result, _num_entries(columns))
+        return result
+
+    def __repr__(self):
+        return "CompiledCut('{0}')".format(self.expression)
+
 
 class Cut(QROOT.TCut):
     """
@@ -270,6 +650,16 @@ class Cut(QROOT.TCut):
             '!(?!=)', '~',
             str(self).replace('&&', '&').replace('||', '|'))
 
+    def compile(self):
+        """
+        Compile this cut into a vectorized NumPy callable that evaluates the
+        cut on a dict of column arrays or a structured array and returns one
+        value per entry (a boolean mask for selections or the value of the
+        expression for weights). The callable's ``branches`` attribute lists
+        the columns required to evaluate it.
+        """
+        return CompiledCut(str(self))
+
     def replace(self, name, newname):
         """
         Replace all occurrences of name with newname
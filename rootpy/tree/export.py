@@ -0,0 +1,213 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements chunked exporters of trees into columnar formats
+(Parquet, Arrow IPC streams and NumPy npz archives) and CSV. The entries are
+read in chunks with ``iterate`` so the memory used is bounded by the chunk
+size instead of the size of the tree.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+from .treetypes import BaseChar, Bool, BoolArray
+
+__all__ = [
+    'to_parquet',
+    'to_arrow',
+    'to_npz',
+    'write_csv',
+]
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    return value.rstrip('\0')
+
+
+def _char_column(column):
+    """
+    Return the strings held by a char or char array column
+    """
+    if column.dtype.kind == 'O' or column.dtype.kind in 'SU':
+        return [_text(value) for value in column]
+    if column.ndim == 1:
+        return [_text(bytes(bytearray([value & 0xff]))) for value in column]
+    return [_text(bytes(bytearray(row.astype('uint8'))))
+            for row in column]
+
+
+def _column_values(value, column):
+    """
+    Return a column with its values converted for export: strings for char
+    and string branches and integers for boolean branches
+    """
+    if isinstance(value, BaseChar):
+        return _char_column(column)
+    if column.dtype.kind == 'O':
+        # std::string
+        return [_text(item) for item in column]
+    if isinstance(value, (Bool, BoolArray)):
+        return column.astype('int8')
+    return column
+
+
+def _chunks(source, branchdict, step_size, stop=None):
+    """
+    Yield dicts mapping branch names to converted columns
+    """
+    for chunk in source.iterate(list(branchdict.keys()),
+                                step_size=step_size, stop=stop):
+        yield dict([
+            (name, _column_values(value, chunk[name]))
+            for name, value in branchdict.items()])
+
+
+def write_csv(source, branchdict, stream, sep=',', limit=None,
+              step_size=10000):
+    """
+    Write the entries of a tree as CSV lines, one block of lines per chunk
+    """
+    for chunk in _chunks(source, branchdict, step_size, stop=limit):
+        tokens = []
+        for name in branchdict.keys():
+            column = chunk[name]
+            if isinstance(column, list):
+                tokens.append(column)
+            elif column.ndim == 1:
+                tokens.append([str(item) for item in column.tolist()])
+            else:
+                # expand arrays to f[0],f[1],f[2],...
+                tokens.append([sep.join(map(str, row))
+                               for row in column.reshape(
+                                   len(column), -1).tolist()])
+        lines = [sep.join(line) for line in zip(*tokens)]
+        if lines:
+            stream.write('\n'.join(lines) + '\n')
+
+
+def _arrow_batches(source, branchdict, step_size):
+    import pyarrow as pa
+    names = list(branchdict.keys())
+    for chunk in _chunks(source, branchdict, step_size):
+        arrays = []
+        for name in names:
+            column = chunk[name]
+            if isinstance(column, list):
+                arrays.append(pa.array(column, type=pa.string()))
+            elif column.ndim == 1:
+                arrays.append(pa.array(column))
+            else:
+                # fixed-length arrays become fixed-size lists of the
+                # flattened inner dimensions
+                flat = column.reshape(len(column), -1)
+                arrays.append(pa.FixedSizeListArray.from_arrays(
+                    pa.array(flat.ravel()), flat.shape[1]))
+        yield pa.RecordBatch.from_arrays(arrays, names)
+
+
+def to_arrow(source, branchdict, sink, step_size=100000):
+    """
+    Write the entries of a tree as an Arrow IPC stream of record batches
+    """
+    import pyarrow as pa
+    writer = None
+    try:
+        for batch in _arrow_batches(source, branchdict, step_size):
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def to_parquet(source, branchdict, path, step_size=100000,
+               compression='snappy'):
+    """
+    Write the entries of a tree into a Parquet file with one row group per
+    chunk
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for batch in _arrow_batches(source, branchdict, step_size):
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    path, batch.schema, compression=compression)
+            writer.write_table(pa.Table.from_batches([batch]))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def to_npz(source, branchdict, path, n_entries, step_size=100000,
+           compressed=True):
+    """
+    Write the entries of a tree into a NumPy npz archive with one array per
+    branch. Numeric columns are streamed into memory-mapped ``.npy`` files
+    that are then added to the archive. The chunks of string columns are
+    saved separately and concatenated into a memory-mapped ``.npy`` file
+    once the length of the longest string is known.
+    """
+    import numpy as np
+    from numpy.lib.format import open_memmap
+    tmpdir = tempfile.mkdtemp()
+    try:
+        outputs = {}
+        # the chunk files and the longest length of each string column
+        strings = {}
+        start = 0
+        for ichunk, chunk in enumerate(
+                _chunks(source, branchdict, step_size)):
+            size = 0
+            for name, column in chunk.items():
+                size = len(column)
+                if isinstance(column, list):
+                    column = np.array(column, dtype=np.str_)
+                    filename = os.path.join(
+                        tmpdir, '{0}.{1:d}.npy'.format(name, ichunk))
+                    np.save(filename, column)
+                    files, length = strings.get(name, ([], 1))
+                    files.append(filename)
+                    strings[name] = (
+                        files, max(length, column.dtype.itemsize // 4))
+                    continue
+                if name not in outputs:
+                    outputs[name] = open_memmap(
+                        os.path.join(tmpdir, name + '.npy'), mode='w+',
+                        dtype=column.dtype,
+                        shape=(n_entries,) + column.shape[1:])
+                outputs[name][start:start + size] = column
+            start += size
+        for name, (files, length) in strings.items():
+            output = open_memmap(
+                os.path.join(tmpdir, name + '.npy'), mode='w+',
+                dtype='U{0:d}'.format(length), shape=(start,))
+            offset = 0
+            for filename in files:
+                column = np.load(filename)
+                output[offset:offset + len(column)] = column
+                offset += len(column)
+                os.unlink(filename)
+            outputs[name] = output
+        for output in outputs.values():
+            output.flush()
+        del outputs
+        compression = (zipfile.ZIP_DEFLATED if compressed
+                       else zipfile.ZIP_STORED)
+        archive = zipfile.ZipFile(path, 'w', compression, allowZip64=True)
+        try:
+            for name in branchdict.keys():
+                filename = os.path.join(tmpdir, name + '.npy')
+                if os.path.exists(filename):
+                    archive.write(filename, name + '.npy')
+        finally:
+            archive.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,451 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements compiled loops that move many tree entries between
+ROOT and contiguous memory (i.e. NumPy arrays) in a single call from Python.
+"""
+from __future__ import absolute_import
+
+import re
+
+import ROOT
+
+from .. import compiled as C
+from ..extern.six import string_types
+from .cut import Cut
+
+__all__ = [
+    'fill_tree',
+    'fill_ntuple',
+    'read_tree',
+    'fill_hist',
+]
+
+C.register_code("""
+    #include <vector>
+    #include "TTree.h"
+    #include "TNtuple.h"
+    #include "TBranch.h"
+
+    // Point the address of each branch at the memory of an array and
+    // advance through the arrays, filling the tree once per entry
+    class _rootpy_ArrayFiller {
+    public:
+        void add(TBranch* branch, Long_t address, Long_t stride) {
+            branches.push_back(branch);
+            addresses.push_back(address);
+            strides.push_back(stride);
+        }
+
+        Long64_t fill(TTree* tree, Long64_t n_entries) {
+            const size_t n_branches = branches.size();
+            Long64_t nbytes = 0;
+            for (Long64_t i = 0; i < n_entries; ++i) {
+                for (size_t j = 0; j < n_branches; ++j) {
+                    branches[j]->SetAddress(
+                        (void*)(addresses[j] + i * strides[j]));
+                }
+                Int_t status = tree->Fill();
+                if (status < 0) {
+                    return -1;
+                }
+                nbytes += status;
+            }
+            return nbytes;
+        }
+
+    private:
+        std::vector<TBranch*> branches;
+        std::vector<Long_t> addresses;
+        std::vector<Long_t> strides;
+    };
+
+    // Fill an ntuple from a C-contiguous (n_entries, n_vars) array of floats
+    Long64_t _rootpy_fill_ntuple(TNtuple* ntuple, Long_t address,
+                                 Long64_t n_entries) {
+        const Float_t* data = (const Float_t*)address;
+        const Int_t n_vars = ntuple->GetNvar();
+        Long64_t nbytes = 0;
+        for (Long64_t i = 0; i < n_entries; ++i) {
+            Int_t status = ntuple->Fill(data + i * n_vars);
+            if (status < 0) {
+                return -1;
+            }
+            nbytes += status;
+        }
+        return nbytes;
+    }
+""", ["_rootpy_ArrayFiller", "_rootpy_fill_ntuple"])
+
+C.register_code("""
+    #include <vector>
+    #include "TTree.h"
+    #include "TBranch.h"
+    #include "TTreeFormula.h"
+    #include "TH1.h"
+
+    // Point the address of each branch at the memory of an array and
+    // advance through the arrays, reading one row per selected entry.
+    // The row is only advanced when an entry passes the selection.
+    class _rootpy_ArrayReader {
+    public:
+        _rootpy_ArrayReader(): selection(0) {}
+
+        ~_rootpy_ArrayReader() {
+            delete selection;
+        }
+
+        void add(TBranch* branch, Long_t address, Long_t stride) {
+            branches.push_back(branch);
+            addresses.push_back(address);
+            strides.push_back(stride);
+        }
+
+        bool select(TTree* tree, const char* expression) {
+            delete selection;
+            selection = new TTreeFormula(
+                "_rootpy_selection", expression, tree);
+            if (selection->GetNdim() == 0) {
+                delete selection;
+                selection = 0;
+                return false;
+            }
+            return true;
+        }
+
+        Long64_t read(TTree* tree, Long64_t start, Long64_t stop,
+                      Long64_t step) {
+            const size_t n_branches = branches.size();
+            Long64_t n = 0;
+            for (Long64_t entry = start; entry < stop; entry += step) {
+                Long64_t local = tree->LoadTree(entry);
+                if (local < 0) {
+                    return -1;
+                }
+                // point the branches at the next row before the selection
+                // reads the entry so that a branch of both the selection and
+                // the output never overwrites a row already read
+                for (size_t j = 0; j < n_branches; ++j) {
+                    branches[j]->SetAddress(
+                        (void*)(addresses[j] + n * strides[j]));
+                }
+                if (selection != 0) {
+                    // an entry is selected if any instance is true
+                    const Int_t n_instances = selection->GetNdata();
+                    bool selected = false;
+                    for (Int_t i = 0; i < n_instances; ++i) {
+                        if (selection->EvalInstance(i) != 0) {
+                            selected = true;
+                            break;
+                        }
+                    }
+                    if (!selected) {
+                        continue;
+                    }
+                }
+                for (size_t j = 0; j < n_branches; ++j) {
+                    if (branches[j]->GetEntry(local) < 0) {
+                        return -1;
+                    }
+                }
+                ++n;
+            }
+            return n;
+        }
+
+    private:
+        TTreeFormula* selection;
+        std::vector<TBranch*> branches;
+        std::vector<Long_t> addresses;
+        std::vector<Long_t> strides;
+    };
+
+    // Fill a histogram with n points of dim coordinates from a C-contiguous
+    // (n, dim) array of doubles and optional weights
+    void _rootpy_fill_hist(TH1* hist, Int_t dim, Long_t address,
+                           Long_t weights, Long64_t n) {
+        const Double_t* x = (const Double_t*)address;
+        const Double_t* w = (const Double_t*)weights;
+        for (Long64_t i = 0; i < n; ++i) {
+            const Double_t* p = x + i * dim;
+            const Double_t weight = w != 0 ? w[i] : 1.;
+            if (dim == 1) {
+                hist->Fill(p[0], weight);
+            } else if (dim == 2) {
+                hist->Fill(p[0], p[1], weight);
+            } else {
+                hist->Fill(p[0], p[1], p[2], weight);
+            }
+        }
+    }
+""", ["_rootpy_ArrayReader", "_rootpy_fill_hist"])
+
+# the NumPy types of the ROOT basic types
+_LEAF_DTYPES = {
+    'Bool_t': 'bool',
+    'Char_t': 'int8',
+    'UChar_t': 'uint8',
+    'Short_t': 'int16',
+    'UShort_t': 'uint16',
+    'Int_t': 'int32',
+    'UInt_t': 'uint32',
+    'Long_t': 'int64',
+    'ULong_t': 'uint64',
+    'Long64_t': 'int64',
+    'ULong64_t': 'uint64',
+    'Float_t': 'float32',
+    'Double_t': 'float64',
+}
+
+
+def _columns(arrays):
+    """
+    Return an ordered list of (name, array) pairs from a dict of arrays or a
+    structured array
+    """
+    import numpy as np
+    if isinstance(arrays, np.ndarray):
+        if arrays.dtype.names is None:
+            raise TypeError("arrays must be a dict or a structured array")
+        return [(name, arrays[name]) for name in arrays.dtype.names]
+    return [(name, np.asarray(array)) for name, array in arrays.items()]
+
+
+def fill_tree(tree, arrays):
+    """
+    Fill a tree with one entry per row of the arrays. Each array is matched
+    with the branch of the same name and that branch's address is advanced
+    through the array memory. Branches without a matching array are filled
+    with the current values in the tree buffer.
+    Return the number of bytes written.
+    """
+    import numpy as np
+    columns = _columns(arrays)
+    if not columns:
+        raise ValueError("no arrays to fill")
+    n_entries = len(columns[0][1])
+    filler = C._rootpy_ArrayFiller()
+    # keep any converted arrays alive until the loop is done
+    keep = []
+    for name, column in columns:
+        if len(column) != n_entries:
+            raise ValueError(
+                "array `{0}` has length {1:d} but expected {2:d}".format(
+                    name, len(column), n_entries))
+        if name not in tree._buffer:
+            raise ValueError(
+                "the tree has no branch `{0}` in its buffer".format(name))
+        value = tree._buffer[name]
+        if not hasattr(value, 'typecode'):
+            raise TypeError(
+                "branch `{0}` is not a scalar or array type".format(name))
+        dtype = np.dtype(value.typecode)
+        shape = (len(value),) if column.ndim > 1 else ()
+        if column.shape[1:] != shape or (not shape and len(value) != 1):
+            raise ValueError(
+                "array `{0}` with shape {1} does not match the "
+                "branch length {2:d}".format(
+                    name, column.shape, len(value)))
+        # rows may be strided (i.e. fields of a structured array) but the
+        # elements within one row must be contiguous
+        if column.dtype != dtype or (
+                column.ndim > 1 and column.strides[1] != dtype.itemsize):
+            column = np.ascontiguousarray(column, dtype=dtype)
+        keep.append(column)
+        branch = tree.GetBranch(name)
+        filler.add(branch, column.ctypes.data, column.strides[0])
+    try:
+        nbytes = filler.fill(tree, n_entries)
+    finally:
+        # point the branches back at the buffer
+        for name, column in columns:
+            tree.SetBranchAddress(name.encode('utf-8'), tree._buffer[name])
+    if nbytes < 0:
+        raise IOError("failed to fill tree `{0}`".format(tree.GetName()))
+    return nbytes
+
+
+def fill_ntuple(ntuple, arrays):
+    """
+    Fill an ntuple with one entry per row of the arrays in the order of the
+    ntuple variables. Return the number of bytes written.
+    """
+    import numpy as np
+    columns = dict(_columns(arrays))
+    names = [leaf.GetName() for leaf in ntuple.GetListOfLeaves()]
+    missing = [name for name in names if name not in columns]
+    if missing:
+        raise ValueError(
+            "missing arrays for ntuple variables: {0}".format(
+                ', '.join(missing)))
+    data = np.empty((len(columns[names[0]]), len(names)), dtype=np.float32)
+    for i, name in enumerate(names):
+        data[:, i] = columns[name]
+    nbytes = C._rootpy_fill_ntuple(ntuple, data.ctypes.data, len(data))
+    if nbytes < 0:
+        raise IOError("failed to fill ntuple `{0}`".format(ntuple.GetName()))
+    return nbytes
+
+
+def _branch_dtype(branch):
+    """
+    Return the NumPy type and shape of a branch holding one basic type or a
+    fixed-length array of a basic type or None if the branch is not supported
+    """
+    if not isinstance(branch, ROOT.TBranch) or branch.GetListOfBranches():
+        return None
+    leaves = branch.GetListOfLeaves()
+    if leaves.GetEntries() != 1:
+        return None
+    leaf = leaves.At(0)
+    dtype = _LEAF_DTYPES.get(leaf.GetTypeName())
+    if dtype is None or leaf.GetLeafCount():
+        return None
+    length = leaf.GetLenStatic()
+    if length == 1:
+        return dtype, ()
+    shape = tuple(int(dim) for dim in re.findall(
+        r'\[(\d+)\]', branch.GetTitle()))
+    product = 1
+    for dim in shape:
+        product *= dim
+    if product != length:
+        shape = (length,)
+    return dtype, shape
+
+
+def read_tree(tree, branches=None, selection=None, object_selection=None,
+              start=None, stop=None, step=None,
+              include_weight=False, weight_name='weight', cache_size=-1):
+    """
+    Read the branches of basic types and fixed-length arrays of basic types
+    of a tree into a NumPy structured array with one row per selected entry.
+    The branch addresses are pointed directly at the rows of the array and
+    the entries are read in a compiled loop. The parameters are those of
+    ``root_numpy.tree2array`` so that either may be used.
+
+    Parameters
+    ----------
+    tree : Tree
+        The tree to read.
+
+    branches : list, optional (default=None)
+        Only read these branches. If None, then all supported branches are
+        read and other branches are skipped.
+
+    selection : str or Cut, optional (default=None)
+        Only read the entries passing this selection. An entry is selected
+        if any instance of the selection is true.
+
+    object_selection : dict, optional (default=None)
+        Not supported since only basic types and fixed-length arrays are
+        read. A ValueError is raised if it is given.
+
+    start, stop, step : int, optional (default=None)
+        Only read the entries in ``range(start, stop, step)``.
+
+    include_weight : bool, optional (default=False)
+        If True, then include a column of the tree weight.
+
+    weight_name : str, optional (default='weight')
+        The name of the weight column.
+
+    cache_size : int, optional (default=-1)
+        The size in bytes of the TTreeCache of the tree. If negative, then
+        the cache of the tree is left unchanged.
+
+    Returns
+    -------
+    array : NumPy structured array
+    """
+    import numpy as np
+    if object_selection:
+        raise ValueError("object_selection is not supported")
+    if isinstance(branches, string_types):
+        branches = [branches]
+    if branches is None:
+        names = []
+        for branch in tree.GetListOfBranches():
+            if _branch_dtype(branch) is not None:
+                names.append(branch.GetName())
+    else:
+        names = list(branches)
+    fields = []
+    for name in names:
+        branch = tree.GetBranch(name)
+        if not branch:
+            raise ValueError("branch `{0}` does not exist".format(name))
+        dtype = _branch_dtype(branch)
+        if dtype is None:
+            raise TypeError(
+                "branch `{0}` is not a basic type or "
+                "a fixed-length array of a basic type".format(name))
+        fields.append((name,) + dtype)
+    if include_weight:
+        fields.append((weight_name, 'float64', ()))
+    if not fields:
+        raise RuntimeError("no supported branches to read")
+    if step is not None and step < 1:
+        raise ValueError("step must be at least 1")
+    start, stop, step = slice(start, stop, step).indices(
+        int(tree.GetEntries()))
+    n_entries = max(0, (stop - start + step - 1) // step)
+    array = np.empty(n_entries, dtype=[
+        (str(name), dtype, shape) for name, dtype, shape in fields])
+    if cache_size >= 0:
+        tree.SetCacheSize(cache_size)
+    reader = C._rootpy_ArrayReader()
+    if selection is not None and str(Cut(selection)):
+        # the TTreeFormula is part of libTreePlayer
+        ROOT.gSystem.Load('libTreePlayer')
+        if not reader.select(tree, str(Cut(selection))):
+            raise ValueError(
+                "invalid selection `{0}`".format(selection))
+    statuses = []
+    for name in names:
+        branch = tree.GetBranch(name)
+        statuses.append((name, tree.GetBranchStatus(name)))
+        tree.SetBranchStatus(name, 1)
+        reader.add(branch,
+                   array.ctypes.data + array.dtype.fields[name][1],
+                   array.strides[0])
+    n = reader.read(tree, start, stop, step) if n_entries else 0
+    # point the branches back at the tree buffer
+    buffer = getattr(tree, '_buffer', {})
+    for name, status in statuses:
+        if name in buffer:
+            tree.SetBranchAddress(name.encode('utf-8'), buffer[name])
+        else:
+            tree.GetBranch(name).ResetAddress()
+        tree.SetBranchStatus(name, status)
+    if n < 0:
+        raise IOError("failed to read tree `{0}`".format(tree.GetName()))
+    if n < n_entries:
+        # release the memory of the rows of unselected entries
+        array = array[:n].copy()
+    if include_weight:
+        array[weight_name] = tree.GetWeight()
+    return array
+
+
+def fill_hist(hist, array, weights=None):
+    """
+    Fill a 1, 2 or 3-dimensional histogram with the rows of an array of
+    shape (n,) or (n, dimension) in a compiled loop
+    """
+    import numpy as np
+    dim = hist.GetDimension()
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    if array.ndim != 2 or array.shape[1] != dim:
+        raise ValueError(
+            "array must have shape (n, {0:d}) "
+            "to fill a {0:d}-dimensional histogram".format(dim))
+    address = 0
+    if weights is not None:
+        weights = np.ascontiguousarray(weights, dtype=np.float64)
+        if weights.shape != (len(array),):
+            raise ValueError("weights must have the same length as array")
+        address = weights.ctypes.data
+    C._rootpy_fill_hist(hist, dim, array.ctypes.data, address, len(array))
@@ -6,6 +6,8 @@ The user must write a class which inherits from Filter and
 """
 from __future__ import absolute_import
 
+from timeit import default_timer
+
 #from ..extern.tabulartext import PrettyTable
 from . import log; log = log[__name__]
 
@@ -35,6 +37,9 @@ class Filter(object):
                  count_funcs=None):
         self.total = 0
         self.passing = 0
+        # only recorded when called by a timed FilterList
+        self.calls = 0
+        self.time = 0.
         self.count_funcs_total = {}
         self.count_funcs_passing = {}
 
@@ -43,7 +48,7 @@ class Filter(object):
         else:
             self.count_funcs = {}
 
-        for func_name in self.count_funcs.iterkeys():
+        for func_name in self.count_funcs.keys():
             self.count_funcs_total[func_name] = 0.
             self.count_funcs_passing[func_name] = 0.
 
@@ -73,6 +78,8 @@ class Filter(object):
             "name": self.name,
             "total": self.total,
             "passing": self.passing,
+            "calls": self.calls,
+            "time": self.time,
             "details": self.details,
             "count_funcs": dict([
                 (name, None) for name in self.count_funcs.keys()]),
@@ -83,6 +90,8 @@ class Filter(object):
         self.name = state['name']
         self.total = state['total']
         self.passing = state['passing']
+        self.calls = state.get('calls', 0)
+        self.time = state.get('time', 0.)
         self.details = state['details']
         self.count_funcs = state['count_funcs']
         self.count_funcs_total = state['count_funcs_total']
@@ -104,6 +113,8 @@ class Filter(object):
         newfilter.name = left.name
         newfilter.total = left.total + right.total
         newfilter.passing = left.passing + right.passing
+        newfilter.calls = left.calls + right.calls
+        newfilter.time = left.time + right.time
         newfilter.details = dict([
             (detail, left.details[detail] + right.details[detail])
             for detail in left.details.keys()])
@@ -128,7 +139,7 @@ class Filter(object):
     def passed(self, event):
         self.total += 1
         self.passing += 1
-        for name, func in self.count_funcs.iteritems():
+        for name, func in self.count_funcs.items():
             count = func(event)
             self.count_funcs_total[name] += count
             self.count_funcs_passing[name] += count
@@ -136,7 +147,7 @@ class Filter(object):
 
     def failed(self, event):
         self.total += 1
-        for name, func in self.count_funcs.iteritems():
+        for name, func in self.count_funcs.items():
             count = func(event)
             self.count_funcs_total[name] += count
         self.was_passed = False
@@ -224,7 +235,18 @@ class FilterList(list):
     """
     Creates a list of Filters for convenient evaluation of a
     sequence of Filters.
+
+    If ``timed`` is True then the wall time spent in and the number of calls
+    of each filter are recorded. The switch is checked once per call of the
+    list so it may be left on in production.
     """
+    # also the default of FilterLists pickled before timing was added
+    timed = False
+
+    def __init__(self, filters=(), timed=False):
+        super(FilterList, self).__init__(filters)
+        self.timed = timed
+
     @classmethod
     def merge(cls, list1, list2):
         if not isinstance(list1, list):
@@ -256,6 +278,41 @@ class FilterList(list):
             return self[-1].passing
         return 0
 
+    @property
+    def time(self):
+        """
+        The total wall time spent in all filters
+        """
+        return sum(filter.get('time', 0.) if isinstance(filter, dict)
+                   else filter.time for filter in self)
+
+    def report(self):
+        """
+        Print the cut-flow with the number of calls of and the wall time
+        spent in each filter
+        """
+        from ..utils.extras import print_table
+        total_time = self.time
+        table = [('Filter', 'Total', 'Pass', 'Calls', 'Time [s]',
+                  'Time/call [us]', 'Time [%]')]
+        for filter in self:
+            if isinstance(filter, dict):
+                _filter = Filter()
+                _filter.__setstate__(filter)
+                filter = _filter
+            if filter.calls:
+                timing = (
+                    '{0:d}'.format(filter.calls),
+                    '{0:.3f}'.format(filter.time),
+                    '{0:.2f}'.format(1e6 * filter.time / filter.calls),
+                    '{0:.1f}'.format(100. * filter.time / total_time
+                                     if total_time else 0.))
+            else:
+                timing = ('-', '-', '-', '-')
+            table.append((filter.name, str(filter.total),
+                          str(filter.passing)) + timing)
+        print_table(table)
+
     def basic(self):
         """
         Return all filters as simple dicts for pickling.
@@ -318,11 +375,23 @@ class FilterList(list):
 class EventFilterList(FilterList):
 
     def __call__(self, event):
+        if self.timed:
+            return self._timed_call(event)
         for filter in self:
             if not filter(event):
                 return False
         return True
 
+    def _timed_call(self, event):
+        for filter in self:
+            t0 = default_timer()
+            passes = filter(event)
+            filter.time += default_timer() - t0
+            filter.calls += 1
+            if not passes:
+                return False
+        return True
+
     def __setitem__(self, filter):
         if not isinstance(filter, EventFilter):
             raise TypeError(
@@ -345,9 +414,22 @@ class EventFilterList(FilterList):
 class ObjectFilterList(FilterList):
 
     def __call__(self, event, collection):
+        if self.timed:
+            return self._timed_call(event, collection)
+        passing_objects = collection
+        for filter in self:
+            passing_objects = filter(event, passing_objects)
+            if not passing_objects:
+                return []
+        return passing_objects
+
+    def _timed_call(self, event, collection):
         passing_objects = collection
         for filter in self:
+            t0 = default_timer()
             passing_objects = filter(event, passing_objects)
+            filter.time += default_timer() - t0
+            filter.calls += 1
             if not passing_objects:
                 return []
         return passing_objects
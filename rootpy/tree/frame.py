@@ -0,0 +1,252 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a lazy, declarative analysis graph over a Tree or
+TreeChain. New columns are defined and selections applied with ``define``
+and ``filter``, and results are requested with ``histo``, ``sum`` and
+``count``. Nothing is read until the value of a result is accessed, at which
+point all pending results are computed in a single loop over the source
+reading only the branches that the graph needs.
+
+.. sourcecode:: python
+
+   frame = TreeFrame(chain)
+   jets = frame.filter('njets>=2').define('mjj', 'sqrt(m2_jj)')
+   hist = jets.histo('mjj', Hist(50, 0, 500))
+   count = jets.count()
+   # the loop runs here, filling hist and computing count together
+   print(count.value)
+"""
+from __future__ import absolute_import
+
+from . import log; log = log[__name__]
+from .cut import Cut
+from .chain import BaseTreeChain
+from .booking import fill_hist
+from .filtering import Filter, FilterList
+
+__all__ = [
+    'TreeFrame',
+]
+
+
+class Result(object):
+    """
+    A lazily computed result of a TreeFrame. Accessing ``value`` runs the
+    event loop if the result has not been computed yet.
+    """
+    def __init__(self, frame, kind, expression=None, hist=None, weight=None):
+        self.frame = frame
+        self.kind = kind
+        self.expression = None
+        if expression is not None:
+            self.expression = Cut(expression).compile()
+        self.weight = None
+        if weight is not None:
+            self.weight = Cut(weight).compile()
+        self.hist = hist
+        self.done = False
+        if kind == 'histo':
+            self._value = hist
+        else:
+            self._value = 0
+
+    @property
+    def branches(self):
+        branches = []
+        if self.expression is not None:
+            branches += self.expression.branches
+        if self.weight is not None:
+            branches += self.weight.branches
+        return branches
+
+    @property
+    def value(self):
+        if not self.done:
+            self.frame._graph.run()
+        return self._value
+
+    def fill(self, columns, mask, tree_weight):
+        if self.kind == 'count':
+            self._value += int(mask.sum())
+            return
+        values = self.expression(columns)[mask]
+        if self.kind == 'sum':
+            self._value += values.sum()
+            return
+        weights = None
+        if self.weight is not None:
+            weights = self.weight(columns)[mask] * tree_weight
+        elif tree_weight != 1.:
+            weights = [tree_weight] * len(values)
+        fill_hist(self.hist, values, weights)
+
+
+class Graph(object):
+    """
+    The state shared by all nodes of a TreeFrame
+    """
+    def __init__(self, source, step_size):
+        self.source = source
+        self.step_size = step_size
+        self.pending = []
+        self.filters = []
+
+    def tree_weight(self):
+        if isinstance(self.source, BaseTreeChain):
+            return self.source.weight
+        return self.source.GetWeight()
+
+    def run(self):
+        results = self.pending
+        self.pending = []
+        if not results:
+            return
+        # only the nodes leading to pending results are evaluated
+        nodes = []
+        for result in results:
+            for node in result.frame.lineage():
+                if node not in nodes:
+                    nodes.append(node)
+        defined = set()
+        required = []
+        for node in nodes:
+            if node.kind == 'define':
+                defined.add(node.name)
+            for branch in node.branches:
+                if branch not in required:
+                    required.append(branch)
+        for result in results:
+            for branch in result.branches:
+                if branch not in required:
+                    required.append(branch)
+        branches = [name for name in required if name not in defined]
+        for node in nodes:
+            if node.kind == 'filter':
+                node.filter_counts.total = 0
+                node.filter_counts.passing = 0
+        log.info("reading {0:d} branches to compute {1:d} results".format(
+            len(branches), len(results)))
+        for chunk in self.source.iterate(branches, step_size=self.step_size):
+            tree_weight = self.tree_weight()
+            # each node is evaluated once per chunk
+            state = {}
+            for node in nodes:
+                state[node] = node.evaluate(chunk, state)
+            for result in results:
+                columns, mask = state[result.frame]
+                result.fill(columns, mask, tree_weight)
+        for result in results:
+            result.done = True
+
+
+class TreeFrame(object):
+    """
+    A node in a lazy analysis graph over a Tree or TreeChain.
+
+    Parameters
+    ----------
+    source : Tree or TreeChain
+        The source of the columns.
+
+    step_size : int, optional (default=100000)
+        The number of entries read at once.
+    """
+    def __init__(self, source, step_size=100000,
+                 parent=None, kind='source', name=None, expression=None):
+        if parent is None:
+            self._graph = Graph(source, step_size)
+        else:
+            self._graph = parent._graph
+        self.parent = parent
+        self.kind = kind
+        self.name = name
+        self.expression = None
+        if expression is not None:
+            self.expression = Cut(expression).compile()
+        if kind == 'filter':
+            self.filter_counts = Filter(name=name or str(expression))
+            self._graph.filters.append(self)
+
+    @property
+    def branches(self):
+        if self.expression is None:
+            return []
+        return self.expression.branches
+
+    def lineage(self):
+        """
+        The nodes from the source to this node
+        """
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        return nodes[::-1]
+
+    def evaluate(self, chunk, state):
+        if self.parent is None:
+            import numpy as np
+            return chunk, np.ones(chunk.n_entries, dtype=np.bool_)
+        columns, mask = state[self.parent]
+        if self.kind == 'define':
+            columns = columns.copy()
+            columns[self.name] = self.expression(columns)
+            return columns, mask
+        passing = mask & (self.expression(columns) != 0)
+        self.filter_counts.total += int(mask.sum())
+        self.filter_counts.passing += int(passing.sum())
+        return columns, passing
+
+    def define(self, name, expression):
+        """
+        Return a new node with an additional column ``name`` computed from
+        an expression of existing columns
+        """
+        return TreeFrame(None, parent=self, kind='define',
+                         name=name, expression=expression)
+
+    def filter(self, selection, name=None):
+        """
+        Return a new node keeping only entries passing a selection
+        """
+        return TreeFrame(None, parent=self, kind='filter',
+                         name=name, expression=selection)
+
+    def _result(self, *args, **kwargs):
+        result = Result(self, *args, **kwargs)
+        self._graph.pending.append(result)
+        return result
+
+    def histo(self, expression, hist, weight=None):
+        """
+        Request a histogram of an expression filled for entries passing all
+        filters of this node. The tree weight is applied as in ``Tree.Draw``.
+        """
+        return self._result('histo', expression, hist=hist, weight=weight)
+
+    def sum(self, expression):
+        """
+        Request the sum of an expression over entries passing all filters
+        """
+        return self._result('sum', expression)
+
+    def count(self):
+        """
+        Request the number of entries passing all filters
+        """
+        return self._result('count')
+
+    def run(self):
+        """
+        Compute all pending results now
+        """
+        self._graph.run()
+
+    def cutflow(self):
+        """
+        Return a FilterList with the number of entries seen and passing for
+        every filter in the graph
+        """
+        return FilterList([node.filter_counts for node in self._graph.filters])
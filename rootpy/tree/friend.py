@@ -0,0 +1,281 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements the join of a friend tree to the entries of other
+trees by the values of key branches, such as the run and event numbers. The
+keys of the friend are sorted once and the sorted index is stored in a
+``.npz`` file next to the friend file so that later jobs only load it. The
+index is rebuilt when the size or modification time of the friend file
+changes. The entries of each tree are matched to the entries of the friend
+with a vectorized binary search of the sorted keys before the tree is read,
+so that looking up the friend entry of each entry is a single array access.
+When both trees are in the same order of keys (i.e. the friend was produced
+from the tree) the friend entries are read one at a time along with the
+entries of the tree. Otherwise the friend entries of each block of entries
+of the tree are read in increasing order and their values are kept until
+the entries of the block are read, so that the friend is never read
+backwards.
+
+.. sourcecode:: python
+
+   chain = TreeChain('tree', files)
+   chain.add_friend('scores.root', 'scores', keys=('run', 'event'))
+   for event in chain:
+       print(event.bdt_score)
+"""
+from __future__ import absolute_import
+
+import os
+import tempfile
+from array import array
+
+from .. import log; log = log[__name__]
+from ..io import root_open
+from ..context import preserve_current_directory
+
+__all__ = [
+    'Friend',
+]
+
+
+class Friend(object):
+    """
+    A friend tree joined to the entries of other trees by the values of key
+    branches. The values of the branches of the friend are set to the
+    values of the friend entry with the same keys as the current entry or to
+    their defaults if there is no such entry (see ``matched``).
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file containing the friend tree.
+
+    name : str
+        The name of the friend tree.
+
+    keys : list, optional (default=('run', 'event'))
+        The names of the branches identifying an entry in both the friend
+        and the joined trees.
+
+    branches : list, optional (default=None)
+        Only read these branches of the friend. If None, then all branches
+        are read.
+
+    prefix : str, optional (default='')
+        Prefix the names of the branches of the friend with this string in
+        the buffer of the joined trees.
+
+    index_path : str, optional (default=None)
+        The file in which the sorted index is stored. By default this is the
+        name of the friend file followed by the name of the tree and
+        ``.index.npz``.
+
+    cache_size : int, optional (default=10000000)
+        The size in bytes of the TTreeCache of the friend tree.
+
+    block_size : int, optional (default=10000)
+        The number of entries of the joined tree whose friend entries are
+        read together in increasing order if the friend is not in the order
+        of the joined tree.
+    """
+    def __init__(self, filename, name, keys=('run', 'event'), branches=None,
+                 prefix='', index_path=None, cache_size=10000000,
+                 block_size=10000):
+        self.filename = filename
+        self.name = name
+        self.keys = list(keys)
+        self.prefix = prefix
+        self.block_size = block_size
+        if index_path is None:
+            index_path = '{0}.{1}.index.npz'.format(
+                filename, name.replace('/', '_'))
+        self.index_path = index_path
+        with preserve_current_directory():
+            self._file = root_open(filename)
+        self.tree = self._file.Get(name)
+        index = self.load_index()
+        if index is None:
+            index = self.build_index()
+            self.save_index(*index)
+        self._sorted_keys, self._entries = index
+        if branches is not None:
+            self.tree.activate(branches, exclusive=True)
+        self.tree.create_buffer()
+        self.tree.SetCacheSize(cache_size)
+        self.tree.AddBranchToCache('*', True)
+        # the friend entry of each entry of the joined tree or -1
+        self._map = None
+        self._last_entry = -1
+        # the range of entries of the joined tree whose friend values are
+        # kept when the friend is read in blocks and the values of each
+        # friend entry in that range
+        self._blocked = False
+        self._block = None
+        self._values = {}
+        # whether the current entry has a friend entry
+        self.matched = False
+
+    def _stat(self):
+        stat = os.stat(self.filename)
+        return [stat.st_size, stat.st_mtime]
+
+    def load_index(self):
+        """
+        Return the sorted keys and their entries from the stored index or
+        None if there is no valid stored index
+        """
+        import numpy as np
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with np.load(self.index_path) as index:
+                if (list(index['stat']) != self._stat() or
+                        list(index['keys']) != self.keys):
+                    log.info("rebuilding the outdated index {0}".format(
+                        self.index_path))
+                    return None
+                return index['sorted_keys'], index['entries']
+        except (IOError, ValueError, KeyError):
+            log.warning("ignoring unreadable index {0}".format(
+                self.index_path))
+            return None
+
+    def build_index(self):
+        """
+        Read the keys of all entries of the friend and return the sorted
+        keys and the entry of each
+        """
+        import numpy as np
+        log.info("building the index of friend {0} in {1}".format(
+            self.name, self.filename))
+        keys = self._keys(self.tree)
+        entries = np.argsort(keys, order=self.keys, kind='mergesort')
+        sorted_keys = keys[entries]
+        if len(sorted_keys) and np.any(sorted_keys[1:] == sorted_keys[:-1]):
+            log.warning(
+                "friend {0} has entries with the same keys: only the first "
+                "is joined".format(self.name))
+        return sorted_keys, entries.astype(np.int64)
+
+    def save_index(self, sorted_keys, entries):
+        """
+        Store the sorted keys and their entries next to the friend file
+        """
+        import numpy as np
+        dirname = os.path.dirname(os.path.abspath(self.index_path))
+        try:
+            # write to a temporary file and rename so that concurrent jobs
+            # never read a partially written index
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.npz')
+            os.close(fd)
+            np.savez(tmp_path,
+                     sorted_keys=sorted_keys, entries=entries,
+                     stat=np.array(self._stat(), dtype=np.double),
+                     keys=np.array(self.keys))
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError) as e:
+            log.warning("unable to store the index {0}: {1}".format(
+                self.index_path, e))
+
+    def _keys(self, tree, dtype=None):
+        import numpy as np
+        rec = tree.to_array(branches=self.keys)
+        if dtype is None:
+            dtype = [(str(key), rec.dtype[key]) for key in self.keys]
+        keys = np.empty(len(rec), dtype=dtype)
+        for key in self.keys:
+            keys[key] = rec[key]
+        return keys
+
+    def join(self, tree):
+        """
+        Match the entries of a tree to the entries of the friend. Return the
+        number of entries of the tree without a friend entry.
+        """
+        import numpy as np
+        keys = self._keys(tree, dtype=self._sorted_keys.dtype)
+        n_friend = len(self._sorted_keys)
+        if n_friend == 0:
+            self._map = np.repeat(np.int64(-1), len(keys))
+        else:
+            pos = np.minimum(
+                np.searchsorted(self._sorted_keys, keys), n_friend - 1)
+            found = self._sorted_keys[pos] == keys
+            self._map = np.where(found, self._entries[pos], -1)
+        self._last_entry = -1
+        self._block = None
+        self._values = {}
+        matched = self._map[self._map >= 0]
+        if len(matched):
+            # only cache the baskets of the entries that are joined
+            self.tree.SetCacheEntryRange(
+                int(matched.min()), int(matched.max()) + 1)
+        self._blocked = bool(np.any(matched[1:] < matched[:-1]))
+        if self._blocked and not all(
+                isinstance(value, (array, bytearray))
+                for name, value in self.tree._buffer.items()):
+            # only the values of basic types can be kept
+            self._blocked = False
+            log.warning(
+                "the entries of friend {0} are not in the order of the "
+                "entries of tree {1} and are read out of order".format(
+                    self.name, tree.GetName()))
+        missing = int(np.count_nonzero(self._map < 0))
+        if missing:
+            log.warning("{0:d} entr{1} of tree {2} without an entry in "
+                        "friend {3}".format(
+                            missing, 'ies' if missing != 1 else 'y',
+                            tree.GetName(), self.name))
+        return missing
+
+    def read(self, entry):
+        """
+        Read the friend entry of an entry of the joined tree and return
+        whether it exists
+        """
+        friend_entry = int(self._map[entry])
+        if friend_entry < 0:
+            self.tree._buffer.reset()
+            self._last_entry = -1
+            self.matched = False
+        elif self._blocked:
+            if self._block is None or not (
+                    self._block[0] <= entry < self._block[1]):
+                self._read_block(entry)
+            for value, kept in zip(self.tree._buffer.values(),
+                                   self._values[friend_entry]):
+                value[:] = kept
+            self.matched = True
+        else:
+            if friend_entry != self._last_entry:
+                self.tree.GetEntry(friend_entry)
+                self._last_entry = friend_entry
+            self.matched = True
+        return self.matched
+
+    def _read_block(self, entry):
+        """
+        Read the friend entries of the block of entries of the joined tree
+        starting at ``entry`` in increasing order and keep their values
+        """
+        import numpy as np
+        last = min(entry + self.block_size, len(self._map))
+        friend_entries = np.unique(self._map[entry:last])
+        self._values = {}
+        for friend_entry in friend_entries[friend_entries >= 0]:
+            self.tree.GetEntry(int(friend_entry))
+            self._values[int(friend_entry)] = [
+                value[:] for value in self.tree._buffer.values()]
+        self._block = (entry, last)
+
+    def items(self):
+        """
+        Return the (name, value) pairs of the branches of the friend to add
+        to the buffer of the joined trees
+        """
+        return [(self.prefix + name, value)
+                for name, value in self.tree._buffer.items()
+                if name not in self.keys]
+
+    def close(self):
+        self._file.Close()
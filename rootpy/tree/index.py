@@ -0,0 +1,263 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements an index of the trees in a dataset of many files.
+The number of entries, the branches, the compressed and uncompressed sizes
+and the weight of the tree in each file are stored in a JSON sidecar file so
+that they are known without opening the files again. A record is rebuilt
+when the size or modification time of its file changes.
+
+.. sourcecode:: python
+
+   index = DatasetIndex('dataset.json', 'tree')
+   index.update(files, workers=8)
+   print(index.entries(files))
+   chain = TreeChain('tree', files, index=index)
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import tempfile
+import multiprocessing
+
+import ROOT
+
+from .. import log; log = log[__name__]
+from ..context import preserve_current_directory
+from ..utils.path import mkdir_p
+
+__all__ = [
+    'DatasetIndex',
+]
+
+
+def _stat(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime
+
+
+def _index_file(args):
+    """
+    Return the record of the tree in one file
+    """
+    tree_name, filename = args
+    try:
+        size, mtime = _stat(filename)
+    except OSError:
+        return filename, None
+    record = {
+        'size': size,
+        'mtime': mtime,
+        'entries': 0,
+        'branches': [],
+        'zip_bytes': 0,
+        'tot_bytes': 0,
+        'weight': 1.}
+    with preserve_current_directory():
+        rootfile = ROOT.TFile.Open(filename)
+        if not rootfile or rootfile.IsZombie():
+            log.warning("could not open file {0}".format(filename))
+            return filename, None
+        try:
+            tree = rootfile.Get(tree_name)
+            if not tree or not isinstance(tree, ROOT.TTree):
+                log.warning("tree {0} does not exist in file {1}".format(
+                    tree_name, filename))
+                return filename, record
+            record['entries'] = int(tree.GetEntries())
+            record['branches'] = [
+                branch.GetName() for branch in tree.GetListOfBranches()]
+            record['zip_bytes'] = int(tree.GetZipBytes())
+            record['tot_bytes'] = int(tree.GetTotBytes())
+            record['weight'] = tree.GetWeight()
+        finally:
+            rootfile.Close()
+    return filename, record
+
+
+class DatasetIndex(object):
+    """
+    An index of a tree in many files stored in a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the JSON file holding the index. It is created if it does
+        not exist.
+
+    tree_name : str
+        The name of the tree (including the path) in each file.
+    """
+    def __init__(self, path, tree_name):
+        self.path = path
+        self.tree_name = tree_name
+        self._records = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except (IOError, ValueError):
+            log.warning("ignoring unreadable index {0}".format(self.path))
+            return
+        self._records = content.get('trees', {}).get(self.tree_name, {})
+
+    def save(self):
+        """
+        Write the index to its JSON file. Records of other trees in the same
+        file are preserved.
+        """
+        content = {'trees': {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    content = json.load(f)
+            except (IOError, ValueError):
+                pass
+        content.setdefault('trees', {})[self.tree_name] = self._records
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        mkdir_p(dirname)
+        # write to a temporary file and rename so that concurrent jobs never
+        # read a partially written index
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(content, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+        self._dirty = False
+
+    def _valid(self, filename, record):
+        try:
+            size, mtime = _stat(filename)
+        except OSError:
+            return False
+        return record['size'] == size and record['mtime'] == mtime
+
+    def stale(self, files):
+        """
+        Return the files that are not in the index or have changed since they
+        were indexed
+        """
+        stale = []
+        for filename in files:
+            record = self._records.get(os.path.abspath(filename))
+            if record is None or not self._valid(filename, record):
+                stale.append(filename)
+        return stale
+
+    def update(self, files, workers=None, save=True):
+        """
+        Index all files that are not in the index or have changed since they
+        were indexed. The files are opened in parallel by ``workers``
+        processes (the number of CPUs by default).
+        """
+        stale = self.stale(files)
+        if not stale:
+            return
+        log.info("indexing {0:d} file{1}".format(
+            len(stale), 's' if len(stale) != 1 else ''))
+        tasks = [(self.tree_name, filename) for filename in stale]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(tasks))
+        pool = None
+        try:
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+                results = pool.imap_unordered(_index_file, tasks)
+            else:
+                results = map(_index_file, tasks)
+            for filename, record in results:
+                if record is not None:
+                    self._records[os.path.abspath(filename)] = record
+                    self._dirty = True
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        if save and self._dirty:
+            self.save()
+
+    def get(self, filename):
+        """
+        Return the record of a file or None if the file is not indexed or
+        has changed since it was indexed
+        """
+        record = self._records.get(os.path.abspath(filename))
+        if record is None or not self._valid(filename, record):
+            return None
+        return record
+
+    def __getitem__(self, filename):
+        """
+        Return the record of a file, indexing it first if needed
+        """
+        key = os.path.abspath(filename)
+        record = self._records.get(key)
+        if record is None or not self._valid(filename, record):
+            self.update([filename], workers=1)
+            record = self._records.get(key)
+            if record is None:
+                raise IOError("could not index file {0}".format(filename))
+        return record
+
+    def __contains__(self, filename):
+        return os.path.abspath(filename) in self._records
+
+    def entries(self, files):
+        """
+        Return the total number of entries in the files, indexing any files
+        that are not in the index. Files that cannot be read are ignored.
+        """
+        self.update(files)
+        total = 0
+        for filename in files:
+            record = self.get(filename)
+            if record is not None:
+                total += record['entries']
+        return total
+
+    def plan(self, files):
+        """
+        Return the files with at least one entry, the largest first.
+        Distributing files in this order (i.e. through a TreeQueue) balances
+        the load of the workers.
+        """
+        self.update(files)
+        records = [(filename, self.get(filename)) for filename in files]
+        records = [item for item in records
+                   if item[1] is not None and item[1]['entries'] > 0]
+        records.sort(key=lambda item: item[1]['entries'], reverse=True)
+        return [filename for filename, record in records]
+
+    def work_units(self, files, workers, min_entries=10000):
+        """
+        Split the files into (filename, first, last) units of entries for a
+        TreeQueue shared by ``workers`` workers. The size of each unit is the
+        number of remaining entries divided by twice the number of workers
+        (but at least ``min_entries``) so that the units shrink towards the
+        end and idle workers pick up the small units while the others finish.
+        The largest files are split first.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        files = self.plan(files)
+        remaining = sum(self.get(filename)['entries'] for filename in files)
+        units = []
+        for filename in files:
+            entries = self.get(filename)['entries']
+            first = 0
+            while first < entries:
+                size = max(min_entries, -(-remaining // (2 * workers)))
+                last = min(first + size, entries)
+                if entries - last < min_entries:
+                    # do not leave a fragment smaller than min_entries
+                    last = entries
+                units.append((filename, first, last))
+                remaining -= last - first
+                first = last
+        return units
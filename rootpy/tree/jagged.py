@@ -0,0 +1,344 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a columnar representation of tree collections
+(see ``TreeBuffer.define_collection``) for a whole chunk of entries at once.
+The values of each attribute of the objects in a collection are stored in a
+single contiguous content array together with an array of offsets marking
+where the objects of each entry begin and end. Selection, masking, sorting
+and slicing of the objects are then vectorized over all entries.
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+__all__ = [
+    'JaggedArray',
+    'JaggedCollection',
+]
+
+
+class JaggedArray(object):
+    """
+    A sequence of variable-length arrays stored as one content array and an
+    array of ``len(self) + 1`` offsets into the content.
+
+    Parameters
+    ----------
+    offsets : array of ints
+        The objects of entry ``i`` are ``content[offsets[i]:offsets[i + 1]]``
+
+    content : array
+        The values of all objects of all entries
+    """
+    def __init__(self, offsets, content):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.content = np.asarray(content)
+        if len(self.offsets) == 0:
+            raise ValueError("offsets must contain at least one element")
+        if self.offsets[-1] != len(self.content):
+            raise ValueError(
+                "the last offset ({0:d}) does not match the length of the "
+                "content ({1:d})".format(
+                    int(self.offsets[-1]), len(self.content)))
+
+    @classmethod
+    def from_counts(cls, counts, content):
+        """
+        Create a JaggedArray from the number of objects in each entry
+        """
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(offsets, content)
+
+    @classmethod
+    def from_iterables(cls, iterables, dtype=None):
+        """
+        Create a JaggedArray from a sequence of sequences, such as the object
+        arrays of vectors returned by root_numpy
+        """
+        counts = np.fromiter(
+            (len(item) for item in iterables),
+            dtype=np.int64, count=len(iterables))
+        if counts.sum() > 0:
+            content = np.concatenate([
+                np.asarray(item, dtype=dtype) for item in iterables])
+        else:
+            content = np.empty(0, dtype=dtype or np.double)
+        return cls.from_counts(counts, content)
+
+    @property
+    def counts(self):
+        """
+        The number of objects in each entry
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def parents(self):
+        """
+        The entry index of each element of the content
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.counts)
+
+    @property
+    def local_index(self):
+        """
+        The index of each element of the content within its entry
+        """
+        return (np.arange(len(self.content), dtype=np.int64) -
+                np.repeat(self.offsets[:-1], self.counts))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, JaggedArray):
+            # an elementwise boolean mask
+            return self.compress(index.content)
+        if isinstance(index, (slice, list, np.ndarray)):
+            # a slice, index array or boolean mask of entries
+            starts = self.offsets[:-1][index]
+            stops = self.offsets[1:][index]
+            counts = stops - starts
+            content_index = (
+                np.repeat(starts - np.cumsum(counts) + counts, counts) +
+                np.arange(counts.sum(), dtype=np.int64))
+            return JaggedArray.from_counts(counts, self.content[content_index])
+        return self.content[self.offsets[index]:self.offsets[index + 1]]
+
+    def compress(self, mask):
+        """
+        Keep the elements of the content where ``mask`` is True
+        """
+        mask = np.asarray(mask, dtype=np.bool_)
+        counts = np.bincount(self.parents[mask], minlength=len(self))
+        return JaggedArray.from_counts(counts, self.content[mask])
+
+    def take(self, content_index):
+        """
+        Reorder or select the content with an index array that keeps the
+        elements of each entry within that entry
+        """
+        parents = self.parents[content_index]
+        counts = np.bincount(parents, minlength=len(self))
+        return JaggedArray.from_counts(counts, self.content[content_index])
+
+    def _binary(self, other, op):
+        if isinstance(other, JaggedArray):
+            other = other.content
+        return JaggedArray(self.offsets, op(self.content, other))
+
+    def __lt__(self, other):
+        return self._binary(other, np.less)
+
+    def __le__(self, other):
+        return self._binary(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._binary(other, np.greater)
+
+    def __ge__(self, other):
+        return self._binary(other, np.greater_equal)
+
+    def __eq__(self, other):
+        return self._binary(other, np.equal)
+
+    def __ne__(self, other):
+        return self._binary(other, np.not_equal)
+
+    def __and__(self, other):
+        return self._binary(other, np.logical_and)
+
+    def __or__(self, other):
+        return self._binary(other, np.logical_or)
+
+    def __invert__(self):
+        return JaggedArray(self.offsets, np.logical_not(self.content))
+
+    def __add__(self, other):
+        return self._binary(other, np.add)
+
+    def __sub__(self, other):
+        return self._binary(other, np.subtract)
+
+    def __mul__(self, other):
+        return self._binary(other, np.multiply)
+
+    def __truediv__(self, other):
+        return self._binary(other, np.true_divide)
+
+    __div__ = __truediv__
+
+    def __abs__(self):
+        return JaggedArray(self.offsets, np.abs(self.content))
+
+    def __repr__(self):
+        return "JaggedArray([{0}])".format(', '.join(
+            str(self[i].tolist()) for i in range(min(len(self), 5))) +
+            (', ...' if len(self) > 5 else ''))
+
+
+class JaggedCollection(object):
+    """
+    A columnar tree collection over a chunk of entries. Each attribute of the
+    collection (a branch named ``prefix + attribute``) is a JaggedArray with
+    the same offsets.
+
+    Parameters
+    ----------
+    name : str
+        The name of the collection
+
+    prefix : str
+        The prefix of the branches of this collection
+
+    attributes : dict
+        A dict mapping attribute names to JaggedArrays
+    """
+    def __init__(self, name, prefix, attributes):
+        self.name = name
+        self.prefix = prefix
+        self.attributes = attributes
+
+    @classmethod
+    def from_columns(cls, name, prefix, columns, size=None):
+        """
+        Create a collection from a dict of columns (such as a chunk yielded by
+        ``Tree.iterate``) where the variable-length branches with names
+        starting with ``prefix`` become the attributes of the collection.
+        If ``size`` is the name of a branch holding the number of objects in
+        each entry then the attributes are assumed to be vectors of that size.
+        """
+        counts = None
+        if size is not None and size in columns:
+            counts = np.asarray(columns[size], dtype=np.int64)
+        attributes = {}
+        for branch, column in columns.items():
+            if not branch.startswith(prefix) or branch == size:
+                continue
+            if column.dtype.kind != 'O':
+                continue
+            attr = branch[len(prefix):]
+            if counts is not None and len(column) and \
+                    hasattr(column[0], 'dtype'):
+                content = np.concatenate(list(column)) \
+                    if counts.sum() > 0 else np.empty(0, column[0].dtype)
+                attributes[attr] = JaggedArray.from_counts(counts, content)
+            else:
+                attributes[attr] = JaggedArray.from_iterables(column)
+        return cls(name, prefix, attributes)
+
+    def _first(self):
+        for array in self.attributes.values():
+            return array
+        raise ValueError(
+            "collection `{0}` has no attributes".format(self.name))
+
+    @property
+    def offsets(self):
+        return self._first().offsets
+
+    @property
+    def counts(self):
+        """
+        The number of objects in each entry
+        """
+        return self._first().counts
+
+    def __len__(self):
+        return len(self._first())
+
+    def __getattr__(self, attr):
+        try:
+            return self.__dict__['attributes'][attr]
+        except KeyError:
+            raise AttributeError(
+                "collection `{0}` has no attribute `{1}`".format(
+                    self.__dict__.get('name'), attr))
+
+    def __getitem__(self, attr):
+        return self.attributes[attr]
+
+    def entries(self, index):
+        """
+        Keep the entries selected by a slice, an index array or a boolean
+        mask of entries
+        """
+        return self._apply(lambda array: array[index])
+
+    def _apply(self, func):
+        return JaggedCollection(
+            self.name, self.prefix,
+            dict([(attr, func(array))
+                  for attr, array in self.attributes.items()]))
+
+    def _mask(self, selection):
+        if callable(selection):
+            selection = selection(self)
+        if isinstance(selection, JaggedArray):
+            selection = selection.content
+        return np.asarray(selection, dtype=np.bool_)
+
+    def select(self, selection):
+        """
+        Keep the objects passing a selection in all entries. ``selection`` is
+        a JaggedArray of booleans or a function of this collection returning
+        one, i.e. ``coll.select(lambda c: c.pt > 20)``.
+        """
+        mask = self._mask(selection)
+        return self._apply(lambda array: array.compress(mask))
+
+    def mask(self, selection):
+        """
+        Remove the objects passing a selection in all entries
+        """
+        mask = ~self._mask(selection)
+        return self._apply(lambda array: array.compress(mask))
+
+    def sort(self, key, reverse=False):
+        """
+        Sort the objects within each entry by the values of an attribute name,
+        a JaggedArray, or a function of this collection returning one
+        """
+        if callable(key):
+            key = key(self)
+        elif not isinstance(key, JaggedArray):
+            key = self.attributes[key]
+        values = key.content
+        if reverse:
+            values = -values
+        # stable sort by value within each entry
+        order = np.lexsort((values, key.parents))
+        return self._apply(lambda array: array.take(order))
+
+    def slice(self, start=0, stop=None, step=1):
+        """
+        Keep a slice of the objects in each entry, i.e. ``coll.slice(0, 2)``
+        keeps the (up to) two leading objects of each entry
+        """
+        if step is None:
+            step = 1
+        if step < 1:
+            raise ValueError("step must be a positive integer")
+        array = self._first()
+        counts = np.repeat(array.counts, array.counts)
+        local = array.local_index
+        if start is None:
+            start = 0
+        starts = np.where(start < 0, np.maximum(counts + start, 0), start)
+        if stop is None:
+            stops = counts
+        else:
+            stops = np.where(stop < 0, counts + stop, np.minimum(stop, counts))
+        mask = (local >= starts) & (local < stops) & \
+            ((local - starts) % step == 0)
+        return self._apply(lambda array: array.compress(mask))
+
+    def __repr__(self):
+        return "JaggedCollection('{0}', attributes={1})".format(
+            self.name, sorted(self.attributes.keys()))
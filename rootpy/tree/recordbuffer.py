@@ -0,0 +1,158 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a TreeBuffer that stores the values of all scalar and
+fixed-length array branches in one contiguous NumPy structured record. The
+branches point at the offsets of their fields in the record, resetting the
+buffer copies a template of the defaults over the record in one operation,
+and the record may be used directly in vectorized code.
+
+.. sourcecode:: python
+
+   tree = Tree('test', model=Event, record=True)
+   tree.x = 1.
+   tree.fill(reset=True)
+   # a zero-copy view of the values of all basic branches
+   tree._buffer.record
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+from .treebuffer import TreeBuffer
+from .treetypes import Scalar, Array, BaseScalar, BaseArray
+
+__all__ = [
+    'RecordBuffer',
+]
+
+# the attributes of a value that are copied onto its view in the record
+_VALUE_ATTRS = (
+    'type', 'typename', 'typecode', 'default', 'resetable', 'convert')
+
+
+def _copy_attrs(view, value):
+    for attr in _VALUE_ATTRS:
+        setattr(view, attr, getattr(value, attr))
+    return view
+
+
+class RecordScalar(Scalar, np.ndarray):
+    """
+    A view of a scalar field of a record with the interface of the scalar
+    types in ``rootpy.tree.treetypes``
+    """
+    def reset(self):
+        """Reset the value to the default"""
+        if self.resetable:
+            self[0] = self.default
+
+    @property
+    def value(self):
+        """The current value"""
+        return self.item(0)
+
+    def set(self, value):
+        """Set the value"""
+        if isinstance(value, Scalar):
+            value = value.value
+        self[0] = self.convert(value)
+
+    def __repr__(self):
+        return "{0}({1}) at {2}".format(
+            self.__class__.__name__, repr(self.value), hex(id(self)))
+
+    __str__ = __repr__
+
+
+class RecordArray(Array, np.ndarray):
+    """
+    A view of a fixed-length array field of a record with the interface of
+    the array types in ``rootpy.tree.treetypes``
+    """
+    def reset(self):
+        """Reset the values to the default"""
+        if self.resetable:
+            self[:] = self.default
+
+    def set(self, other):
+        other = [self.convert(thing) for thing in other]
+        self[:len(other)] = other
+        self[len(other):] = self.default
+
+    def __repr__(self):
+        return "{0}[{1}] at {2}".format(
+            self.__class__.__name__,
+            ', '.join(map(str, self.tolist())), hex(id(self)))
+
+    __str__ = __repr__
+
+
+class RecordBuffer(TreeBuffer):
+    """
+    A TreeBuffer whose scalar and fixed-length array values are views of the
+    fields of a single NumPy structured record.
+
+    Parameters
+    ----------
+    treebuffer : TreeBuffer
+        The buffer (i.e. the buffer of a TreeModel) to pack into a record.
+        The other values (objects and char types) are kept as they are.
+    """
+    def __init__(self, treebuffer=None):
+        super(RecordBuffer, self).__init__()
+        items = []
+        if treebuffer is not None:
+            items = list(treebuffer.items())
+        packed = [(name, value) for name, value in items
+                  if isinstance(value, (BaseScalar, BaseArray))]
+        dtype = []
+        for name, value in packed:
+            shape = () if isinstance(value, BaseScalar) else (len(value),)
+            dtype.append((str(name), np.dtype(value.typecode), shape))
+        dtype = np.dtype(dtype, align=True)
+        object.__setattr__(self, 'record', np.zeros(1, dtype=dtype))
+        # the values of a reset record
+        object.__setattr__(self, '_defaults', np.zeros(1, dtype=dtype))
+        # fields that keep their values on reset
+        object.__setattr__(self, '_keep', [])
+        views = {}
+        for name, value in packed:
+            if isinstance(value, BaseScalar):
+                self.record[name] = value.value
+                self._defaults[name] = value.default
+                view = self.record[name].view(RecordScalar)
+            else:
+                self.record[name][0] = list(value)
+                self._defaults[name] = value.default
+                view = self.record[name][0].view(RecordArray)
+            if not value.resetable:
+                self._keep.append(name)
+            views[name] = _copy_attrs(view, value)
+        # keep the order of the branches
+        for name, value in items:
+            self[name] = views.get(name, value)
+        if treebuffer is not None:
+            self._fixed_names.update(treebuffer._fixed_names)
+            self.set_objects(treebuffer)
+
+    def reset(self):
+        """
+        Reset the record by copying the defaults over it and reset any other
+        values individually (only those set or accessed since the last reset
+        if dirty tracking is enabled)
+        """
+        kept = [(name, self.record[name].copy()) for name in self._keep]
+        self.record[...] = self._defaults
+        for name, value in kept:
+            self.record[name] = value
+        plan = self._build_reset_plan()
+        names = self._dirty
+        if names is None:
+            names = plan.keys()
+        fields = self.record.dtype.fields
+        for name in names:
+            if name not in fields and name in plan:
+                plan[name]()
+        if self._dirty is not None:
+            self._dirty.clear()
@@ -0,0 +1,157 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements a cache of the entries of trees passing selections.
+The entries are stored as ``TEntryList`` objects (compressed bitmaps of the
+passing entries) in ROOT files keyed by the normalized selection, the name of
+the tree, and the path, size and modification time of the file containing the
+tree. Applying a cached selection to an unchanged file then skips the
+evaluation of the selection entirely.
+
+.. sourcecode:: python
+
+   tree.selection_cache = SelectionCache()
+   # evaluated once and stored
+   tree.GetEntries('njets>=2')
+   # later runs only read the cached entry list
+   tree.CopyTree('njets>=2')
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import hashlib
+
+import ROOT
+
+from .. import log; log = log[__name__]
+from .. import userdata
+from ..extern.shortuuid import uuid
+from ..context import preserve_current_directory, thread_specific_tmprootdir
+from ..utils.path import mkdir_p
+from .cut import Cut
+
+__all__ = [
+    'SelectionCache',
+]
+
+
+def normalize_selection(selection):
+    """
+    Return a normalized string for a selection so that equivalent spellings
+    share the same cache entry
+    """
+    return re.sub(r'\s+', '', str(Cut(selection)))
+
+
+class SelectionCache(object):
+    """
+    A cache of TEntryLists of the entries of trees passing selections.
+
+    Parameters
+    ----------
+    path : str, optional (default=None)
+        The directory in which the entry lists are stored. By default this is
+        ``selections`` in the rootpy user data directory.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(userdata.DATA_ROOT, 'selections')
+        self.path = path
+
+    def key(self, tree, selection):
+        """
+        Return the key of a selection applied to a tree. A tree that is not
+        read from a file cannot be cached and None is returned.
+        """
+        directory = tree.GetDirectory()
+        if not directory:
+            return None
+        rootfile = directory.GetFile()
+        if not rootfile:
+            return None
+        filename = os.path.abspath(rootfile.GetName())
+        if not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        key = '\n'.join([
+            normalize_selection(selection),
+            directory.GetPath().split(':', 1)[-1],
+            tree.GetName(),
+            filename,
+            str(stat.st_size),
+            repr(stat.st_mtime)])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.root')
+
+    def get(self, tree, selection):
+        """
+        Return the cached TEntryList of the entries of a tree passing a
+        selection or None if it is not cached
+        """
+        key = self.key(tree, selection)
+        if key is None:
+            return None
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+        with preserve_current_directory():
+            cachefile = ROOT.TFile.Open(filename)
+            if not cachefile or cachefile.IsZombie():
+                log.warning(
+                    "ignoring unreadable selection cache {0}".format(filename))
+                return None
+            elist = cachefile.Get('entries')
+            if not elist:
+                cachefile.Close()
+                return None
+            elist = elist.Clone(uuid())
+            elist.SetDirectory(0)
+            cachefile.Close()
+        log.debug("using cached selection `{0}` on tree `{1}`".format(
+            selection, tree.GetName()))
+        return elist
+
+    def build(self, tree, selection):
+        """
+        Evaluate a selection on all entries of a tree and return the TEntryList
+        of the passing entries, storing it in the cache if possible
+        """
+        name = uuid()
+        with thread_specific_tmprootdir() as tmpdir:
+            # call TTree::Draw directly to bypass any entry list on the tree
+            entrylist = tree.GetEntryList()
+            ROOT.TTree.SetEntryList(tree, 0)
+            try:
+                ROOT.TTree.Draw(tree, '>>{0}'.format(name),
+                                str(Cut(selection)), 'entrylist')
+            finally:
+                if entrylist:
+                    ROOT.TTree.SetEntryList(tree, entrylist)
+            elist = tmpdir.Get(name)
+            elist.SetDirectory(0)
+        key = self.key(tree, selection)
+        if key is not None:
+            mkdir_p(self.path)
+            filename = self._filename(key)
+            # write to a temporary file and rename so that concurrent jobs
+            # never read a partially written entry list
+            tmp_filename = '{0}.{1}.tmp'.format(filename, uuid())
+            with preserve_current_directory():
+                cachefile = ROOT.TFile.Open(tmp_filename, 'recreate')
+                elist.Write('entries')
+                cachefile.Close()
+            os.rename(tmp_filename, filename)
+        return elist
+
+    def entry_list(self, tree, selection):
+        """
+        Return the TEntryList of the entries of a tree passing a selection,
+        building and caching it if it is not cached yet
+        """
+        elist = self.get(tree, selection)
+        if elist is None:
+            elist = self.build(tree, selection)
+        return elist
@@ -0,0 +1,263 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+"""
+This module implements skimming (keeping the entries passing a selection) and
+slimming (keeping a subset of branches) of the files of a TreeChain in a pool
+of worker processes.
+
+.. sourcecode:: python
+
+   from rootpy.tree import TreeChain, skim
+
+   chain = TreeChain('tree', files)
+   cutflow = skim(chain, 'njets>=2', ['njets', 'jet_*'], 'skimmed/',
+                  workers=8, merge='skim.root')
+"""
+from __future__ import absolute_import
+
+import os
+import multiprocessing
+
+import ROOT
+
+from .. import log; log = log[__name__]
+from ..io import root_open, DoesNotExist
+from ..extern.shortuuid import uuid
+from ..context import preserve_current_directory, thread_specific_tmprootdir
+from ..utils.path import mkdir_p
+from .cut import Cut
+from .filtering import Filter, FilterList
+
+__all__ = [
+    'skim',
+]
+
+
+def _entry_list(tree, selection):
+    """
+    Evaluate a selection on a tree and return the TEntryList of the entries
+    passing it
+    """
+    name = uuid()
+    with thread_specific_tmprootdir() as tmpdir:
+        ROOT.TTree.Draw(tree, '>>{0}'.format(name), str(selection),
+                        'entrylist')
+        elist = tmpdir.Get(name)
+        elist.SetDirectory(0)
+    return elist
+
+
+def _skim_file(args):
+    """
+    Skim one input file into one output file and return the cut-flow as a
+    list of dicts (see ``FilterList.basic``) or None if the input cannot be
+    read
+    """
+    name, filename, output, selection, branches, filters = args
+    selection = Cut(selection)
+    try:
+        infile = root_open(filename)
+    except IOError:
+        log.warning("could not open file {0} (skipping)".format(filename))
+        return None
+    with preserve_current_directory():
+        try:
+            tree = infile.Get(name)
+        except DoesNotExist:
+            log.warning("tree {0} does not exist in file {1} (skipping)".format(
+                name, filename))
+            infile.Close()
+            return None
+        counts = Filter(name=str(selection) or 'all')
+        counts.total = int(tree.GetEntries())
+        filterlist = None
+        with root_open(output, 'recreate') as outfile:
+            if filters is None:
+                if branches is not None:
+                    tree.activate(branches, exclusive=True)
+                outfile.cd()
+                if selection:
+                    # the selection is evaluated by the compiled TTreeFormula
+                    outtree = tree.CopyTree(selection)
+                else:
+                    # copy the compressed baskets without unzipping them
+                    outtree = tree.CloneTree(-1, 'fast')
+                counts.passing = int(outtree.GetEntries())
+            else:
+                filterlist = filters()
+                counts.passing = counts.total
+                if selection:
+                    elist = _entry_list(tree, selection)
+                    tree.SetEntryList(elist)
+                    counts.passing = int(elist.GetN())
+                # the filters may access any branch
+                tree.create_buffer(ignore_unsupported=True)
+                if branches is not None:
+                    tree.activate(branches, exclusive=True)
+                outfile.cd()
+                # the clone holds the kept branches and shares the addresses
+                # of the tree buffer
+                outtree = tree.CloneTree(0)
+                # the kept branches are read for every entry and the other
+                # branches only when the filters access them
+                tree.SetBranchStatus('*', 1)
+                tree.read_branches_on_demand = True
+                tree.always_read([
+                    branch.GetName()
+                    for branch in outtree.GetListOfBranches()])
+                for event in tree:
+                    if filterlist(event):
+                        outtree.Fill()
+                filterlist.finalize()
+            outtree.Write()
+        infile.Close()
+    cutflow = [counts.__getstate__()]
+    if filterlist is not None:
+        cutflow += filterlist.basic()
+    return cutflow
+
+
+def _as_filterlist(states):
+    filterlist = FilterList()
+    for state in states:
+        _filter = Filter()
+        _filter.__setstate__(state)
+        filterlist.append(_filter)
+    return filterlist
+
+
+def _output_names(files):
+    """
+    Return one output filename per input, prefixing the basenames with the
+    position of the input if the basenames are not unique
+    """
+    basenames = [os.path.basename(filename) for filename in files]
+    if len(set(basenames)) == len(basenames):
+        return basenames
+    return ['{0:d}_{1}'.format(i, basename)
+            for i, basename in enumerate(basenames)]
+
+
+def _same_file(first, second):
+    """
+    Return True if two paths refer to the same file
+    """
+    if os.path.abspath(first) == os.path.abspath(second):
+        return True
+    try:
+        return os.path.samefile(first, second)
+    except OSError:
+        return False
+
+
+def skim(chain, selection=None, branches=None, output_dir='.',
+         workers=None, merge=False, filters=None):
+    """
+    Write the entries of each file of a TreeChain passing a selection into
+    an output file, keeping only a subset of the branches. Files are
+    processed in parallel.
+
+    Without ``filters`` the selection is applied with ``TTree::CopyTree`` and
+    without a selection the kept branches are copied with fast cloning
+    (without decompressing the baskets), so no Python code runs per entry.
+    With ``filters`` the entries passing the selection are copied one by one:
+    the kept branches are read for each entry and the other branches are
+    only read when the filters access them.
+
+    Parameters
+    ----------
+    chain : TreeChain
+        The input files and the name of the tree.
+
+    selection : str or Cut, optional (default=None)
+        Only entries passing this selection are kept.
+
+    branches : list, optional (default=None)
+        Only keep these branches (wildcards are allowed). If None, then all
+        branches are kept.
+
+    output_dir : str, optional (default='.')
+        The directory of the output files. One output file with the same
+        basename as its input is written per input file. A ValueError is
+        raised if an output would overwrite an input.
+
+    workers : int, optional (default=None)
+        The number of worker processes. By default use as many processes as
+        there are CPUs.
+
+    merge : bool or str, optional (default=False)
+        If True or a filename, then the outputs are merged into a single file
+        (``skim.root`` if True) in ``output_dir`` and the per-file outputs are
+        removed.
+
+    filters : callable, optional (default=None)
+        A picklable (module-level) function returning an EventFilterList
+        applied to each entry passing the selection. The filters are created
+        in each worker process.
+
+    Returns
+    -------
+    cutflow : FilterList
+        The aggregated number of entries seen and passing the selection and
+        each filter.
+    """
+    name = chain._name
+    files = list(chain._files)
+    mkdir_p(output_dir)
+    outputs = [os.path.join(output_dir, output)
+               for output in _output_names(files)]
+    if merge:
+        # keep the per-file outputs apart from the merged output
+        outputs = [os.path.join(output_dir, '.{0}.{1}'.format(
+            uuid(), os.path.basename(output))) for output in outputs]
+    if merge:
+        merged = os.path.join(
+            output_dir, 'skim.root' if merge is True else merge)
+    for filename in files:
+        for output in outputs + ([merged] if merge else []):
+            if _same_file(filename, output):
+                raise ValueError(
+                    "the output {0} would overwrite the input {1}".format(
+                        output, filename))
+    tasks = [(name, filename, output, selection, branches, filters)
+             for filename, output in zip(files, outputs)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(tasks))
+    pool = None
+    if workers <= 1:
+        results = map(_skim_file, tasks)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_skim_file, tasks)
+    cutflow = None
+    written = []
+    try:
+        for output, result in zip(outputs, results):
+            if result is None:
+                continue
+            written.append(output)
+            if cutflow is None:
+                cutflow = _as_filterlist(result)
+            else:
+                cutflow = FilterList.merge(cutflow, result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if merge:
+        with preserve_current_directory():
+            merger = ROOT.TFileMerger(False)
+            merger.OutputFile(merged, 'RECREATE')
+            for output in written:
+                merger.AddFile(output)
+            if not merger.Merge():
+                raise RuntimeError(
+                    "failed to merge the outputs into {0}".format(merged))
+        for output in written:
+            os.unlink(output)
+        log.info("merged {0:d} outputs into {1}".format(
+            len(written), merged))
+    if cutflow is None:
+        return FilterList()
+    return cutflow
@@ -1,7 +1,8 @@
 # Copyright 2012 the rootpy developers
 # distributed under the terms of the GNU General Public License
 from rootpy.tree.categories import Categories
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_true
+from nose.plugins.skip import SkipTest
 
 GOOD = [
     '{a|1,2,3}',
@@ -43,6 +44,24 @@ def test_len():
     assert len(c) == 4
 
 
+def test_categorize():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    random = np.random.RandomState(0)
+    for string in GOOD + ['{a|1,2,3*}x{b|*4,5,6*}']:
+        c = Categories.from_string(string)
+        arrays = dict([(name, random.uniform(-20, 120, 1000).round())
+                       for name, var_type in c.variables])
+        index = c.categorize(arrays)
+        expected = np.empty(1000, dtype=int)
+        expected.fill(-1)
+        for i, category in enumerate(c.walk()):
+            expected[category.compile()(arrays).astype(bool)] = i
+        assert_true(np.all(index == expected))
+
+
 if __name__ == "__main__":
     import nose
     nose.runmodule()
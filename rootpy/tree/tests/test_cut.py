@@ -1,7 +1,8 @@
 # Copyright 2014 the rootpy developers
 # distributed under the terms of the GNU General Public License
 from rootpy.tree import Cut
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises
+from nose.plugins.skip import SkipTest
 
 
 def test_safe():
@@ -9,6 +10,54 @@ def test_safe():
     assert_equal(Cut("var*2").safe(), "var_mul_2")
     assert_equal(Cut("2*var**2").safe(), "2_mul_var_pow_2")
 
+
+def test_compile():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    columns = {
+        'a': np.array([1., 2., 3., 4.]),
+        'b': np.array([0, 1, 0, 1]),
+        'v': np.arange(8.).reshape(4, 2)}
+    func = (Cut('a>1') & Cut('b==1')).compile()
+    assert_equal(sorted(func.branches), ['a', 'b'])
+    assert_equal(func(columns).tolist(), [False, True, False, True])
+    # ternary expansion
+    func = Cut('1<a<4').compile()
+    assert_equal(func(columns).tolist(), [False, True, True, False])
+    func = Cut('!(a>2)||b').compile()
+    assert_equal(func(columns).tolist(), [True, True, False, True])
+    func = Cut('TMath::Abs(a-3)<1&&v[1]>4').compile()
+    assert_equal(func(columns).tolist(), [False, False, True, False])
+    # weights
+    assert_equal(Cut('a^2*b').compile()(columns).tolist(), [0, 4, 0, 16])
+    assert_equal(Cut('2*a^2').compile()(columns).tolist(), [2, 8, 18, 32])
+    assert_equal(Cut('-a^2').compile()(columns).tolist(), [-1, -4, -9, -16])
+    # chained comparison of expressions
+    func = Cut('0<a+b<4').compile()
+    assert_equal(func(columns).tolist(), [True, True, True, False])
+    # bitwise operators bind less tightly than comparisons
+    func = Cut('a>1 & b==1').compile()
+    assert_equal(func(columns).tolist(), [False, True, False, True])
+    func = Cut('a==!b').compile()
+    assert_equal(func(columns).tolist(), [True, False, False, False])
+    # integer columns are evaluated in double precision as in TTreeFormula
+    columns['i'] = np.array([70000, -7, 2, 0], dtype=np.int32)
+    assert_equal(Cut('i*i').compile()(columns).tolist(),
+                 [4.9e9, 49., 4., 0.])
+    assert_equal(Cut('b^-1').compile()(columns).tolist(),
+                 [np.inf, 1., np.inf, 1.])
+    assert_equal(Cut('i/4').compile()(columns).tolist(),
+                 [17500., -1.75, 0.5, 0.])
+    # the modulo and bitwise operators truncate their operands as in C
+    assert_equal(Cut('i%4').compile()(columns).tolist(), [0, -3, 2, 0])
+    assert_equal(Cut('(a+0.5)|i').compile()(columns).tolist(),
+                 [70001, -5, 3, 4])
+    # the empty cut selects everything
+    assert_equal(Cut().compile()(columns).tolist(), [True] * 4)
+    assert_raises(SyntaxError, Cut('Unknown(a)>1').compile)
+
 if __name__ == "__main__":
     import nose
     nose.runmodule()
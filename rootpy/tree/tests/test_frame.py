@@ -0,0 +1,32 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+from rootpy.tree import TreeFrame, TreeChain
+from rootpy.plotting import Hist
+
+from nose.tools import assert_equal, assert_almost_equal, with_setup
+
+from .test_tree import create_chain, cleanup
+
+
+@with_setup(create_chain, cleanup)
+def test_frame():
+    from . import test_tree
+    chain = TreeChain('tree', test_tree.FILE_PATHS)
+    frame = TreeFrame(chain, step_size=500)
+    positive = frame.filter('a_x>0', name='positive')
+    squared = positive.define('a_x2', 'a_x*a_x')
+    hist = squared.histo('a_x2', Hist(10, 0, 10))
+    total = frame.count()
+    selected = squared.count()
+    sum_x2 = squared.sum('a_x2')
+    # nothing is read until a value is accessed
+    assert_equal(hist.done, False)
+    assert_equal(total.value, 3000)
+    assert_equal(hist.done, True)
+    assert_equal(selected.value > 0, True)
+    assert_equal(hist.value.GetEntries(), selected.value)
+    assert_almost_equal(hist.value.GetMean() * selected.value,
+                        sum_x2.value, places=1)
+    cutflow = frame.cutflow()
+    assert_equal(cutflow.total, 3000)
+    assert_equal(cutflow.passing, selected.value)
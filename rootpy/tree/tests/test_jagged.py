@@ -0,0 +1,73 @@
+# Copyright 2014 the rootpy developers
+# distributed under the terms of the GNU General Public License
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+
+
+def make_collection():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    from rootpy.tree.jagged import JaggedCollection
+    pt = np.empty(4, dtype=object)
+    pt[:] = [np.array([5., 30., 20.]), np.array([]),
+             np.array([50.]), np.array([1., 2.])]
+    eta = np.empty(4, dtype=object)
+    eta[:] = [np.array([0., 1., 2.]), np.array([]),
+              np.array([3.]), np.array([4., 5.])]
+    columns = {
+        'jet_n': np.array([3, 0, 1, 2]),
+        'jet_pt': pt,
+        'jet_eta': eta,
+        'met': np.array([1., 2., 3., 4.])}
+    return JaggedCollection.from_columns('jets', 'jet_', columns, size='jet_n')
+
+
+def tolist(array):
+    return [list(item) for item in array]
+
+
+def test_from_columns():
+    jets = make_collection()
+    assert_equal(sorted(jets.attributes.keys()), ['eta', 'pt'])
+    assert_equal(len(jets), 4)
+    assert_equal(jets.counts.tolist(), [3, 0, 1, 2])
+    assert_equal(tolist(jets.pt[1:3]), [[], [50.]])
+    assert_equal(tolist(jets.pt[[0, 2]]), [[5., 30., 20.], [50.]])
+
+
+def test_entries():
+    import numpy as np
+    jets = make_collection()
+    selected = jets.entries(np.array([0, 3]))
+    assert_equal(len(selected), 2)
+    assert_equal(tolist(selected.pt), [[5., 30., 20.], [1., 2.]])
+    selected = jets.entries(np.array([False, True, True, False]))
+    assert_equal(tolist(selected.eta), [[], [3.]])
+
+
+def test_select_mask():
+    jets = make_collection()
+    selected = jets.select(lambda jets: jets.pt > 10)
+    assert_equal(tolist(selected.pt), [[30., 20.], [], [50.], []])
+    assert_equal(tolist(selected.eta), [[1., 2.], [], [3.], []])
+    masked = jets.mask(jets.pt > 10)
+    assert_equal(tolist(masked.pt), [[5.], [], [], [1., 2.]])
+
+
+def test_sort_slice():
+    jets = make_collection()
+    ordered = jets.sort('pt', reverse=True)
+    assert_equal(tolist(ordered.pt), [[30., 20., 5.], [], [50.], [2., 1.]])
+    assert_equal(tolist(ordered.eta), [[1., 2., 0.], [], [3.], [5., 4.]])
+    leading = ordered.slice(0, 1)
+    assert_equal(tolist(leading.pt), [[30.], [], [50.], [2.]])
+    assert_equal(tolist(jets.slice(-1).eta), [[2.], [], [3.], [5.]])
+    assert_equal(tolist(jets.slice(0, None, 2).pt),
+                 [[5., 20.], [], [50.], [1.]])
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -21,7 +21,7 @@ else:
 
 from nose.plugins.skip import SkipTest
 from nose.tools import (assert_raises, assert_almost_equal,
-                        assert_equal, raises, with_setup)
+                        assert_equal, assert_true, raises, with_setup)
 
 
 FILES = []
@@ -123,6 +123,22 @@ def test_attrs():
             assert_equal(len(event.b) > 0, True)
 
 
+@with_setup(create_tree, cleanup)
+def test_specialized_buffer():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        tree.create_buffer(specialize=True)
+        assert_equal(tree._buffer.__class__.__name__, 'SpecializedTreeBuffer')
+        for i, event in enumerate(tree):
+            assert_equal(event.i, i)
+            assert_equal(event.a_x, event['a_x'].value)
+            event.a_y = 2.
+            assert_almost_equal(event.a_y, 2.)
+        tree.read_branches_on_demand = True
+        for i, event in enumerate(tree):
+            assert_equal(event.i, i)
+
+
 @with_setup(create_tree, cleanup)
 def test_draw():
     with root_open(FILE_PATHS[0]) as f:
@@ -209,6 +225,503 @@ def test_chain_draw_hist_init_first():
     assert_equal(hist.Integral() > 0, True)
 
 
+@with_setup(create_tree, cleanup)
+def test_iterate():
+    try:
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        total = 0
+        buffers = set()
+        for chunk in tree.iterate(['a_x', 'i'], step_size=300):
+            assert_equal(list(chunk.keys()), ['a_x', 'i'])
+            assert_equal(chunk['i'][0], total)
+            total += len(chunk['i'])
+            buffers.add(chunk['i'].ctypes.data)
+        assert_equal(total, 1000)
+        # output arrays are reused between chunks
+        assert_equal(len(buffers), 1)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_iterate():
+    try:
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    chain = TreeChain('tree', FILE_PATHS)
+    total = 0
+    for chunk in chain.iterate('a_x', step_size=400):
+        total += len(chunk['a_x'])
+    assert_equal(total, 3000)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_random_access():
+    chain = TreeChain('tree', FILE_PATHS)
+    assert_equal(chain.offsets, [0, 1000, 2000, 3000])
+    assert_equal(chain[1500].i, 500)
+    assert_equal(chain[-1].i, 999)
+    assert_equal(chain[0].i, 0)
+    assert_raises(IndexError, chain.__getitem__, 3000)
+    ranges = chain.split(4)
+    assert_equal(ranges, [(0, 750), (750, 1500), (1500, 2250), (2250, 3000)])
+    try:
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    for start, stop in ranges:
+        entries = []
+        for chunk in chain.iterate('i', step_size=400, start=start, stop=stop):
+            entries.extend(chunk['i'].tolist())
+        assert_equal(entries, [entry % 1000 for entry in range(start, stop)])
+
+
+@with_setup(create_chain, cleanup)
+def test_book():
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        h1 = Hist(10, -1, 2)
+        h2 = Hist(10, -1, 2)
+        h3 = Hist2D(10, -1, 2, 10, -1, 2)
+        tree.book('a_x', 'a_y>0', h1)
+        tree.book('a_z', 'a_y>0', h2)
+        tree.book('a_x:a_y', '', h3)
+        hists = tree.run()
+        assert_equal(hists, [h1, h2, h3])
+        assert_equal(h1.GetEntries(), tree.GetEntries('a_y>0'))
+        assert_equal(h3.GetEntries(), 1000)
+        h4 = Hist(10, -1, 2)
+        tree.draw('a_x', 'a_y>0', hist=h4)
+        assert_almost_equal(h1.Integral(), h4.Integral())
+    chain = TreeChain('tree', FILE_PATHS)
+    hist = Hist(10, -1, 2)
+    chain.book('a_x', '', hist)
+    chain.run()
+    assert_equal(hist.GetEntries(), 3000)
+
+
+def test_book_arrays():
+    with TemporaryFile():
+        tree = Tree('test')
+        tree.create_branches({'x': 'F', 'v': 'F[3]'})
+        for i in range(10):
+            tree.x = i
+            tree.v[0] = 0
+            tree.v[1] = 1
+            tree.v[2] = 2
+            tree.fill()
+        # the scalar is repeated for each element of the array
+        hist = Hist2D(10, 0, 10, 3, 0, 3)
+        tree.book('x:v', 'x>4', hist)
+        tree.run()
+        hist_draw = Hist2D(10, 0, 10, 3, 0, 3)
+        tree.Draw('v:x', 'x>4', hist=hist_draw)
+        assert_equal(hist.GetEntries(), 15)
+        assert_equal(hist.GetEntries(), hist_draw.GetEntries())
+
+
+@with_setup(create_chain, cleanup)
+def test_yields():
+    cuts = ['a_y>0', 'a_x>0', '']
+    weights = ['a_x', '2']
+    with root_open(FILE_PATHS[0]) as f:
+        tree = f.tree
+        count, sumw, sumw2 = tree.yields(cuts, weights)
+        assert_equal(count.shape, (3,))
+        assert_equal(sumw.shape, (3, 2))
+        for i, cut in enumerate(cuts):
+            assert_equal(count[i], tree.GetEntries(cut))
+            assert_almost_equal(sumw[i, 1], 2 * count[i])
+            assert_almost_equal(sumw2[i, 1], 4 * count[i])
+            assert_almost_equal(
+                sumw[i, 0], tree.GetEntries(cut, weighted_cut='a_x'),
+                places=3)
+        count, sumw, sumw2 = tree.yields(cuts, cumulative=True)
+        assert_equal(count[1], tree.GetEntries('a_y>0&&a_x>0'))
+        assert_equal(count[2], count[1])
+        assert_equal(list(sumw[:, 0]), list(count))
+        # no branch is needed to evaluate the cuts and weights
+        count, sumw, sumw2 = tree.yields([''], ['2'])
+        assert_equal(count[0], 1000)
+        assert_almost_equal(sumw[0, 0], 2000)
+        # without branches the chunks only hold their number of entries
+        chunks = list(tree.iterate([], step_size=300))
+        assert_equal([chunk.n_entries for chunk in chunks],
+                     [300, 300, 300, 100])
+        assert_equal(list(chunks[0].keys()), [])
+    chain = TreeChain('tree', FILE_PATHS)
+    count, sumw, sumw2 = chain.yields([''])
+    assert_equal(count[0], 3000)
+    # the chain is closed after the first pass
+    count, sumw, sumw2 = chain.yields([''])
+    assert_equal(count[0], 3000)
+
+
+def _count_entries(chain):
+    return sum(1 for event in chain)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_map_reduce():
+    chain = TreeChain('tree', FILE_PATHS)
+    assert_equal(chain.map_reduce(_count_entries, workers=1), 3000)
+    assert_equal(chain.map_reduce(_count_entries, workers=3), 3000)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_prefetch():
+    chain = TreeChain('tree', FILE_PATHS, prefetch=2)
+    assert_equal(sum(1 for event in chain), 3000)
+    stats = chain.prefetch_stats
+    # all files after the first are read ahead
+    assert_equal(stats['files'], 2)
+    assert_equal(stats['hidden_time'] <= stats['prefetch_time'], True)
+    assert_equal(stats['wait_time'] <= stats['rollover_time'], True)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_branch_profile():
+    from rootpy.tree.branchprofile import BranchProfile
+    with TemporaryFile() as tmp:
+        path = tmp.GetName() + '.json'
+    profile = BranchProfile('test', 'tree', path=path)
+    try:
+        chain = TreeChain('tree', FILE_PATHS, read_branches_on_demand=True,
+                          branch_profile=profile)
+        for event in chain:
+            event.a_x
+        assert_equal(profile.branches, ['a_x'])
+        chain = TreeChain('tree', FILE_PATHS, read_branches_on_demand=True,
+                          branch_profile=profile)
+        assert_equal(chain._always_read, ['a_x'])
+        # the other trees in the profile are preserved
+        BranchProfile('test', 'other', path=path).save(['i'])
+        assert_equal(profile.branches, ['a_x'])
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+@with_setup(create_chain, cleanup)
+def test_selection_cache():
+    import shutil
+    import tempfile
+    from rootpy.tree.selectioncache import SelectionCache
+    path = tempfile.mkdtemp()
+    try:
+        cache = SelectionCache(path)
+        with root_open(FILE_PATHS[0]) as f:
+            tree = f.tree
+            expected = tree.GetEntries('a_x > 0')
+            tree.selection_cache = cache
+            assert_equal(tree.GetEntries('a_x > 0'), expected)
+            assert_equal(len(os.listdir(path)), 1)
+            # equivalent spellings share the cached entry list
+            assert_equal(tree.GetEntries('a_x>0'), expected)
+            assert_equal(len(os.listdir(path)), 1)
+            with TemporaryFile():
+                copy = tree.CopyTree('a_x>0')
+                assert_equal(copy.GetEntries(), expected)
+            hist = Hist(10, -1, 2)
+            tree.Draw('a_x', 'a_x>0', hist=hist)
+            assert_equal(hist.GetEntries(), expected)
+            assert_true(not tree.GetEntryList())
+        chain = TreeChain('tree', FILE_PATHS, selection='a_x>0',
+                          selection_cache=cache)
+        entries = 0
+        for event in chain:
+            assert_true(event.a_x > 0)
+            entries += 1
+        expected = 0
+        for path_ in FILE_PATHS:
+            with root_open(path_) as f:
+                expected += f.tree.GetEntries('a_x>0')
+        assert_equal(entries, expected)
+        assert_equal(len(os.listdir(path)), len(FILE_PATHS))
+        # the chunks of iterate only include the selected entries
+        entries = 0
+        for chunk in chain.iterate(['a_x'], step_size=300):
+            assert_true((chunk['a_x'] > 0).all())
+            entries += len(chunk['a_x'])
+        assert_equal(entries, expected)
+        try:
+            import root_numpy
+        except ImportError:
+            pass
+        else:
+            # collections are selected by entry
+            chain.define_collection('b', 'b_', 'b_n')
+            for chunk in chain.iterate(['a_x'], step_size=300,
+                                       collections=True):
+                assert_equal(len(chunk['b']), len(chunk['a_x']))
+                assert_equal(list(chunk['b'].counts), list(chunk['b_n']))
+        # an entry list set outside of a chain selection is not iterated
+        with root_open(FILE_PATHS[0]) as f:
+            tree = f.tree
+            tree.SetEntryList(cache.entry_list(tree, 'a_x>0'))
+            assert_equal(sum(1 for event in tree), tree.GetEntries())
+    finally:
+        shutil.rmtree(path)
+
+
+@with_setup(create_chain, cleanup)
+def test_column_cache():
+    try:
+        import numpy as np
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    import shutil
+    import tempfile
+    from rootpy.tree.columncache import ColumnCache
+    path = tempfile.mkdtemp()
+    try:
+        cache = ColumnCache(path)
+        chain = TreeChain('tree', FILE_PATHS, column_cache=cache)
+        expected = [dict((name, column.copy())
+                         for name, column in chunk.items())
+                    for chunk in chain.iterate(['a_x', 'i', 'b_x'],
+                                               step_size=300)]
+        # b_x is a variable-length branch and is not cached
+        assert_equal(len(os.listdir(path)), len(FILE_PATHS))
+        for directory in os.listdir(path):
+            assert_equal(sorted(os.listdir(os.path.join(path, directory))),
+                         ['a_x.npy', 'i.npy'])
+        for chunk, expected_chunk in zip(
+                chain.iterate(['a_x', 'i', 'b_x'], step_size=300),
+                expected):
+            assert_equal(list(chunk.keys()), ['a_x', 'i', 'b_x'])
+            assert_true(isinstance(chunk['a_x'], np.memmap))
+            assert_true(np.all(chunk['a_x'] == expected_chunk['a_x']))
+            assert_true(np.all(chunk['i'] == expected_chunk['i']))
+        # the least recently used columns are evicted
+        cache.max_size = cache.size() // 2
+        cache.evict()
+        assert_true(0 < cache.size() <= cache.max_size)
+    finally:
+        shutil.rmtree(path)
+
+
+@with_setup(create_chain, cleanup)
+def test_dataset_index():
+    from rootpy.tree.index import DatasetIndex
+    with TemporaryFile() as tmp:
+        path = tmp.GetName() + '.json'
+    try:
+        index = DatasetIndex(path, 'tree')
+        assert_equal(index.stale(FILE_PATHS), FILE_PATHS)
+        index.update(FILE_PATHS, workers=2)
+        assert_equal(index.stale(FILE_PATHS), [])
+        assert_equal(index.entries(FILE_PATHS), 1000 * len(FILE_PATHS))
+        record = DatasetIndex(path, 'tree')[FILE_PATHS[0]]
+        assert_equal(record['entries'], 1000)
+        assert_true('a_x' in record['branches'])
+        chain = TreeChain('tree', FILE_PATHS, index=path)
+        assert_equal(chain.GetEntries(), 1000 * len(FILE_PATHS))
+        assert_equal(sorted(index.plan(FILE_PATHS)), sorted(FILE_PATHS))
+        # modified files are reindexed
+        os.utime(FILE_PATHS[0], (0, 0))
+        assert_equal(index.stale(FILE_PATHS), FILE_PATHS[:1])
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+@with_setup(create_chain, cleanup)
+def test_queue_work_units():
+    import multiprocessing
+    from rootpy.tree import TreeQueue
+    from rootpy.tree.index import DatasetIndex
+    with TemporaryFile() as tmp:
+        path = tmp.GetName() + '.json'
+    try:
+        index = DatasetIndex(path, 'tree')
+        units = index.work_units(FILE_PATHS, workers=2, min_entries=100)
+        # the units cover all entries and shrink towards the end
+        sizes = [last - first for filename, first, last in units]
+        assert_equal(sum(sizes), 1000 * len(FILE_PATHS))
+        assert_equal(sizes[0], max(sizes))
+        assert_true(sizes[-1] < 2 * 100)
+        queue = multiprocessing.Queue()
+        for unit in units:
+            queue.put(unit)
+        queue.put(TreeQueue.SENTINEL)
+        entries = []
+        for event in TreeQueue('tree', queue):
+            entries.append(event.i)
+        assert_equal(sorted(entries),
+                     sorted(list(range(1000)) * len(FILE_PATHS)))
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_fill_categories():
+    try:
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    from rootpy.tree.categories import Categories
+    categories = Categories.from_string('{a_x|0,1}x{a_y|0}')
+    chain = TreeChain('tree', FILE_PATHS)
+    hists = chain.fill_categories(categories, 'a_z', Hist(10, -100, 100),
+                                  selection='i % 2 == 0')
+    assert_equal(len(hists), len(categories))
+    for hist, category in zip(hists, categories.walk()):
+        expected = 0
+        for path in FILE_PATHS:
+            with root_open(path) as f:
+                expected += f.tree.GetEntries(
+                    str(category & 'i % 2 == 0'))
+        assert_equal(hist.GetEntries(), expected)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_friend():
+    import shutil
+    import tempfile
+    from rootpy.tree.friend import Friend
+    path = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(path, 'friend.root')
+        with root_open(filename, 'recreate'):
+            friend = Tree('scores')
+            friend.create_branches({'i': 'I', 'score': 'F'})
+            # the friend is in reverse order and misses the odd entries
+            for i in reversed(range(0, 1000, 2)):
+                friend.i = i
+                friend.score = 2 * i
+                friend.fill()
+            friend.write()
+        chain = TreeChain('tree', FILE_PATHS)
+        scores = chain.add_friend(filename, 'scores', keys=['i'])
+        # the index is stored next to the friend file
+        assert_true(os.path.exists(scores.index_path))
+        assert_equal(os.path.dirname(scores.index_path), path)
+        entries = 0
+        for event in chain:
+            entries += 1
+            assert_equal(scores.matched, event.i % 2 == 0)
+            if scores.matched:
+                assert_almost_equal(event.score, 2 * event.i)
+            else:
+                assert_almost_equal(event.score, 0)
+        assert_equal(entries, 3000)
+        # random access reads the friend entry
+        chain[1002]
+        assert_true(scores.matched)
+        assert_almost_equal(chain.score, 4)
+        chain[1003]
+        assert_equal(scores.matched, False)
+        scores.close()
+
+        # a second friend loads the stored index
+        def build_index(self):
+            raise AssertionError("the stored index is not used")
+
+        build_index_orig = Friend.build_index
+        Friend.build_index = build_index
+        try:
+            chain = TreeChain('tree', FILE_PATHS,
+                              read_branches_on_demand=True)
+            # a friend may be added after the chain is closed
+            assert_equal(_count_entries(chain), 3000)
+            scores = chain.add_friend(filename, 'scores', keys=['i'],
+                                      prefix='friend_')
+        finally:
+            Friend.build_index = build_index_orig
+        entries = 0
+        for event in chain:
+            entries += 1
+            assert_equal(scores.matched, event.i % 2 == 0)
+            if scores.matched:
+                # friend branches are not read on demand from the chain
+                assert_almost_equal(event.friend_score, 2 * event.i)
+        assert_equal(entries, 3000)
+        scores.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def _odd_filters():
+    from rootpy.tree.filtering import EventFilter, EventFilterList
+
+    class Odd(EventFilter):
+        def passes(self, event):
+            return event.i % 2 == 1
+
+    return EventFilterList([Odd()])
+
+
+@with_setup(create_chain, cleanup)
+def test_skim():
+    import shutil
+    import tempfile
+    from rootpy.tree import skim
+    output_dir = tempfile.mkdtemp()
+    try:
+        chain = TreeChain('tree', FILE_PATHS)
+        expected = 0
+        for path in FILE_PATHS:
+            with root_open(path) as f:
+                expected += f.tree.GetEntries('a_x>0')
+        cutflow = skim(chain, 'a_x>0', ['a_*', 'i'], output_dir, workers=2)
+        assert_equal(cutflow.total, 3000)
+        assert_equal(cutflow.passing, expected)
+        assert_equal(len(os.listdir(output_dir)), len(FILE_PATHS))
+        with root_open(os.path.join(
+                output_dir, os.path.basename(FILE_PATHS[0]))) as f:
+            assert_true(f.tree.has_branch('a_x'))
+            assert_true(not f.tree.has_branch('b_x'))
+        shutil.rmtree(output_dir)
+        # python filters (entries are copied one by one) and merging
+        cutflow = skim(chain, branches=['i'], output_dir=output_dir,
+                       workers=1, merge=True, filters=_odd_filters)
+        assert_equal(cutflow.total, 3000)
+        assert_equal(cutflow.passing, 1500)
+        assert_equal(os.listdir(output_dir), ['skim.root'])
+        with root_open(os.path.join(output_dir, 'skim.root')) as f:
+            assert_equal(f.tree.GetEntries(), 1500)
+        # the inputs are never overwritten
+        assert_raises(ValueError, skim, chain, 'a_x>0',
+                      output_dir=os.path.dirname(FILE_PATHS[0]))
+        assert_raises(ValueError, skim, chain, merge=FILE_PATHS[0],
+                      output_dir=output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+@with_setup(create_chain, cleanup)
+def test_chain_timed_filters():
+    from rootpy.tree.filtering import (
+        EventFilter, EventFilterList, FilterList)
+
+    class Odd(EventFilter):
+        def passes(self, event):
+            return event.i % 2 == 1
+
+    filters = EventFilterList([Odd()], timed=True)
+    chain = TreeChain('tree', FILE_PATHS, filters=filters)
+    entries = sum(1 for event in chain)
+    assert_equal(filters[0].calls, filters[0].total)
+    assert_equal(filters.passing, entries)
+    assert_true(filters.time > 0)
+    assert_equal(len(chain.bytes_read), len(FILE_PATHS))
+    merged = filters.merge(filters, filters.basic())
+    assert_equal(merged[0].calls, 2 * filters[0].calls)
+    assert_equal(merged.timed, False)
+    chain.report()
+    # lists of filter states and lists pickled without the timed switch
+    basic = FilterList(filters.basic())
+    assert_almost_equal(basic.time, filters.time)
+    old = FilterList.__new__(FilterList)
+    assert_equal(old.timed, False)
+
+
 @raises(RuntimeError)
 def test_require_file_bad():
     t = Tree()
@@ -270,6 +783,49 @@ def test_csv():
         assert_equal(output.getvalue(), true_output)
 
 
+def test_csv_limit():
+    with TemporaryFile():
+        tree = Tree('test')
+        tree.create_branches({'i': 'I', 'v': 'F[2]'})
+        for i in range(20):
+            tree.i = i
+            tree.v[0] = i
+            tree.v[1] = -i
+            tree.fill()
+        output = StringIO()
+        tree.csv(stream=output, branches=['i', 'v'], limit=12)
+        lines = output.getvalue().splitlines()
+        assert_equal(lines[0], 'i,v[0],v[1]')
+        assert_equal(len(lines), 13)
+        assert_equal(lines[12], '11,11.0,-11.0')
+
+
+def test_to_npz():
+    try:
+        import numpy as np
+        import root_numpy
+    except ImportError:
+        raise SkipTest("root_numpy is not installed")
+    import tempfile
+    import shutil
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with TemporaryFile():
+            tree = Tree('test')
+            tree.create_branches({'x': 'F', 'i': 'I'})
+            for i in range(100):
+                tree.i = i
+                tree.x = gauss(0, 1)
+                tree.fill()
+            path = os.path.join(tmpdir, 'tree.npz')
+            tree.to_npz(path, step_size=7)
+            arrays = np.load(path)
+            assert_equal(sorted(arrays.files), ['i', 'x'])
+            assert_equal(list(arrays['i']), list(range(100)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_ntuple():
     with TemporaryFile():
         ntuple = Ntuple(('a', 'b', 'c'), name='test')
@@ -278,6 +834,136 @@ def test_ntuple():
         ntuple.Write()
 
 
+def test_fill_arrays():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    with TemporaryFile():
+        tree = Tree('test')
+        tree.create_branches({'x': 'F', 'i': 'I', 'v': 'D[3]'})
+        arrays = np.empty(1000, dtype=[
+            ('x', np.float32), ('i', np.int32), ('v', np.float64, (3,))])
+        arrays['x'] = np.random.normal(size=1000)
+        arrays['i'] = np.arange(1000)
+        arrays['v'] = np.random.normal(size=(1000, 3))
+        tree.fill_arrays(arrays)
+        tree.x = 5.
+        tree.fill()
+        assert_equal(tree.GetEntries(), 1001)
+        for i, event in enumerate(tree):
+            if i == 1000:
+                assert_almost_equal(event.x, 5.)
+                break
+            assert_equal(event.i, i)
+            assert_almost_equal(event.x, arrays['x'][i], places=5)
+            assert_almost_equal(event.v[2], arrays['v'][i, 2])
+        assert_raises(ValueError, tree.fill_arrays, {'y': np.zeros(3)})
+        ntuple = Ntuple(('a', 'b'), name='ntuple')
+        ntuple.fill_arrays({'a': np.arange(10.), 'b': np.ones(10)})
+        assert_equal(ntuple.GetEntries(), 10)
+        assert_equal(ntuple.GetEntries('a>4.5'), 5)
+
+
+def test_record_buffer():
+    from rootpy.tree.treetypes import FloatArrayCol
+
+    class Model(TreeModel):
+        x = FloatCol(default=-1.)
+        i = IntCol()
+        v = FloatArrayCol(3)
+
+    with TemporaryFile():
+        tree = Tree('test', model=Model, record=True)
+        # the specialized buffer keeps the methods of the RecordBuffer
+        tree._buffer.specialize()
+        assert_equal(tree._buffer.__class__.__name__,
+                     'SpecializedRecordBuffer')
+        record = tree._buffer.record
+        assert_equal(record['x'][0], -1.)
+        for i in range(10):
+            tree.x = i
+            tree.i = i
+            tree.v = [i, i, i]
+            # the values are stored in the record
+            assert_equal(record['i'][0], i)
+            assert_equal(list(record['v'][0]), [i, i, i])
+            tree.fill(reset=True)
+            assert_equal(record['x'][0], -1.)
+            assert_equal(tree.i, 0)
+        tree._buffer.reset()
+        for i, event in enumerate(tree):
+            assert_equal(event.i, i)
+            assert_almost_equal(event.x, i)
+            assert_equal(list(event.v), [i, i, i])
+            assert_equal(record['i'][0], i)
+
+
+def test_dirty_reset():
+    class Model(TreeModel):
+        x = FloatCol(default=-1.)
+        i = IntCol()
+        v = stl.vector('float')
+
+    with TemporaryFile():
+        tree = Tree('test', model=Model)
+        tree._buffer.track_dirty()
+        for i in range(10):
+            if i % 2:
+                tree.x = i
+            tree.i = i
+            tree.v.push_back(i)
+            tree.fill(reset=True)
+            assert_almost_equal(tree.x, -1.)
+            assert_equal(tree.i, 0)
+            assert_equal(tree.v.size(), 0)
+        # a missing name is not tracked
+        assert_raises(KeyError, tree._buffer.__getitem__, 'missing')
+        tree._buffer.reset()
+        tree._buffer.track_dirty(False)
+        for i, event in enumerate(tree):
+            assert_equal(event.i, i)
+            assert_almost_equal(event.x, i if i % 2 else -1.)
+            assert_equal(list(event.v), [i])
+
+
+def test_read_tree():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    from rootpy.tree.fastio import read_tree
+    with TemporaryFile():
+        tree = Tree('test')
+        tree.create_branches({'x': 'F', 'i': 'I', 'v': 'D[3]'})
+        arrays = np.empty(100, dtype=[
+            ('x', np.float32), ('i', np.int32), ('v', np.float64, (3,))])
+        arrays['x'] = np.random.normal(size=100)
+        arrays['i'] = np.arange(100)
+        arrays['v'] = np.random.normal(size=(100, 3))
+        tree.fill_arrays(arrays)
+        array = read_tree(tree)
+        assert_equal(sorted(array.dtype.names), ['i', 'v', 'x'])
+        assert_true(np.all(array['i'] == arrays['i']))
+        assert_true(np.all(array['x'] == arrays['x']))
+        assert_true(np.all(array['v'] == arrays['v']))
+        array = read_tree(tree, branches=['i'], selection='i % 3 == 0',
+                          start=10, stop=80, step=2)
+        assert_equal(list(array['i']), list(range(12, 80, 6)))
+        # branches of both the selection and the output keep their values
+        array = read_tree(tree, branches=['i', 'x'],
+                          selection='x > 0 && i % 2 == 0')
+        mask = (arrays['x'] > 0) & (arrays['i'] % 2 == 0)
+        assert_equal(list(array['i']), list(arrays['i'][mask]))
+        assert_true(np.all(array['x'] == arrays['x'][mask]))
+        array = read_tree(tree, branches=['x'], include_weight=True)
+        assert_true(np.all(array['weight'] == 1.))
+        # the tree buffer is still bound to the branches
+        for i, event in enumerate(tree):
+            assert_equal(event.i, i)
+        assert_raises(ValueError, read_tree, tree, branches=['y'])
+
+
 if __name__ == '__main__':
     import nose
     nose.runmodule()
@@ -5,6 +5,7 @@ from __future__ import absolute_import, print_function
 import sys
 import re
 import fnmatch
+from contextlib import contextmanager
 
 try:
     from collections import OrderedDict
@@ -26,6 +27,7 @@ from ..plotting.base import Plottable
 from ..plotting import Hist, Canvas
 from ..memory.keepalive import keepalive
 from .cut import Cut
+from .booking import Bookings, Chunk, compute_yields, yield_branches
 from .treebuffer import TreeBuffer
 from .treetypes import Scalar, Array, BaseChar
 from .model import TreeModel
@@ -61,9 +63,58 @@ class BaseTree(NamedObject):
         self._branch_cache = {}
         self._current_entry = 0
         self._always_read = []
+        self._bookings = Bookings()
+        # a SelectionCache of the entries passing selections
+        self.selection_cache = None
+        # the TEntryList of the entries passing the selection of a TreeChain
+        # from its selection cache: only these entries are iterated over
+        self._selection_entry_list = None
+        # a ColumnCache of the branches read with iterate
+        self.column_cache = None
+        # only iterate over the entries in [first, last) if not None
+        self.entry_range = None
         self.userdata = UserData()
         self._inited = True
 
+    def cached_entry_list(self, selection):
+        """
+        Return the TEntryList of the entries passing a selection from the
+        ``selection_cache`` of this tree (building and caching it if needed)
+        or None if this tree has no selection cache or the selection is empty
+        """
+        if self.selection_cache is None or not selection:
+            return None
+        return self.selection_cache.entry_list(self, selection)
+
+    @contextmanager
+    def _using_entry_list(self, elist):
+        previous = self.GetEntryList()
+        self.SetEntryList(elist)
+        try:
+            yield
+        finally:
+            self.SetEntryList(previous if previous else 0)
+
+    def _entry_numbers(self):
+        """
+        The entry numbers in the entry list of the selection of a TreeChain
+        if one is set, otherwise all entry numbers, within the
+        ``entry_range`` if one is set
+        """
+        first, last = 0, self.GetEntries()
+        if self.entry_range is not None:
+            first = max(first, self.entry_range[0])
+            last = min(last, self.entry_range[1])
+        elist = self._selection_entry_list
+        if elist:
+            for i in range(elist.GetN()):
+                entry = elist.GetEntry(i)
+                if first <= entry < last:
+                    yield entry
+        else:
+            for i in range(first, last):
+                yield i
+
     def always_read(self, branches):
         """
         Always read these branches, even when in caching mode. Maybe you have
@@ -107,9 +158,19 @@ class BaseTree(NamedObject):
         """
         return branch.GetNleaves() == 1
 
-    def create_buffer(self, ignore_unsupported=False):
+    def create_buffer(self, ignore_unsupported=False, specialize=False):
         """
         Create this tree's TreeBuffer
+
+        Parameters
+        ----------
+        ignore_unsupported : bool, optional (default=False)
+            If True then skip branches of unsupported types instead of raising
+            a TypeError.
+
+        specialize : bool, optional (default=False)
+            If True then generate a TreeBuffer class for this tree's branches
+            with faster attribute access (see ``TreeBuffer.specialize``).
         """
         bufferdict = OrderedDict()
         for branch in self.iterbranches():
@@ -124,6 +185,8 @@ class BaseTree(NamedObject):
         self.set_buffer(TreeBuffer(
             bufferdict,
             ignore_unsupported=ignore_unsupported))
+        if specialize:
+            self._buffer.specialize()
 
     def create_branches(self, branches):
         """
@@ -420,11 +483,12 @@ class BaseTree(NamedObject):
                 # add branches that we should always read to cache
                 self.AddBranchToCache(branch)
 
-            for i in range(self.GetEntries()):
+            for i in self._entry_numbers():
                 # Only increment current entry.
                 # getattr on a branch will then GetEntry on only that branch
                 # see ``TreeBuffer.get_with_read_if_cached``.
                 self._current_entry = i
+                self._buffer._current_entry = i
                 self.LoadTree(i)
                 for attr in self._always_read:
                     # Always read branched in ``self._always_read`` since
@@ -441,7 +505,7 @@ class BaseTree(NamedObject):
                 self._buffer.next_entry()
                 self._buffer.reset_collections()
         else:
-            for i in range(self.GetEntries()):
+            for i in self._entry_numbers():
                 # Read all activated branches (can be slow!).
                 super(BaseTree, self).GetEntry(i)
                 self._buffer._entry.set(i)
@@ -502,6 +566,105 @@ class BaseTree(NamedObject):
         """
         return not not self.GetBranch(branch)
 
+    def _export_branches(self, branches=None):
+        """
+        Return an OrderedDict mapping the names of the branches of basic types
+        (scalars, fixed-length arrays and strings) to their buffer values
+        """
+        supported_types = (Scalar, Array, stl.string)
+        if not self._buffer:
+            self.create_buffer(ignore_unsupported=True)
+        if branches is None:
+            branchdict = OrderedDict([
+                (name, self._buffer[name])
+                for name in self.iterbranchnames()
+                if isinstance(self._buffer[name], supported_types)])
+        else:
+            branchdict = OrderedDict()
+            for name in branches:
+                if not isinstance(self._buffer[name], supported_types):
+                    raise TypeError(
+                        "selected branch `{0}` "
+                        "is not a scalar or array type".format(name))
+                branchdict[name] = self._buffer[name]
+        if not branchdict:
+            raise RuntimeError(
+                "no branches selected or no "
+                "branches of scalar or array types exist")
+        return branchdict
+
+    def to_parquet(self, path, branches=None, step_size=100000,
+                   compression='snappy'):
+        """
+        Write the branches of basic types (scalars, fixed-length arrays and
+        strings) into a Parquet file, reading and writing one chunk of
+        entries at a time. Requires root_numpy and pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            The path of the output file.
+
+        branches : list, optional (default=None)
+            Only write these branches. If None, then all branches of basic
+            types are written.
+
+        step_size : int, optional (default=100000)
+            The number of entries in each chunk (and Parquet row group).
+
+        compression : str, optional (default='snappy')
+            The Parquet compression codec.
+        """
+        from .export import to_parquet
+        to_parquet(self, self._export_branches(branches), path,
+                   step_size=step_size, compression=compression)
+
+    def to_arrow(self, sink, branches=None, step_size=100000):
+        """
+        Write the branches of basic types as an Arrow IPC stream with one
+        record batch per chunk of entries. Requires root_numpy and pyarrow.
+
+        Parameters
+        ----------
+        sink : str or file-like
+            The path of the output file or a writable stream.
+
+        branches : list, optional (default=None)
+            Only write these branches. If None, then all branches of basic
+            types are written.
+
+        step_size : int, optional (default=100000)
+            The number of entries in each chunk (and record batch).
+        """
+        from .export import to_arrow
+        to_arrow(self, self._export_branches(branches), sink,
+                 step_size=step_size)
+
+    def to_npz(self, path, branches=None, step_size=100000, compressed=True):
+        """
+        Write the branches of basic types into a NumPy npz archive with one
+        array per branch, reading one chunk of entries at a time.
+        Requires root_numpy.
+
+        Parameters
+        ----------
+        path : str
+            The path of the output file.
+
+        branches : list, optional (default=None)
+            Only write these branches. If None, then all branches of basic
+            types are written.
+
+        step_size : int, optional (default=100000)
+            The number of entries in each chunk.
+
+        compressed : bool, optional (default=True)
+            If True then compress the arrays in the archive.
+        """
+        from .export import to_npz
+        to_npz(self, self._export_branches(branches), path,
+               self.GetEntries(), step_size=step_size, compressed=compressed)
+
     def csv(self, sep=',', branches=None,
             include_labels=True, limit=None,
             stream=None):
@@ -527,29 +690,17 @@ class BaseTree(NamedObject):
         stream : file, (default=None)
             Stream to write the CSV output on. By default the CSV will be
             written to ``sys.stdout``.
+
+        Notes
+        -----
+        If NumPy is installed then the entries are read in chunks with
+        ``iterate`` and written in blocks of lines. Without root_numpy, char
+        and string branches cannot be read in chunks and the entries are then
+        written one by one.
         """
-        supported_types = (Scalar, Array, stl.string)
         if stream is None:
             stream = sys.stdout
-        if not self._buffer:
-            self.create_buffer(ignore_unsupported=True)
-        if branches is None:
-            branchdict = OrderedDict([
-                (name, self._buffer[name])
-                for name in self.iterbranchnames()
-                if isinstance(self._buffer[name], supported_types)])
-        else:
-            branchdict = OrderedDict()
-            for name in branches:
-                if not isinstance(self._buffer[name], supported_types):
-                    raise TypeError(
-                        "selected branch `{0}` "
-                        "is not a scalar or array type".format(name))
-                branchdict[name] = self._buffer[name]
-        if not branchdict:
-            raise RuntimeError(
-                "no branches selected or no "
-                "branches of scalar or array types exist")
+        branchdict = self._export_branches(branches)
         if include_labels:
             # expand array types to f[0],f[1],f[2],...
             print(sep.join(
@@ -558,6 +709,23 @@ class BaseTree(NamedObject):
                                   for idx in range(len(value)))
                         for name, value in branchdict.items()),
                 file=stream)
+        try:
+            import numpy
+        except ImportError:
+            chunked = False
+        else:
+            try:
+                import root_numpy
+            except ImportError:
+                chunked = not any(
+                    isinstance(value, (BaseChar, stl.string))
+                    for value in branchdict.values())
+            else:
+                chunked = True
+        if chunked:
+            from .export import write_csv
+            write_csv(self, branchdict, stream, sep=sep, limit=limit)
+            return
         # even though 'entry' is not used, enumerate or simply iterating over
         # self is required to update the buffer with the new branch values at
         # each tree entry.
@@ -601,6 +769,11 @@ class BaseTree(NamedObject):
 
         weighted : bool, optional (default=False)
             Multiply the number of (weighted) entries by the Tree weight.
+
+        Notes
+        -----
+        If the tree has a ``selection_cache`` then the number of entries
+        passing ``cut`` is taken from the cached entry list.
         """
         if weighted_cut:
             hist = Hist(1, -1, 2)
@@ -612,7 +785,11 @@ class BaseTree(NamedObject):
             self.SetWeight(weight)
             entries = hist.Integral()
         elif cut:
-            entries = super(BaseTree, self).GetEntries(str(cut))
+            elist = self.cached_entry_list(cut)
+            if elist is not None:
+                entries = elist.GetN()
+            else:
+                entries = super(BaseTree, self).GetEntries(str(cut))
         else:
             entries = super(BaseTree, self).GetEntries()
         if weighted:
@@ -650,8 +827,14 @@ class BaseTree(NamedObject):
     def CopyTree(self, selection, *args, **kwargs):
         """
         Copy the tree while supporting a rootpy.tree.cut.Cut selection in
-        addition to a simple string.
+        addition to a simple string. If the tree has a ``selection_cache``
+        then only the cached entries passing the selection are copied without
+        evaluating the selection.
         """
+        elist = self.cached_entry_list(selection)
+        if elist is not None:
+            with self._using_entry_list(elist):
+                return super(BaseTree, self).CopyTree('', *args, **kwargs)
         return super(BaseTree, self).CopyTree(str(selection), *args, **kwargs)
 
     def reset_branch_values(self):
@@ -688,7 +871,10 @@ class BaseTree(NamedObject):
 
         selection : str or rootpy.tree.Cut, optional (default="")
             The cut expression. Only entries satisfying this selection are
-            included in the filled histogram.
+            included in the filled histogram. If the tree has a
+            ``selection_cache`` then only the cached entries passing the
+            selection are read. The selection is still evaluated on these
+            entries since it also acts as a weight.
 
         options : str, optional (default="")
             Draw options passed to ROOT.TTree.Draw
@@ -795,8 +981,14 @@ class BaseTree(NamedObject):
                 context = set_directory(hist)
             else:
                 context = do_nothing()
+            elist = self.cached_entry_list(selection)
+            if elist is not None:
+                context_elist = self._using_entry_list(elist)
+            else:
+                context_elist = do_nothing()
             with context:
-                super(BaseTree, self).Draw(expression, selection, options)
+                with context_elist:
+                    super(BaseTree, self).Draw(expression, selection, options)
 
         if hist is None:
             # Retrieve histogram made by TTree.Draw
@@ -837,13 +1029,215 @@ class BaseTree(NamedObject):
                 pad.Update()
         return hist
 
+    def book(self, expression, selection="", hist=None):
+        """
+        Book a histogram to be filled with an expression for all entries
+        passing a selection when ``run`` is called. All booked histograms are
+        filled in a single pass over the tree, reading each required branch
+        once and evaluating each distinct selection only once.
+
+        Parameters
+        ----------
+        expression : str
+            The expression to fill. Multidimensional expressions are separated
+            by ":" in the order of the histogram axes (as in ``Draw``).
+
+        selection : str or rootpy.tree.Cut, optional (default="")
+            The selection. As in ``Draw``, the value of the selection is used
+            as the weight of each entry.
+
+        hist : ROOT.TH1
+            The histogram to fill.
+        """
+        self._bookings.book(expression, selection, hist)
+
+    def run(self, step_size=100000):
+        """
+        Fill all histograms booked with ``book`` in a single pass over the
+        tree and return the list of filled histograms in the order they were
+        booked. The list of booked histograms is then cleared.
+        """
+        return self._bookings.run(
+            self.iterate(self._bookings.branches, step_size=step_size),
+            weight=self.GetWeight())
+
+    def yields(self, cuts, weights=None, cumulative=False, weighted=False,
+               step_size=100000):
+        """
+        Compute the number of entries, the sum of weights and the sum of
+        squared weights passing each cut for each weight expression in a
+        single pass over the tree. A cutflow with many rows and weight
+        systematics costs one read of the required branches instead of one
+        ``GetEntries`` call for each pair of cut and weight.
+
+        Parameters
+        ----------
+        cuts : list
+            The selections (str or Cut). An entry passes a cut if the value
+            of the cut is nonzero.
+
+        weights : list, optional (default=None)
+            The weight expressions (str or Cut). If None, then each entry has
+            a weight of one.
+
+        cumulative : bool, optional (default=False)
+            If True, then an entry passes a cut only if it also passes all
+            previous cuts, as in a cutflow.
+
+        weighted : bool, optional (default=False)
+            Multiply the weights by the Tree weight.
+
+        step_size : int, optional (default=100000)
+            The number of entries in each chunk read with ``iterate``.
+
+        Returns
+        -------
+        count, sumw, sumw2 : tuple of arrays
+            The number of entries passing each cut (of shape ``(n_cuts,)``)
+            and the sum of weights and squared weights of these entries for
+            each weight expression (of shape ``(n_cuts, n_weights)``).
+        """
+        return compute_yields(
+            self.iterate(yield_branches(cuts, weights),
+                         step_size=step_size),
+            cuts, weights, cumulative=cumulative,
+            weight=self.GetWeight() if weighted else 1.)
+
     def to_array(self, *args, **kwargs):
         """
-        Convert this tree into a NumPy structured array
+        Convert this tree into a NumPy structured array. If root_numpy is
+        not installed then ``rootpy.tree.fastio.read_tree`` is used, which
+        only reads branches of basic types and fixed-length arrays.
         """
-        from root_numpy import tree2array
+        try:
+            from root_numpy import tree2array
+        except ImportError:
+            from .fastio import read_tree as tree2array
         return tree2array(self, *args, **kwargs)
 
+    def iterate(self, branches=None, step_size=100000, out=None,
+                collections=False, start=0, stop=None):
+        """
+        Iterate over the Tree in contiguous chunks of entries, yielding a
+        ``Chunk`` (an ordered dict) mapping each branch name to a NumPy array
+        holding the values of that branch for all entries in the current
+        chunk. This allows per-entry Python loops to be replaced by vectorized
+        NumPy operations.
+
+        Parameters
+        ----------
+        branches : list, optional (default=None)
+            Only read these branches. If None, then all branches are read.
+            If empty, then no branches are read and the chunks only hold
+            their number of entries (``chunk.n_entries``).
+
+        step_size : int, optional (default=100000)
+            The maximum number of entries in each chunk.
+
+        out : dict, optional (default=None)
+            A dict holding the output arrays. The values of each chunk are
+            copied into these arrays so that every chunk is yielded in the
+            same memory. The same dict may be passed to the ``iterate``
+            method of other trees with the same branches to keep the arrays
+            across trees. Each chunk is still read into a new temporary
+            array (``tree2array`` allocates one per chunk) before the copy.
+
+        collections : bool, optional (default=False)
+            If True, then each chunk also maps the name of each collection
+            defined with ``define_collection`` to a
+            ``rootpy.tree.jagged.JaggedCollection`` of the variable-length
+            branches of that collection over all entries in the chunk.
+
+        start : int, optional (default=0)
+            The first entry to read.
+
+        stop : int, optional (default=None)
+            Stop before this entry. If None, then read until the last entry.
+
+        Notes
+        -----
+        The same arrays are reused for all chunks, so copy the arrays if their
+        contents are needed after advancing to the next chunk.
+
+        If this tree has a ``column_cache`` and ``branches`` are given, then
+        the columns of these branches are stored in the cache the first time
+        they are read and later chunks are read-only slices of the
+        memory-mapped cached columns.
+        """
+        import numpy as np
+        try:
+            from root_numpy import tree2array
+        except ImportError:
+            from .fastio import read_tree as tree2array
+        if step_size < 1:
+            raise ValueError("step_size must be at least 1")
+        if isinstance(branches, string_types):
+            branches = [branches]
+        if out is None:
+            out = {}
+        defined = []
+        if collections:
+            from .jagged import JaggedCollection
+            defined = list(self._buffer._collections.values())
+            if branches is not None:
+                branches = list(branches)
+                for name, prefix, size, mix in defined:
+                    for branch in self.glob(prefix + '*') + [size]:
+                        if branch not in branches:
+                            branches.append(branch)
+        total_entries = self.GetEntries()
+        if stop is None or stop > total_entries:
+            stop = total_entries
+        if branches is not None and not branches:
+            # only count the entries
+            for chunk_start in range(start, stop, step_size):
+                chunk = Chunk()
+                chunk.n_entries = min(step_size, stop - chunk_start)
+                yield chunk
+            return
+        cached = {}
+        order = None
+        if self.column_cache is not None and branches is not None:
+            cached = self.column_cache.columns(
+                self, branches,
+                lambda names, first, last: tree2array(
+                    self, branches=names, start=first, stop=last),
+                step_size=step_size)
+            order = list(branches)
+            branches = [name for name in branches if name not in cached]
+        for chunk_start in range(start, stop, step_size):
+            chunk_stop = min(chunk_start + step_size, stop)
+            n_entries = chunk_stop - chunk_start
+            columns = dict([
+                (name, column[chunk_start:chunk_stop])
+                for name, column in cached.items()])
+            if branches or not cached:
+                rec = tree2array(self, branches=branches,
+                                 start=chunk_start, stop=chunk_stop)
+                columns.update([(name, rec[name])
+                                for name in rec.dtype.names])
+            chunk = Chunk()
+            chunk.n_entries = n_entries
+            for name in order or rec.dtype.names:
+                column = columns[name]
+                if name in cached:
+                    # a read-only slice of the memory-mapped column
+                    chunk[name] = column
+                    continue
+                buf = out.get(name)
+                if (buf is None or len(buf) < n_entries or
+                        buf.dtype != column.dtype or
+                        buf.shape[1:] != column.shape[1:]):
+                    buf = np.empty((step_size,) + column.shape[1:],
+                                   dtype=column.dtype)
+                    out[name] = buf
+                buf[:n_entries] = column
+                chunk[name] = buf[:n_entries]
+            for name, prefix, size, mix in defined:
+                chunk[name] = JaggedCollection.from_columns(
+                    name, prefix, chunk, size=size)
+            yield chunk
+
 
 @snake_case_methods
 class Tree(BaseTree, QROOT.TTree):
@@ -862,17 +1256,30 @@ class Tree(BaseTree, QROOT.TTree):
 
     model : TreeModel, optional (default=None)
         If specified then this TreeModel will be used to create the branches
+
+    record : bool, optional (default=False)
+        If True then the values of the scalar and fixed-length array branches
+        of the model are stored in a single NumPy structured record (see
+        ``rootpy.tree.recordbuffer.RecordBuffer``). The branches point into
+        the record and resetting the buffer is a single copy of the defaults.
+        Requires NumPy.
     """
     _ROOT = QROOT.TTree
 
     @method_file_check
-    def __init__(self, name=None, title=None, model=None):
+    def __init__(self, name=None, title=None, model=None, record=False):
         super(Tree, self).__init__(name=name, title=title)
         self._buffer = TreeBuffer()
         if model is not None:
             if not issubclass(model, TreeModel):
                 raise TypeError("the model must subclass TreeModel")
-            self.set_buffer(model(), create_branches=True)
+            if record:
+                from .recordbuffer import RecordBuffer
+                self._buffer = RecordBuffer(model())
+                self.set_buffer(self._buffer, create_branches=True,
+                                visible=False)
+            else:
+                self.set_buffer(model(), create_branches=True)
         self._post_init()
 
     def Fill(self, reset=False):
@@ -890,6 +1297,29 @@ class Tree(BaseTree, QROOT.TTree):
         if reset:
             self._buffer.reset()
 
+    def fill_arrays(self, arrays):
+        """
+        Fill the Tree with many entries at once from NumPy arrays. The address
+        of each branch is pointed into the memory of the array with the same
+        name and advanced through it in a compiled loop, avoiding a Python
+        call per entry.
+
+        Parameters
+        ----------
+        arrays : dict or structured array
+            A dict mapping branch names to arrays or a NumPy structured array
+            with one field per branch. Array branches require arrays of shape
+            (n_entries, length). Branches without a matching array are filled
+            with the current values in the buffer.
+
+        Returns
+        -------
+        nbytes : int
+            The number of bytes written.
+        """
+        from .fastio import fill_tree
+        return fill_tree(self, arrays)
+
 
 @snake_case_methods
 class Ntuple(BaseTree, QROOT.TNtuple):
@@ -920,3 +1350,22 @@ class Ntuple(BaseTree, QROOT.TNtuple):
                                      name=name,
                                      title=title)
         self._post_init()
+
+    def fill_arrays(self, arrays):
+        """
+        Fill the Ntuple with many entries at once from NumPy arrays in a
+        compiled loop.
+
+        Parameters
+        ----------
+        arrays : dict or structured array
+            A dict mapping variable names to arrays or a NumPy structured
+            array with one field per variable.
+
+        Returns
+        -------
+        nbytes : int
+            The number of bytes written.
+        """
+        from .fastio import fill_ntuple
+        return fill_ntuple(self, arrays)
@@ -4,6 +4,8 @@ from __future__ import absolute_import
 
 import sys
 import re
+from array import array
+from functools import partial
 
 import ROOT
 
@@ -16,7 +18,9 @@ except ImportError: # py 2.6
 from . import log
 from .. import lookup_by_name, create, stl
 from ..base import Object
-from .treetypes import Scalar, Array, Int, Char, UChar, BaseCharArray
+from .treetypes import (
+    Scalar, Array, Int, Char, UChar,
+    BaseScalar, BaseCharArray)
 from .treeobject import TreeCollection, TreeObject, mix_classes
 
 
@@ -24,17 +28,53 @@ __all__ = [
     'TreeBuffer',
 ]
 
+# generated TreeBuffer subclasses keyed by the unspecialized class and the
+# buffer schema
+__SPECIALIZED__ = {}
+
+
+def _branch_property(name, kind):
+    """
+    Return a property that reads the value of branch ``name`` without going
+    through TreeBuffer.__getattr__
+    """
+    getitem = dict.__getitem__
+    if kind == 'scalar':
+        getvalue = array.__getitem__
+
+        def fget(self):
+            if self._tree is None:
+                return getvalue(getitem(self, name), 0)
+            return getvalue(self.get_with_read_if_cached(name), 0)
+    elif kind == 'value':
+        def fget(self):
+            if self._tree is None:
+                return getitem(self, name).value
+            return self.get_with_read_if_cached(name).value
+    else:
+        def fget(self):
+            if self._dirty is not None:
+                # the object may be modified in place
+                self._dirty.add(name)
+            if self._tree is None:
+                return getitem(self, name)
+            return self.get_with_read_if_cached(name)
+    return property(fget)
+
 
 class TreeBuffer(OrderedDict):
     """
     A dictionary mapping branch names to values
     """
     ARRAY_PATTERN = re.compile('^(?P<type>[^\[]+)\[(?P<length>\d+)\]$')
+    # attribute names of the branches with generated properties
+    _branch_properties = frozenset()
 
     def __init__(self,
                  branches=None,
                  tree=None,
-                 ignore_unsupported=False):
+                 ignore_unsupported=False,
+                 specialize=False):
         super(TreeBuffer, self).__init__()
         self._fixed_names = {}
         self._branch_cache = {}
@@ -45,9 +85,20 @@ class TreeBuffer(OrderedDict):
         self._collections = {}
         self._objects = []
         self._entry = Int(0)
+        self._specialized = False
+        # the reset action of each value, built when first needed
+        self._reset_plan = None
+        # the names of the values set since the last reset if tracking
+        self._dirty = None
+        # the collections as a tuple for reset_collections
+        self._collection_list = ()
+        # the names of the values that are not read from the tree
+        self._external = set()
         if branches is not None:
             self.__process(branches)
         self._inited = True
+        if specialize:
+            self.specialize()
 
     @classmethod
     def __clean(cls, branchname):
@@ -119,22 +170,74 @@ class TreeBuffer(OrderedDict):
             else:
                 self[name] = obj
 
+    @staticmethod
+    def _reset_action(value):
+        """
+        Return a callable resetting a value
+        """
+        if isinstance(value, (Scalar, Array)):
+            return value.reset
+        elif isinstance(value, Object):
+            return partial(value._ROOT.__init__, value)
+        elif isinstance(value, (ROOT.TObject, ROOT.ObjectProxy)):
+            return value.__init__
+        # there should be no other types of objects in the buffer
+        raise TypeError(
+            "cannot reset object of type `{0}`".format(type(value)))
+
+    @classmethod
+    def _reset_value(cls, value):
+        cls._reset_action(value)()
+
+    def _build_reset_plan(self):
+        """
+        Return an OrderedDict mapping the name of each value to the callable
+        resetting it. The plan is built once and rebuilt only after the
+        values in the buffer change.
+        """
+        plan = self._reset_plan
+        if plan is None:
+            plan = OrderedDict([
+                (name, self._reset_action(value))
+                for name, value in self.items()])
+            super(TreeBuffer, self).__setattr__('_reset_plan', plan)
+            super(TreeBuffer, self).__setattr__(
+                '_reset_actions', tuple(plan.values()))
+        return plan
+
     def reset(self):
-        if sys.version_info[0] < 3:
-            iter_values = self.itervalues()
+        """
+        Reset all values to their defaults. If dirty tracking is enabled
+        (see ``track_dirty``) then only the values set or accessed since the
+        last reset are reset.
+        """
+        plan = self._build_reset_plan()
+        dirty = self._dirty
+        if dirty is None:
+            for action in self._reset_actions:
+                action()
+            return
+        for name in dirty:
+            plan[name]()
+        dirty.clear()
+
+    def track_dirty(self, enable=True):
+        """
+        Enable or disable dirty tracking. When enabled, ``reset`` only resets
+        the values that were set with attribute or item assignment or that
+        were accessed as mutable objects (i.e. vectors that may have been
+        filled in place) since the last reset. This is faster for buffers of
+        many branches when only a few values are set for each entry. Values
+        modified through references obtained before the last reset are not
+        tracked.
+        """
+        if enable:
+            if self._dirty is None:
+                # values set before tracking started may not be defaults
+                super(TreeBuffer, self).__setattr__(
+                    '_dirty', set(self.keys()))
         else:
-            iter_values = self.values()
-        for value in iter_values:
-            if isinstance(value, (Scalar, Array)):
-                value.reset()
-            elif isinstance(value, Object):
-                value._ROOT.__init__(value)
-            elif isinstance(value, (ROOT.TObject, ROOT.ObjectProxy)):
-                value.__init__()
-            else:
-                # there should be no other types of objects in the buffer
-                raise TypeError(
-                    "cannot reset object of type `{0}`".format(type(value)))
+            super(TreeBuffer, self).__setattr__('_dirty', None)
 
     def update(self, branches=None):
         if branches is None:
@@ -144,9 +247,50 @@ class TreeBuffer(OrderedDict):
             self._entry = branches._entry
             for name, value in branches.items():
                 super(TreeBuffer, self).__setitem__(name, value)
+                if self._dirty is not None:
+                    self._dirty.add(name)
             self._fixed_names.update(branches._fixed_names)
+            super(TreeBuffer, self).__setattr__('_reset_plan', None)
         else:
             self.__process(branches)
+        if self._specialized:
+            self.specialize()
+
+    def specialize(self):
+        """
+        Switch the class of this buffer to a subclass of its class generated
+        for the current set of branches. Each branch is accessed through a
+        property that returns the branch value directly, bypassing the
+        generic ``__getattr__`` lookup. Reading branches on demand is still
+        supported. Branches added later are also specialized.
+        """
+        schema = []
+        reverse_names = dict([
+            (name, attr) for attr, name in self._fixed_names.items()])
+        for name, value in self.items():
+            if isinstance(value, BaseScalar):
+                kind = 'scalar'
+            elif isinstance(value, Scalar):
+                # char scalars and other scalars with a value property
+                kind = 'value'
+            else:
+                kind = 'other'
+            schema.append((reverse_names.get(name, name), name, kind))
+        schema = tuple(schema)
+        # specialize the class of this buffer (i.e. a RecordBuffer) and not
+        # any class it was already specialized into
+        base = getattr(type(self), '_unspecialized', type(self))
+        cls = __SPECIALIZED__.get((base, schema))
+        if cls is None:
+            attrs = dict([
+                (attr, _branch_property(name, kind))
+                for attr, name, kind in schema])
+            attrs['_branch_properties'] = frozenset(attrs.keys())
+            attrs['_unspecialized'] = base
+            cls = type('Specialized' + base.__name__, (base,), attrs)
+            __SPECIALIZED__[(base, schema)] = cls
+        object.__setattr__(self, '__class__', cls)
+        self._specialized = True
 
     def set_tree(self, tree=None):
         self._branch_cache = {}
@@ -158,8 +302,17 @@ class TreeBuffer(OrderedDict):
         super(TreeBuffer, self).__setattr__('_branch_cache_event', {})
         self._current_entry += 1
 
+    def add_external(self, name, value):
+        """
+        Add a value that is not read from the tree of this buffer (i.e. the
+        value of a branch of a friend tree) and is therefore never read on
+        demand
+        """
+        self[name] = value
+        self._external.add(name)
+
     def get_with_read_if_cached(self, attr):
-        if self._tree is not None:
+        if self._tree is not None and attr not in self._external:
             try:
                 branch = self._branch_cache[attr]
             except KeyError:
@@ -181,14 +334,30 @@ class TreeBuffer(OrderedDict):
     def __setitem__(self, name, value):
         # for a key to be used as an attr it must be a valid Python identifier
         fixed_name = TreeBuffer.__clean(name)
-        if fixed_name in dir(self) or fixed_name.startswith('_'):
+        if ((fixed_name in dir(self) and
+                fixed_name not in self._branch_properties) or
+                fixed_name.startswith('_')):
             raise ValueError("illegal branch name: `{0}`".format(name))
         if fixed_name != name:
             self._fixed_names[fixed_name] = name
         super(TreeBuffer, self).__setitem__(name, value)
+        # the reset plan must be rebuilt
+        super(TreeBuffer, self).__setattr__('_reset_plan', None)
+        if self._dirty is not None:
+            self._dirty.add(name)
+
+    def __delitem__(self, name):
+        super(TreeBuffer, self).__delitem__(name)
+        super(TreeBuffer, self).__setattr__('_reset_plan', None)
+        if self._dirty is not None:
+            self._dirty.discard(name)
 
     def __getitem__(self, name):
-        return self.get_with_read_if_cached(name)
+        value = self.get_with_read_if_cached(name)
+        if self._dirty is not None:
+            # the value may be modified in place
+            self._dirty.add(name)
+        return value
 
     def __setattr__(self, attr, value):
         """
@@ -201,6 +370,8 @@ class TreeBuffer(OrderedDict):
             return super(TreeBuffer, self).__setattr__(attr, value)
         elif attr in self:
             variable = self.get_with_read_if_cached(attr)
+            if self._dirty is not None:
+                self._dirty.add(attr)
             if isinstance(variable, (Scalar, Array)):
                 variable.set(value)
                 return
@@ -229,6 +400,9 @@ class TreeBuffer(OrderedDict):
             variable = self.get_with_read_if_cached(attr)
             if isinstance(variable, Scalar):
                 return variable.value
+            if self._dirty is not None:
+                # the object may be modified in place
+                self._dirty.add(attr)
             return variable
         except (KeyError, AttributeError):
             raise AttributeError(
@@ -236,17 +410,15 @@ class TreeBuffer(OrderedDict):
                     self.__class__.__name__, attr))
 
     def reset_collections(self):
-        if sys.version_info[0] < 3:
-            for coll in self._collections.iterkeys():
-                coll.reset()
-        else:
-            for coll in self._collections.keys():
-                coll.reset()
+        for coll in self._collection_list:
+            coll.reset()
 
     def define_collection(self, name, prefix, size, mix=None):
         coll = TreeCollection(self, name, prefix, size, mix=mix)
         object.__setattr__(self, name, coll)
         self._collections[coll] = (name, prefix, size, mix)
+        object.__setattr__(
+            self, '_collection_list', tuple(self._collections.keys()))
         return coll
 
     def define_object(self, name, prefix, mix=None):